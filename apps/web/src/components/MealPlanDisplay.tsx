@@ -23,7 +23,7 @@ type Day = {
   labels?: string[];
 };
 
-type GroceryCategory = { category: string; items: string[] };
+type GroceryCategory = { category: string; items: string[]; quantities?: Record<string, string> };
 
 type PlanData = {
   plan: Day[];
@@ -248,6 +248,7 @@ export default function MealPlanPremium({ data, onClose }: { data: any, onClose?
                       <span className="checkmark"></span>
                     </div>
                     <span className="item-name">{item}</span>
+                    {cat.quantities?.[item] && <span className="item-quantity">{cat.quantities[item]}</span>}
                   </div>
                 ))}
               </div>
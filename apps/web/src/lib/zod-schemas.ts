@@ -58,6 +58,7 @@ export const mealPlanResponseSchema = z.object({
   groceries: z.array(z.object({
     category: z.string(),
     items: z.array(z.string()),
+    quantities: z.record(z.string()).optional(),
   })),
 })
 
@@ -0,0 +1,324 @@
+"""
+Local stand-in for the OpenAI chat completions API, so throughput can be
+measured without spending tokens.
+
+It answers the prompts of main.py, worker.main and simple_main.py with
+well-formed plans, "meals" or "meal" objects of the requested size, after a
+simulated delay: time to first token from a latency distribution plus the
+completion length at a fixed token rate. Configurable fractions of responses
+are malformed, have the wrong meal count or fail with 429/500.
+
+    python -m benchmarks.fake_llm --port 9100 --latency lognormal:0.8,0.4 --tokens-per-second 120
+
+Point an app at it with OPENAI_BASE_URL=http://127.0.0.1:9100/v1.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, List, NamedTuple, Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+MALFORMED_KINDS = ("fence", "trailing_comma", "truncate", "prose")
+
+SLOTS = {
+    3: ["breakfast", "lunch", "dinner"],
+    4: ["breakfast", "lunch", "dinner", "snack"],
+    5: ["breakfast", "lunch", "dinner", "afternoon snack", "evening snack"],
+    6: ["breakfast", "snack", "lunch", "snack", "dinner", "snack"],
+}
+
+DISHES = {
+    "breakfast": [
+        ("Greek Yogurt Parfait", [("Greek yogurt", "200g"), ("Mixed berries", "80g"), ("Granola", "30g")]),
+        ("Veggie Omelette", [("Eggs", "3"), ("Spinach", "1 cup"), ("Bell pepper", "1/2"), ("Olive oil", "1 tsp")]),
+        ("Overnight Oats", [("Rolled oats", "60g"), ("Milk", "200ml"), ("Chia seeds", "1 tbsp"), ("Banana", "1")]),
+        ("Avocado Toast", [("Whole wheat bread", "2 slices"), ("Avocado", "1/2"), ("Eggs", "2")]),
+    ],
+    "lunch": [
+        ("Grilled Chicken Salad", [("Chicken breast", "150g"), ("Mixed greens", "100g"), ("Cherry tomatoes", "80g"), ("Olive oil", "1 tbsp")]),
+        ("Quinoa Power Bowl", [("Quinoa", "80g"), ("Chickpeas", "100g"), ("Cucumber", "1/2"), ("Feta cheese", "30g")]),
+        ("Turkey Wrap", [("Whole wheat tortilla", "1"), ("Turkey breast", "120g"), ("Lettuce", "2 leaves"), ("Hummus", "2 tbsp")]),
+        ("Lentil Soup", [("Red lentils", "90g"), ("Carrot", "1"), ("Onion", "1/2"), ("Vegetable broth", "400ml")]),
+    ],
+    "dinner": [
+        ("Baked Salmon with Rice", [("Salmon fillet", "150g"), ("Brown rice", "75g"), ("Broccoli", "150g")]),
+        ("Beef Stir-Fry", [("Lean beef", "150g"), ("Bell pepper", "1"), ("Soy sauce", "1 tbsp"), ("Rice", "75g")]),
+        ("Chicken Curry", [("Chicken thighs", "160g"), ("Coconut milk", "100ml"), ("Curry powder", "1 tbsp"), ("Basmati rice", "75g")]),
+        ("Shrimp Pasta", [("Shrimp", "150g"), ("Whole wheat pasta", "85g"), ("Garlic", "2 cloves"), ("Parmesan", "20g")]),
+    ],
+    "snack": [
+        ("Apple with Almond Butter", [("Apple", "1"), ("Almond butter", "1 tbsp")]),
+        ("Hummus and Carrots", [("Hummus", "3 tbsp"), ("Carrot", "2")]),
+        ("Trail Mix", [("Almonds", "20g"), ("Raisins", "15g"), ("Dark chocolate", "10g")]),
+        ("Cottage Cheese Cup", [("Cottage cheese", "150g"), ("Pineapple", "60g")]),
+    ],
+}
+
+CUISINES = ["Mediterranean", "Mexican", "Japanese", "Indian", "Italian", "Thai", "Korean"]
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    A sampler for time to first token, in seconds, from a spec:
+    ``fixed:0.5``, ``uniform:0.2,1.5``, ``exponential:0.8`` (mean) or
+    ``lognormal:0.8,0.4`` (median, sigma).
+    """
+    kind, _, raw = spec.partition(":")
+    values = [float(value) for value in raw.split(",") if value]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "exponential":
+        return lambda rng: rng.expovariate(1 / values[0])
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+@dataclass
+class FakeLLMConfig:
+    latency: str = "lognormal:0.8,0.4"
+    tokens_per_second: float = 120.0
+    malformed_rate: float = 0.0
+    malformed_kinds: List[str] = field(default_factory=lambda: ["fence", "trailing_comma", "truncate"])
+    wrong_count_rate: float = 0.0
+    error_rate: float = 0.0
+    seed: Optional[int] = None
+
+class RequestShape(NamedTuple):
+    kind: str  # "plan", "meals" or "meal"
+    days: List[int]
+    meals_per_day: int
+    count: int
+    calorie_target: int
+
+def _search_int(patterns: List[str], text: str, default: int) -> int:
+    for pattern in patterns:
+        match = re.search(pattern, text)
+        if match:
+            return int(match.group(1))
+    return default
+
+def describe_request(messages: List[Dict[str, Any]]) -> RequestShape:
+    """Work out from the prompt what the caller expects back, for all three apps' prompts."""
+    text = "\n".join(str(message.get("content", "")) for message in messages)
+    meals_per_day = _search_int([r"EXACTLY (\d+), in this order", r'"meals_per_day":\s*(\d+)', r"(\d+) meals\)"], text, 3)
+    calorie_target = _search_int([r"Target calories: (\d+)", r'"calorie_target":\s*(\d+)', r"\((\d+) kcal/day"], text, 2000)
+
+    if re.search(r'Replace the [^"]*"', text):
+        return RequestShape("meal", [1], meals_per_day, 1, calorie_target)
+    missing = re.search(r"Create exactly (\d+) (?:additional )?meal\(s\)", text)
+    if missing:
+        return RequestShape("meals", [1], meals_per_day, int(missing.group(1)), calorie_target)
+
+    listed = re.search(r"Create days ([\d, ]+) of", text)
+    if listed:
+        days = [int(day) for day in listed.group(1).split(",")]
+    else:
+        # main.py and simple_main.py ask for one day; worker.main's single-call path for the week
+        days = list(range(1, _search_int([r'"timeframe_days":\s*(\d+)', r"Create a (\d+)-day", r"(7)-day meal plan"], text, 1) + 1))
+    return RequestShape("plan", days, meals_per_day, meals_per_day, calorie_target)
+
+def make_meal(rng: random.Random, slot: str, kcal: int) -> Dict[str, Any]:
+    dish, ingredients = rng.choice(DISHES["snack" if "snack" in slot else slot])
+    return {
+        "name": f"{slot.title()}: {rng.choice(CUISINES)} {dish}",
+        "kcal": kcal,
+        "protein_g": round(kcal * 0.3 / 4, 1),
+        "carbs_g": round(kcal * 0.4 / 4, 1),
+        "fat_g": round(kcal * 0.3 / 9, 1),
+        "ingredients": [{"item": item, "qty": qty} for item, qty in ingredients],
+        "steps": ["Prepare the ingredients", f"Cook the {dish.lower()}", "Serve"],
+    }
+
+def make_content(rng: random.Random, shape: RequestShape, wrong_count: bool) -> Dict[str, Any]:
+    """A response body matching ``shape``; with ``wrong_count`` one day (or the meal list) is a meal short or long."""
+    slots = SLOTS.get(shape.meals_per_day, ["meal"] * shape.meals_per_day)
+    kcal = max(100, shape.calorie_target // max(shape.meals_per_day, 1))
+    if shape.kind == "meal":
+        return {"meal": make_meal(rng, "dinner", kcal)}
+    if shape.kind == "meals":
+        count = shape.count + (rng.choice([-1, 1]) if wrong_count and shape.count > 1 else 0)
+        return {"meals": [make_meal(rng, slots[index % len(slots)], kcal) for index in range(count)]}
+
+    plan = [{"day": day, "meals": [make_meal(rng, slot, kcal) for slot in slots]} for day in shape.days]
+    if wrong_count:
+        meals = rng.choice(plan)["meals"]
+        if len(meals) > 1 and rng.random() < 0.7:
+            meals.pop()
+        else:
+            meals.append(make_meal(rng, "snack", kcal))
+    daily = kcal * shape.meals_per_day
+    return {
+        "plan": plan,
+        "totals": {"kcal": daily, "protein_g": round(daily * 0.3 / 4, 1), "carbs_g": round(daily * 0.4 / 4, 1), "fat_g": round(daily * 0.3 / 9, 1)},
+        "groceries": [{"category": "Proteins", "items": ["Chicken breast", "Eggs"]}, {"category": "Grains", "items": ["Rice"]}],
+    }
+
+def malform(rng: random.Random, content: str, kind: str) -> str:
+    """Damage a JSON response the way models do: fenced, trailing comma, cut off, or not JSON at all."""
+    if kind == "fence":
+        return f"Here is your plan:\n```json\n{content}\n```"
+    if kind == "trailing_comma":
+        return content[:-1] + ",}"
+    if kind == "truncate":
+        return content[: int(len(content) * rng.uniform(0.6, 0.95))]
+    return "I'm sorry, I can't produce a meal plan right now."
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+def create_app(config: FakeLLMConfig) -> FastAPI:
+    app = FastAPI(title="Fake chat completions")
+    rng = random.Random(config.seed)
+    sample_latency = parse_latency(config.latency)
+    stats: Dict[str, Any] = {}
+
+    def reset() -> None:
+        stats.clear()
+        stats.update({
+            "requests": 0, "plan": 0, "meals": 0, "meal": 0, "stream": 0,
+            "errors": 0, "malformed": 0, "wrong_count": 0,
+            "prompt_tokens": 0, "completion_tokens": 0,
+            "in_flight": 0, "max_in_flight": 0,
+        })
+
+    reset()
+
+    def usage(prompt_tokens: int, completion_tokens: int) -> Dict[str, Any]:
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": 0},
+        }
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "gpt-4o", "object": "model", "owned_by": "fake"}]}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.post("/stats/reset")
+    async def reset_stats():
+        reset()
+        return stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages", [])
+        model = body.get("model", "gpt-4o")
+        stats["requests"] += 1
+
+        if rng.random() < config.error_rate:
+            stats["errors"] += 1
+            status = rng.choice([429, 500])
+            return JSONResponse(
+                {"error": {"message": f"Fake upstream error {status}", "type": "server_error" if status == 500 else "rate_limit_error", "code": None}},
+                status_code=status,
+                headers={"retry-after": "1"} if status == 429 else None,
+            )
+
+        shape = describe_request(messages)
+        stats[shape.kind] += 1
+        wrong_count = rng.random() < config.wrong_count_rate
+        stats["wrong_count"] += wrong_count
+        content = json.dumps(make_content(rng, shape, wrong_count))
+        if config.malformed_kinds and rng.random() < config.malformed_rate:
+            stats["malformed"] += 1
+            content = malform(rng, content, rng.choice(config.malformed_kinds))
+
+        prompt_tokens = count_tokens("".join(str(message.get("content", "")) for message in messages))
+        completion_tokens = count_tokens(content)
+        stats["prompt_tokens"] += prompt_tokens
+        stats["completion_tokens"] += completion_tokens
+        first_token = sample_latency(rng)
+        generation = completion_tokens / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+        completion_id = f"chatcmpl-fake-{stats['requests']}"
+
+        if body.get("stream"):
+            stats["stream"] += 1
+            include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+            async def chunks() -> AsyncIterator[str]:
+                stats["in_flight"] += 1
+                stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+                try:
+                    await asyncio.sleep(first_token)
+                    pieces = [content[start:start + 64] for start in range(0, len(content), 64)]
+                    for piece in pieces:
+                        chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                                 "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                        yield f"data: {json.dumps(chunk)}\n\n"
+                        await asyncio.sleep(generation / len(pieces))
+                    final = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                             "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+                    yield f"data: {json.dumps(final)}\n\n"
+                    if include_usage:
+                        usage_chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                                       "choices": [], "usage": usage(prompt_tokens, completion_tokens)}
+                        yield f"data: {json.dumps(usage_chunk)}\n\n"
+                    yield "data: [DONE]\n\n"
+                finally:
+                    stats["in_flight"] -= 1
+
+            return StreamingResponse(chunks(), media_type="text/event-stream")
+
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            await asyncio.sleep(first_token + generation)
+        finally:
+            stats["in_flight"] -= 1
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage(prompt_tokens, completion_tokens),
+        }
+
+    return app
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Fake upstream options, shared with the benchmark runner."""
+    parser.add_argument("--latency", default="lognormal:0.8,0.4", help="time to first token: fixed:S, uniform:A,B, exponential:MEAN or lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--tokens-per-second", type=float, default=120.0, help="completion token rate; 0 returns instantly after the first token")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="fraction of responses with broken JSON")
+    parser.add_argument("--malformed-kinds", default="fence,trailing_comma,truncate", help=f"comma-separated subset of {','.join(MALFORMED_KINDS)}")
+    parser.add_argument("--wrong-count-rate", type=float, default=0.0, help="fraction of responses with a meal too few or too many")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls failing with 429 or 500")
+    parser.add_argument("--seed", type=int, default=None)
+
+def config_from_args(args: argparse.Namespace) -> FakeLLMConfig:
+    return FakeLLMConfig(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        malformed_rate=args.malformed_rate,
+        malformed_kinds=[kind for kind in args.malformed_kinds.split(",") if kind],
+        wrong_count_rate=args.wrong_count_rate,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
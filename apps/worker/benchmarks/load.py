@@ -0,0 +1,167 @@
+"""
+Closed-loop load driver for the generate endpoints.
+
+``concurrency`` clients each send their next request as soon as the previous
+one returns, until ``requests`` have completed. Reports throughput, latency
+percentiles, errors and retry amplification: upstream calls per request
+(from the fake server's /stats) and generation retries per request (from
+the app's /metrics, where it has one).
+
+    python -m benchmarks.load --app worker --url http://127.0.0.1:8000 --fake-url http://127.0.0.1:9100 -c 16 -n 200
+"""
+import argparse
+import asyncio
+import json
+import re
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+import httpx
+
+class AppTarget(NamedTuple):
+    module: str  # ASGI app for gunicorn/uvicorn
+    generate_path: str
+    health_path: str
+    wrap_preferences: bool  # worker.main takes {"preferences": {...}}
+    has_metrics: bool
+
+APPS: Dict[str, AppTarget] = {
+    "main": AppTarget("main:app", "/generate", "/health", False, True),
+    "worker": AppTarget("worker.main:app", "/generate/", "/health/", True, True),
+    "simple": AppTarget("simple_main:app", "/generate", "/health", False, False),
+}
+
+RETRIES_SERIES = "wellplate_generation_retries_total"
+
+def make_profile(index: int, meals_per_day: int = 3) -> Dict[str, Any]:
+    """A profile all three apps accept; the weight varies so requests do not share a cache key."""
+    return {
+        "age": 25 + index % 40,
+        "weightKg": 55.0 + index % 50,
+        "heightCm": 170,
+        "sex": "female" if index % 2 else "male",
+        "goal": "maintain",
+        "dietType": "omnivore",
+        "allergies": [],
+        "dislikes": [],
+        "cookingEffort": "quick",
+        "caloriesTarget": 2000,
+        "mealsPerDay": meals_per_day,
+    }
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile; 0.0 for no values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+def parse_counter(text: str, series: str) -> float:
+    """Sum of every sample of ``series`` in a Prometheus text exposition."""
+    pattern = re.compile(rf"^{re.escape(series)}(?:{{[^}}]*}})? (\S+)$", re.MULTILINE)
+    return sum(float(value) for value in pattern.findall(text))
+
+async def _upstream_calls(client: httpx.AsyncClient, fake_url: Optional[str]) -> Optional[float]:
+    if not fake_url:
+        return None
+    response = await client.get(f"{fake_url}/stats")
+    return float(response.json()["requests"])
+
+async def _retries(client: httpx.AsyncClient, base_url: str, target: AppTarget) -> Optional[float]:
+    if not target.has_metrics:
+        return None
+    response = await client.get(f"{base_url}/metrics")
+    return parse_counter(response.text, RETRIES_SERIES)
+
+async def run_load(
+    app: str,
+    base_url: str,
+    concurrency: int,
+    requests: int,
+    fake_url: Optional[str] = None,
+    regenerate: bool = True,
+    meals_per_day: int = 3,
+    timeout: float = 300.0,
+    metrics_settle_seconds: float = 0.0,
+) -> Dict[str, Any]:
+    """
+    Drive ``requests`` generations through ``concurrency`` clients and summarize them.
+    ``regenerate`` bypasses the plan cache so every request reaches the model.
+    ``metrics_settle_seconds`` waits for the app's workers to flush their metrics
+    before the final scrape.
+    """
+    target = APPS[app]
+    params = {"regenerate": "true"} if regenerate and app != "simple" else {}
+    limits = httpx.Limits(max_connections=concurrency + 4, max_keepalive_connections=concurrency + 4)
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    issued = 0
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        upstream_before = await _upstream_calls(client, fake_url)
+        retries_before = await _retries(client, base_url, target)
+
+        async def worker() -> None:
+            nonlocal issued
+            while issued < requests:
+                index = issued
+                issued += 1
+                profile = make_profile(index, meals_per_day)
+                body = {"preferences": profile} if target.wrap_preferences else profile
+                started = time.perf_counter()
+                try:
+                    response = await client.post(f"{base_url}{target.generate_path}", params=params, json=body)
+                    outcome = None if response.status_code == 200 else str(response.status_code)
+                except httpx.HTTPError as e:
+                    outcome = type(e).__name__
+                latencies.append(time.perf_counter() - started)
+                if outcome:
+                    errors[outcome] = errors.get(outcome, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+        if metrics_settle_seconds:
+            await asyncio.sleep(metrics_settle_seconds)
+        upstream_after = await _upstream_calls(client, fake_url)
+        retries_after = await _retries(client, base_url, target)
+
+    result = {
+        "app": app,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": sum(errors.values()),
+        "error_kinds": errors,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "upstream_calls_per_request": None,
+        "retries_per_request": None,
+    }
+    if upstream_before is not None and upstream_after is not None and latencies:
+        result["upstream_calls_per_request"] = round((upstream_after - upstream_before) / len(latencies), 3)
+    if retries_before is not None and retries_after is not None and latencies:
+        result["retries_per_request"] = round((retries_after - retries_before) / len(latencies), 3)
+    return result
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=sorted(APPS), required=True)
+    parser.add_argument("--url", required=True, help="base URL of the running app")
+    parser.add_argument("--fake-url", help="base URL of the fake upstream, to count upstream calls")
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument("-n", "--requests", type=int, default=100)
+    parser.add_argument("--meals-per-day", type=int, default=3)
+    parser.add_argument("--cached", action="store_true", help="let repeated profiles hit the plan cache")
+    args = parser.parse_args()
+    result = asyncio.run(run_load(
+        args.app, args.url.rstrip("/"), args.concurrency, args.requests,
+        fake_url=args.fake_url, regenerate=not args.cached, meals_per_day=args.meals_per_day,
+    ))
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+"""
+Micro-benchmark and regression corpus for the response post-processing stages
+that run on every completion: JSON parsing with repairs (main.soft_json_parse
+and OpenAIClient._parse_content), main.sanitize_meal_plan and
+OpenAIClient._validate_and_clean_response.
+
+The corpus in benchmarks/corpus holds model outputs at four sizes (1 day and
+7 days, 3 and 6 meals per day), each clean and damaged the ways models damage
+them: fenced, trailing commas, truncated, another schema, a meal short. The
+manifest records what every stage returns for every case, so a behaviour
+change fails the check as well as a slowdown.
+
+    python -m benchmarks.postprocess                   # check outcomes, time, compare to the baseline
+    python -m benchmarks.postprocess --update-baseline # record this machine's timings as the baseline
+    python -m benchmarks.postprocess --write-corpus    # regenerate the corpus and its expected outcomes
+
+Timings are per call, the best of several repeats; allocations are the peak
+traced memory of one call. Baselines are machine-specific: record them on the
+machine that runs the comparison.
+"""
+import argparse
+import copy
+import gc
+import json
+import math
+import os
+import platform
+import random
+import re
+import sys
+import tracemalloc
+from time import perf_counter
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+# The apps read their settings at import; keep stage logging and metrics out of the numbers
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+os.environ.setdefault("METRICS_ENABLED", "false")
+
+from benchmarks.fake_llm import RequestShape, make_content  # noqa: E402
+from worker.schemas import MealPreference  # noqa: E402
+from worker.services.json_stream import parse_json_with_repairs  # noqa: E402
+from worker.services.metrics import Metrics  # noqa: E402
+from worker.services.openai_client import OpenAIClient  # noqa: E402
+from worker.services.plan_defects import PlanValidationError  # noqa: E402
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_DIR = os.path.join(BENCHMARK_DIR, "corpus")
+MANIFEST_PATH = os.path.join(CORPUS_DIR, "manifest.json")
+BASELINE_PATH = os.path.join(BENCHMARK_DIR, "baselines", "postprocess.json")
+
+CORPUS_SEED = 2024
+
+# size -> (days, meals per day)
+SIZES = {
+    "1day": (1, 3),
+    "7day": (7, 3),
+    "1day_6meals": (1, 6),
+    "7day_6meals": (7, 6),
+}
+
+CASES = ("clean", "fenced", "trailing_comma", "truncated", "wrong_schema", "wrong_count")
+
+# Differences below these are noise, whatever the ratio
+MIN_TIME_DELTA_US = 2.0
+MIN_ALLOC_DELTA_KIB = 1.0
+
+class Case(NamedTuple):
+    name: str
+    size: str
+    text: str
+
+def _other_schema(content: Dict[str, Any]) -> Dict[str, Any]:
+    """The older shape models still drift into: meal_plan, comma-joined ingredients, prose instructions, no totals."""
+    days = []
+    for day in content["plan"]:
+        meals = [
+            {
+                "name": meal["name"],
+                "kcal": str(meal["kcal"]),
+                "ingredients": ", ".join(ingredient["item"] for ingredient in meal["ingredients"]),
+                "instructions": ". ".join(meal["steps"]) + ".",
+            }
+            for meal in day["meals"]
+        ]
+        days.append({"day": str(day["day"]), "meals": meals})
+    return {"meal_plan": days, "totalCalories": content["totals"]["kcal"], "macronutrients": {"protein": 120.0}}
+
+def build_case(size: str, case: str) -> Case:
+    """One corpus entry; deterministic for a given size and case."""
+    days, meals_per_day = SIZES[size]
+    rng = random.Random(f"{CORPUS_SEED}:{size}:{case}")
+    shape = RequestShape("plan", list(range(1, days + 1)), meals_per_day, meals_per_day, 2000)
+    content = make_content(rng, shape, wrong_count=case == "wrong_count")
+    if case == "wrong_schema":
+        content = _other_schema(content)
+    text = json.dumps(content, indent=2)
+
+    if case == "fenced":
+        text = f"Here is your personalized meal plan:\n\n```json\n{text}\n```\n\nEnjoy your meals!"
+    elif case == "trailing_comma":
+        text = re.sub(r"(\}|\]|\"|\d)(\n\s*[\]\}])", r"\1,\2", text)
+    elif case == "truncated":
+        text = text[: int(len(text) * 0.8)]
+    return Case(f"{size}/{case}", size, text)
+
+def load_corpus() -> List[Case]:
+    with open(MANIFEST_PATH) as f:
+        manifest = json.load(f)
+    cases = []
+    for name in manifest["cases"]:
+        with open(os.path.join(CORPUS_DIR, name.replace("/", "-") + ".txt")) as f:
+            cases.append(Case(name, name.split("/")[0], f.read()))
+    return cases
+
+class Stage(NamedTuple):
+    run: Callable[[Any], Any]
+    takes_text: bool  # else the parsed plan, copied fresh for every call since stages mutate it
+
+def _preferences(size: str) -> MealPreference:
+    return MealPreference(
+        age=30, weightKg=70.0, heightCm=170, sex="male", goal="maintain", dietType="omnivore",
+        cookingEffort="quick", caloriesTarget=2000, mealsPerDay=SIZES[size][1], allergies=["peanuts"],
+    )
+
+def make_stages(size: str) -> Dict[str, Stage]:
+    # main.py sets up logging and its upstream client at import, so only load it when a stage needs it
+    import main
+
+    client = OpenAIClient(object(), metrics=Metrics(path=None, enabled=False))
+    preferences = _preferences(size)
+    return {
+        "soft_json_parse": Stage(main.soft_json_parse, True),
+        "parse_content": Stage(client._parse_content, True),
+        "sanitize_meal_plan": Stage(main.sanitize_meal_plan, False),
+        "validate_and_clean": Stage(lambda data: client._validate_and_clean_response(data, preferences), False),
+    }
+
+def _parsed(case: Case) -> Optional[Dict[str, Any]]:
+    try:
+        data, _ = parse_json_with_repairs(case.text)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+def _call(stage: Stage, value: Any) -> Any:
+    try:
+        return stage.run(value)
+    except ValueError as e:
+        return e
+
+def outcome(stage_name: str, result: Any) -> Dict[str, Any]:
+    """A small, stable summary of what a stage returned, for the manifest."""
+    if isinstance(result, PlanValidationError):
+        return {"error": "PlanValidationError", "defects": sorted({defect.kind for defect in result.defects})}
+    if isinstance(result, Exception):
+        return {"error": type(result).__name__}
+    if stage_name in ("sanitize_meal_plan", "validate_and_clean"):
+        return {"meals_per_day": [len(day.get("meals", [])) for day in result["plan"] if isinstance(day, dict)], "keys": sorted(result)}
+    return {"keys": sorted(result)}
+
+def run_outcomes(cases: List[Case]) -> Dict[str, Dict[str, Any]]:
+    """Every stage's outcome on every case; stages after parsing only see cases that parse."""
+    outcomes: Dict[str, Dict[str, Any]] = {}
+    for case in cases:
+        parsed = _parsed(case)
+        for stage_name, stage in make_stages(case.size).items():
+            if stage.takes_text:
+                outcomes.setdefault(case.name, {})[stage_name] = outcome(stage_name, _call(stage, case.text))
+            elif parsed is not None:
+                outcomes.setdefault(case.name, {})[stage_name] = outcome(stage_name, _call(stage, copy.deepcopy(parsed)))
+    return outcomes
+
+def _time_calls(stage: Stage, inputs: List[Any]) -> float:
+    # As timeit does: a collection triggered by the prebuilt inputs would land on whichever call is running
+    gc.collect()
+    gc.disable()
+    try:
+        started = perf_counter()
+        for value in inputs:
+            _call(stage, value)
+        return perf_counter() - started
+    finally:
+        gc.enable()
+
+class Benchmark(NamedTuple):
+    stage: Stage
+    make_input: Callable[[], Any]
+    number: int  # calls per batch
+
+def _batch(benchmark: Benchmark) -> float:
+    """Seconds per call over one batch; inputs are built before the clock starts."""
+    return _time_calls(benchmark.stage, [benchmark.make_input() for _ in range(benchmark.number)]) / benchmark.number
+
+def calibrate(stage: Stage, make_input: Callable[[], Any], min_seconds: float = 0.02) -> Benchmark:
+    """Double the batch size until a batch lasts ``min_seconds``."""
+    number = 1
+    while True:
+        started = perf_counter()
+        inputs = [make_input() for _ in range(number)]
+        building = perf_counter() - started
+        elapsed = _time_calls(stage, inputs)
+        # Fresh inputs for fast stages on big plans cost more than the calls; cap the batch on that too
+        if elapsed >= min_seconds or building >= 2 * min_seconds or number >= 1 << 16:
+            return Benchmark(stage, make_input, number)
+        number *= 2
+
+def peak_allocation(stage: Stage, value: Any) -> float:
+    """KiB allocated at the peak of one call, above what was live before it."""
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        _call(stage, value)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (peak - before) / 1024
+
+def _reference_workload(_: Any) -> int:
+    total = 0
+    for number in range(2000):
+        total += len({"n": str(number), "sq": number * number})
+    return total
+
+REFERENCE = "reference"
+
+def measure(cases: List[Case], repeats: int = 5, only: str = "") -> Tuple[Dict[str, Dict[str, float]], float]:
+    """
+    ``{"stage:size/case": {"us": ..., "peak_kib": ...}}`` for every stage a
+    case reaches, and the time of a fixed pure-Python workload that factors
+    machine speed out of comparisons. Each timing is the best of ``repeats``
+    rounds over every benchmark, so slow spells on a shared machine hit one
+    round of everything rather than every repeat of one stage.
+    """
+    benchmarks = {REFERENCE: calibrate(Stage(_reference_workload, True), lambda: None)}
+    allocations = {}
+    for case in cases:
+        parsed = _parsed(case)
+        for stage_name, stage in make_stages(case.size).items():
+            key = f"{stage_name}:{case.name}"
+            if only not in key:
+                continue
+            if stage.takes_text:
+                make_input = lambda text=case.text: text
+            elif parsed is not None:
+                # Restoring from JSON is far cheaper than deepcopy, so batches stay short
+                make_input = lambda snapshot=json.dumps(parsed): json.loads(snapshot)
+            else:
+                continue
+            benchmarks[key] = calibrate(stage, make_input)
+            allocations[key] = round(peak_allocation(stage, make_input()), 2)
+
+    best = {key: math.inf for key in benchmarks}
+    for _ in range(repeats):
+        for key, benchmark in benchmarks.items():
+            best[key] = min(best[key], _batch(benchmark))
+    reference = best.pop(REFERENCE) * 1e6
+    return {key: {"us": round(seconds * 1e6, 2), "peak_kib": allocations[key]} for key, seconds in best.items()}, reference
+
+def compare(
+    current: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    time_threshold: float = 0.3,
+    alloc_threshold: float = 0.1,
+    speed: float = 1.0,
+) -> List[str]:
+    """
+    Regressions beyond the thresholds (fractions over baseline). Timings are
+    judged per stage and size, as the geometric mean of the cases' ratios to
+    their baseline, since single cases on a shared machine are too noisy to
+    gate on; ``speed`` scales baseline timings to this run's machine (this
+    run's reference time over the baseline's). Allocations are stable enough
+    to judge per case. Deltas that are noise are ignored either way.
+    """
+    regressions = []
+    ratios: Dict[str, List[float]] = {}
+    for key, result in sorted(current.items()):
+        base = baseline.get(key)
+        if base is None:
+            continue
+        expected_us = base["us"] * speed
+        ratio = result["us"] / expected_us if abs(result["us"] - expected_us) > MIN_TIME_DELTA_US else 1.0
+        stage, name = key.split(":", 1)
+        ratios.setdefault(f"{stage} on {name.split('/')[0]}", []).append(ratio)
+        if result["peak_kib"] > base["peak_kib"] * (1 + alloc_threshold) and result["peak_kib"] - base["peak_kib"] > MIN_ALLOC_DELTA_KIB:
+            regressions.append(f"{key}: peak {result['peak_kib']:.1f}KiB vs {base['peak_kib']:.1f}KiB baseline")
+    for group, values in sorted(ratios.items()):
+        slowdown = math.exp(sum(math.log(value) for value in values) / len(values))
+        if slowdown > 1 + time_threshold:
+            regressions.append(f"{group}: {slowdown:.2f}x the baseline time (geometric mean of {len(values)} cases)")
+    return regressions
+
+def outcome_mismatches(cases: List[Case], expected: Dict[str, Dict[str, Any]]) -> List[str]:
+    actual = run_outcomes(cases)
+    return [
+        f"{name}: {stage}: {actual.get(name, {}).get(stage)} != expected {expected[name].get(stage)}"
+        for name in sorted(set(actual) | set(expected))
+        for stage in sorted(set(actual.get(name, {})) | set(expected.get(name, {})))
+        if actual.get(name, {}).get(stage) != expected.get(name, {}).get(stage)
+    ]
+
+def write_corpus() -> None:
+    cases = [build_case(size, case) for size in SIZES for case in CASES]
+    os.makedirs(CORPUS_DIR, exist_ok=True)
+    for case in cases:
+        with open(os.path.join(CORPUS_DIR, case.name.replace("/", "-") + ".txt"), "w") as f:
+            f.write(case.text)
+    with open(MANIFEST_PATH, "w") as f:
+        json.dump({"seed": CORPUS_SEED, "cases": [case.name for case in cases], "outcomes": run_outcomes(cases)}, f, indent=2)
+        f.write("\n")
+
+def format_report(current: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], speed: float = 1.0) -> str:
+    rows = [("stage", "case", "us/call", "baseline", "change", "peak KiB")]
+    for key, result in sorted(current.items()):
+        stage, name = key.split(":", 1)
+        base = baseline.get(key)
+        change = f"{(result['us'] / (base['us'] * speed) - 1) * 100:+.0f}%" if base and base["us"] else "new"
+        rows.append((stage, name, f"{result['us']:.1f}", f"{base['us']:.1f}" if base else "-", change, f"{result['peak_kib']:.1f}"))
+    widths = [max(len(row[index]) for row in rows) for index in range(len(rows[0]))]
+    return "\n".join("  ".join(cell.ljust(width) if index < 2 else cell.rjust(width) for index, (cell, width) in enumerate(zip(row, widths))) for row in rows)
+
+def main_cli() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--write-corpus", action="store_true", help="regenerate the corpus and its expected outcomes, then exit")
+    parser.add_argument("--update-baseline", action="store_true", help="record these timings as the new baseline")
+    parser.add_argument("--time-threshold", type=float, default=0.3, help="allowed slowdown over the baseline (0.3 = 30%%)")
+    parser.add_argument("--alloc-threshold", type=float, default=0.1, help="allowed growth of peak allocations over the baseline")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--filter", default="", help="only run stage:size/case keys containing this text")
+    args = parser.parse_args()
+
+    if args.write_corpus:
+        write_corpus()
+        print(f"Wrote {len(SIZES) * len(CASES)} cases to {CORPUS_DIR}")
+        return 0
+
+    with open(MANIFEST_PATH) as f:
+        expected = json.load(f)["outcomes"]
+    cases = load_corpus()
+    mismatches = outcome_mismatches(cases, expected)
+    for mismatch in mismatches:
+        print(f"OUTCOME CHANGED {mismatch}", file=sys.stderr)
+
+    current, reference = measure(cases, args.repeats, args.filter)
+    baseline: Dict[str, Dict[str, float]] = {}
+    speed = 1.0
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            recorded = json.load(f)
+        baseline = recorded["results"]
+        speed = reference / recorded["reference_us"]
+    print(format_report(current, baseline, speed))
+    print(f"reference workload {reference:.1f}us, {speed:.2f}x the baseline machine's time")
+
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.platform(),
+                    "reference_us": round(reference, 2),
+                    "results": {**baseline, **current} if args.filter else current,
+                },
+                f, indent=2, sort_keys=True,
+            )
+            f.write("\n")
+        print(f"Baseline written to {BASELINE_PATH}")
+        return 1 if mismatches else 0
+
+    regressions = compare(current, baseline, args.time_threshold, args.alloc_threshold, speed)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions or mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,145 @@
+"""
+Benchmark matrix: start the fake upstream, then for each app and worker count
+start the app under gunicorn pointed at it, and drive every concurrency level.
+
+    python -m benchmarks.run --apps main,worker,simple --workers 1,4 --concurrency 1,8,32 --requests 200 \\
+        --latency lognormal:0.8,0.4 --tokens-per-second 120 --malformed-rate 0.05 --wrong-count-rate 0.05
+
+Run from apps/worker. Each app gets fresh cache, meal store, jobs and metrics
+files in a temporary directory, so runs do not see each other's state.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+import httpx
+from benchmarks.fake_llm import add_arguments
+from benchmarks.load import APPS, run_load
+
+WORKER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Short enough that the final scrape sees every worker's counts
+METRICS_FLUSH_SECONDS = 1.0
+
+COLUMNS = [
+    ("app", "app"), ("workers", "workers"), ("concurrency", "conc"), ("requests_per_second", "req/s"),
+    ("p50_ms", "p50 ms"), ("p95_ms", "p95 ms"), ("p99_ms", "p99 ms"), ("errors", "errors"),
+    ("upstream_calls_per_request", "upstream/req"), ("retries_per_request", "retries/req"),
+]
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{' '.join(process.args)} exited with {process.returncode}")
+        try:
+            if httpx.get(url, timeout=2.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+@contextmanager
+def running(command: List[str], health_url: str, env: Dict[str, str]) -> Iterator[subprocess.Popen]:
+    process = subprocess.Popen(command, cwd=WORKER_DIR, env=env, stdout=subprocess.DEVNULL)
+    try:
+        wait_until_up(health_url, process)
+        yield process
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def fake_command(args: argparse.Namespace, port: int) -> List[str]:
+    command = [
+        sys.executable, "-m", "benchmarks.fake_llm", "--port", str(port),
+        "--latency", args.latency, "--tokens-per-second", str(args.tokens_per_second),
+        "--malformed-rate", str(args.malformed_rate), "--malformed-kinds", args.malformed_kinds,
+        "--wrong-count-rate", str(args.wrong_count_rate), "--error-rate", str(args.error_rate),
+    ]
+    if args.seed is not None:
+        command += ["--seed", str(args.seed)]
+    return command
+
+def app_env(fake_url: str, state_dir: str, log_level: str) -> Dict[str, str]:
+    return {
+        **os.environ,
+        "OPENAI_BASE_URL": f"{fake_url}/v1",
+        "OPENAI_API_KEY": "sk-bench",
+        "PLAN_CACHE_PATH": os.path.join(state_dir, "plan-cache.sqlite3"),
+        "MEAL_STORE_PATH": os.path.join(state_dir, "meal-store.sqlite3"),
+        "JOBS_PATH": os.path.join(state_dir, "jobs.sqlite3"),
+        "METRICS_PATH": os.path.join(state_dir, "metrics.sqlite3"),
+        "METRICS_FLUSH_SECONDS": str(METRICS_FLUSH_SECONDS),
+        "LOG_LEVEL": log_level,
+    }
+
+def format_table(results: List[dict]) -> str:
+    rows = [[header for _, header in COLUMNS]]
+    for result in results:
+        rows.append(["-" if result.get(key) is None else str(result[key]) for key, _ in COLUMNS])
+    widths = [max(len(row[index]) for row in rows) for index in range(len(COLUMNS))]
+    return "\n".join("  ".join(cell.rjust(width) for cell, width in zip(row, widths)) for row in rows)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apps", default="main,worker,simple", help=f"comma-separated subset of {','.join(APPS)}")
+    parser.add_argument("--workers", default="1", help="comma-separated gunicorn worker counts")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated client concurrency levels")
+    parser.add_argument("--requests", type=int, default=100, help="requests per concurrency level")
+    parser.add_argument("--meals-per-day", type=int, default=3)
+    parser.add_argument("--cached", action="store_true", help="let repeated profiles hit the plan cache")
+    parser.add_argument("--app-log-level", default="WARNING")
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    fake_port = free_port()
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    results = []
+    with running(fake_command(args, fake_port), f"{fake_url}/stats", dict(os.environ)):
+        for app in args.apps.split(","):
+            target = APPS[app]
+            for workers in [int(value) for value in args.workers.split(",")]:
+                port = free_port()
+                base_url = f"http://127.0.0.1:{port}"
+                command = [
+                    sys.executable, "-m", "gunicorn", target.module, "-k", "uvicorn.workers.UvicornWorker",
+                    "-w", str(workers), "-b", f"127.0.0.1:{port}", "--timeout", "300", "--log-level", "warning",
+                ]
+                with tempfile.TemporaryDirectory(prefix=f"bench-{app}-") as state_dir:
+                    with running(command, base_url + target.health_path, app_env(fake_url, state_dir, args.app_log_level)):
+                        for concurrency in [int(value) for value in args.concurrency.split(",")]:
+                            result = asyncio.run(run_load(
+                                app, base_url, concurrency, args.requests,
+                                fake_url=fake_url,
+                                regenerate=not args.cached,
+                                meals_per_day=args.meals_per_day,
+                                metrics_settle_seconds=METRICS_FLUSH_SECONDS * 1.5 if target.has_metrics else 0.0,
+                            ))
+                            result["workers"] = workers
+                            results.append(result)
+                            print(format_table([result]).splitlines()[1], file=sys.stderr, flush=True)
+
+    print(format_table(results))
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
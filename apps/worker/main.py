@@ -6,28 +6,195 @@ Simple FastAPI service for AI meal plan generation
 
 import os
 import json
-import re
+import logging
+import asyncio
+from contextlib import asynccontextmanager
 from time import time
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import AsyncIterator, List, Dict, Optional
 
-from fastapi import FastAPI, HTTPException
+# The HTTP client the installed openai SDK is built on: httpx2 in newer releases, httpx before
+try:
+    import httpx2 as httpx
+except ImportError:
+    import httpx  # type: ignore[no-redef]
+from fastapi import FastAPI, Header, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
-from openai import OpenAI
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
 
+from worker.services.plan_cache import PlanCache, plan_cache_key, DEFAULT_CACHE_PATH
+from worker.services.single_flight import SingleFlight, flight_key
+from worker.services.json_stream import JSONRepairError, MealStreamScanner, parse_json_with_repairs
+from worker.services.allergen_matcher import compile_matcher
+from worker.services.batch import gather_unique
+from worker.services.ingredients import build_groceries, load_ingredient_index
+from worker.services.job_store import DEFAULT_JOBS_PATH, JobQueueFull, JobRunner, JobStore, job_event_stream, job_summary
+from worker.services.local_planner import is_simple_profile, local_meal_plan
+from worker.services.meal_store import DEFAULT_MEAL_STORE_PATH, MealStore, StoredMeal
+from worker.services.metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    DEFAULT_METRICS_PATH,
+    FALLBACK_RESPONSES,
+    GENERATION_RETRIES,
+    GENERATION_SECONDS,
+    JSON_PARSES,
+    OFF_TARGET_DAYS,
+    TOTALS_CORRECTIONS,
+    UPSTREAM_SECONDS,
+    Metrics,
+)
+from worker.services.nutrition import daily_macros, off_target_days, plan_totals, reconcile_totals
+from worker.services.nutrition_db import apply_meal_macros, load_nutrition_table
+from worker.services.plan_defects import PlanDefect, PlanValidationError
+from worker.services.plan_payload import JSONPayload, event_line, json_response, plan_event_line
+from worker.services.prompts import PromptTemplate
+from worker.services.retry_policy import Deadline, DeadlineExceeded, RetryBudget, RetryPolicy, retry_cause
+from worker.services.structured_logging import RequestIDMiddleware, configure_logging, log_payload
+
 # Load environment variables from .env file
 load_dotenv()
 
+# Structured logging: JSON lines (LOG_FORMAT=text for humans) written by a
+# background thread, so requests never block on stdout. Raw model responses
+# are only logged for LOG_PAYLOAD_SAMPLE_RATE of the calls that need repairs.
+configure_logging(os.getenv("LOG_LEVEL", "INFO"), json_format=os.getenv("LOG_FORMAT", "json") == "json")
+logger = logging.getLogger("nutriai.main")
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+
+# Upstream concurrency: one pooled async client per process, and a cap on how
+# many OpenAI calls may be in flight at once so a burst cannot exhaust the pool.
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "64"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "32"))
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "90"))
+MAX_INFLIGHT_GENERATIONS = int(os.getenv("MAX_INFLIGHT_GENERATIONS", "48"))
+# /generate/batch: max profiles per call and how many of them generate at once
+MAX_BATCH_PROFILES = int(os.getenv("MAX_BATCH_PROFILES", "10"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
 # Configure OpenAI
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+    ),
+    timeout=httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=10.0),
+)
+# Retries are owned by retry_policy below, so the SDK must not retry on its own
+openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client, max_retries=0)
+upstream_slots = asyncio.Semaphore(MAX_INFLIGHT_GENERATIONS)
+
+# /metrics (Prometheus text): recorded in memory, flushed every
+# METRICS_FLUSH_SECONDS and on each scrape into a SQLite file shared by all gunicorn workers
+metrics = Metrics(
+    path=os.getenv("METRICS_PATH", DEFAULT_METRICS_PATH),
+    enabled=os.getenv("METRICS_ENABLED", "true").lower() == "true",
+)
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "10"))
+
+async def create_completion(kind: str, **kwargs):
+    """One chat completion, timed and with its token usage counted per model."""
+    with metrics.timer(UPSTREAM_SECONDS, model=kwargs["model"], kind=kind):
+        response = await openai_client.chat.completions.create(**kwargs)
+    if not kwargs.get("stream"):
+        metrics.record_usage(kwargs["model"], response)
+    return response
+
+# Retries back off with jitter, share one deadline per request, and may not
+# exceed RETRY_BUDGET_RATIO of request volume across the process
+retry_policy = RetryPolicy(
+    RetryBudget(
+        ratio=float(os.getenv("RETRY_BUDGET_RATIO", "0.2")),
+        min_per_second=float(os.getenv("RETRY_BUDGET_MIN_PER_SECOND", "1")),
+        burst=float(os.getenv("RETRY_BUDGET_BURST", "10")),
+    ),
+    max_attempts=int(os.getenv("RETRY_MAX_ATTEMPTS", "5")),
+    deadline_seconds=float(os.getenv("GENERATION_DEADLINE_SECONDS", "120")),
+    base_delay=float(os.getenv("RETRY_BASE_DELAY_SECONDS", "0.5")),
+    max_delay=float(os.getenv("RETRY_MAX_DELAY_SECONDS", "8")),
+    on_retry=lambda error: metrics.inc(GENERATION_RETRIES, cause=retry_cause(error)),
+)
+
+# Grocery lists are built from the bundled ingredient taxonomy when the model
+# leaves them out; LOCAL_GROCERIES stops asking for them (and their prices) at all
+LOCAL_GROCERIES = os.getenv("LOCAL_GROCERIES", "false").lower() == "true"
+load_ingredient_index()
+
+# LOCAL_MACROS: each meal's kcal and macros are computed from its ingredient
+# quantities with the bundled nutrition table instead of asking the model
+LOCAL_MACROS = os.getenv("LOCAL_MACROS", "false").lower() == "true"
+if LOCAL_MACROS:
+    load_nutrition_table()
+
+# Plan cache: in-process LRU plus a SQLite file shared by all gunicorn workers.
+# Bump PLAN_CACHE_SCOPE whenever the prompt changes so stale plans are not served.
+PLAN_CACHE_SCOPE = "main.generate:v2" + (":local-groceries" if LOCAL_GROCERIES else "") + (":local-macros" if LOCAL_MACROS else "")
+plan_cache = PlanCache(
+    path=os.getenv("PLAN_CACHE_PATH", DEFAULT_CACHE_PATH),
+    max_entries=int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "1024")),
+    ttl_seconds=float(os.getenv("PLAN_CACHE_TTL_SECONDS", "86400")),
+    enabled=os.getenv("PLAN_CACHE_ENABLED", "true").lower() == "true",
+)
+
+# Concurrent identical requests (double submits, web app retries) share one upstream call
+generation_flights = SingleFlight()
+
+# Offline plans from the bundled recipe corpus: always used instead of failing,
+# and optionally served directly for profiles the corpus fully covers
+LOCAL_PLAN_FAST_PATH = os.getenv("LOCAL_PLAN_FAST_PATH", "false").lower() == "true"
+LOCAL_PLAN_DAYS = int(os.getenv("LOCAL_PLAN_DAYS", "1"))
+
+# Every generated meal is kept in a SQLite store (FTS5 + indexes on diet, slot,
+# kcal band and allergens); up to MEAL_STORE_MAX_FILL of a new plan's slots are
+# filled from it, so only the remaining meals are requested from the model
+meal_store = MealStore(
+    path=os.getenv("MEAL_STORE_PATH", DEFAULT_MEAL_STORE_PATH),
+    max_meals=int(os.getenv("MEAL_STORE_MAX_MEALS", "20000")),
+    enabled=os.getenv("MEAL_STORE_ENABLED", "true").lower() == "true",
+)
+MEAL_STORE_MAX_FILL = float(os.getenv("MEAL_STORE_MAX_FILL", "1.0"))
+
+# Background generation jobs (POST /jobs); job state lives in a SQLite file
+# shared by all gunicorn workers, so results survive restarts
+JOB_MAX_WAIT_SECONDS = float(os.getenv("JOB_MAX_WAIT_SECONDS", "55"))
+JOB_EVENTS_MAX_SECONDS = float(os.getenv("JOB_EVENTS_MAX_SECONDS", "600"))
+JOB_EVENTS_HEARTBEAT_SECONDS = float(os.getenv("JOB_EVENTS_HEARTBEAT_SECONDS", "15"))
+
+async def run_job(request: dict, report) -> dict:
+    """Job handler: the regular /generate pipeline (cache, single-flight, retries) without the mock fallback."""
+    preferences = MealPreference(**request["preferences"])
+    await report({"stage": "generating"})
+    plan = await cached_or_generated_plan(preferences, request.get("regenerate", False), endpoint="job")
+    return plan.data()
+
+job_runner = JobRunner(
+    JobStore(
+        path=os.getenv("JOBS_PATH", DEFAULT_JOBS_PATH),
+        ttl_seconds=float(os.getenv("JOB_TTL_SECONDS", str(7 * 24 * 3600))),
+    ),
+    handler=run_job,
+    workers=int(os.getenv("JOB_WORKERS", "4")),
+    max_queued=int(os.getenv("JOB_MAX_QUEUED", "100")),
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await job_runner.start()
+    metrics_flusher = asyncio.create_task(metrics.flush_periodically(METRICS_FLUSH_SECONDS))
+    yield
+    await job_runner.stop()
+    await openai_client.close()
+    metrics_flusher.cancel()
+    await asyncio.gather(metrics_flusher, return_exceptions=True)
 
 # Initialize FastAPI app
 app = FastAPI(
     title="NutriAI Worker Service",
     description="AI-powered meal plan generation service",
-    version="1.1.1"
+    version="1.1.1",
+    lifespan=lifespan,
 )
 
 # CORS middleware - updated to include Vercel URL
@@ -43,7 +210,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
+# Every request gets an ID that appears in its log lines and the X-Request-ID response header
+app.add_middleware(RequestIDMiddleware)
 
 # ---------------- Pydantic models ----------------
 class MealPreference(BaseModel):
@@ -61,6 +231,9 @@ class MealPreference(BaseModel):
     includeProteinShakes: bool = False  # whether to include protein shakes
     recentMeals: Optional[List[str]] = None  # injected server-side to avoid repeats
 
+class BatchGenerateRequest(BaseModel):
+    profiles: List[MealPreference]
+
 class Meal(BaseModel):
     name: str
     kcal: int
@@ -77,53 +250,26 @@ class MealPlanResponse(BaseModel):
     macronutrients: Dict[str, float]
 
 # ---------------- JSON repair helpers ----------------
-def extract_json_block(text: str) -> str:
-    """
-    Extract the largest JSON-looking block from a text blob:
-    takes substring from first '{' to last '}'.
-    """
-    if not text:
-        return text
-    start = text.find("{")
-    end = text.rfind("}")
-    if start != -1 and end != -1 and end > start:
-        return text[start:end + 1].strip()
-    return text.strip()
-
 def soft_json_parse(text: str) -> dict:
     """
-    Best-effort JSON loader for minor model glitches:
-    - strip code fences
-    - extract JSON block
-    - remove trailing commas before } or ]
-    - fix common unescaped inner quotes like: tomorrow"s -> tomorrow's
+    Best-effort JSON loader for minor model glitches. Runs the single-pass
+    repairing parser, which in the same scan:
+    - skips code fences and prose around the JSON block
+    - drops trailing commas before } or ]
+    - fixes unescaped inner quotes like: tomorrow"s -> tomorrow's
+    - closes strings, arrays and objects left open by a truncated response
     """
-    t = text.strip()
-
-    # Strip ```json fences
-    if t.startswith("```"):
-        t = t.strip("`")
-        if t.lower().startswith("json"):
-            t = t[4:].strip()
-
-    # Extract the JSON block
-    t = extract_json_block(t)
-
-    # Try strict parse first
     try:
-        return json.loads(t)
-    except json.JSONDecodeError:
-        pass
-
-    # Remove trailing commas ( ,] or ,} )
-    t = re.sub(r",(\s*[}\]])", r"\1", t)
-
-    # Fix inner unescaped quotes in words: foo"s -> foo's
-    # Only between alphanumerics to avoid messing URLs, numbers, etc.
-    t = re.sub(r'(\w)"(\w)', r"\1'\2", t)
-
-    # Try again
-    return json.loads(t)
+        data, repairs = parse_json_with_repairs(text)
+        if not isinstance(data, dict):
+            raise JSONRepairError("Expected a JSON object")
+    except ValueError:
+        metrics.inc(JSON_PARSES, mode="failed")
+        raise
+    metrics.inc(JSON_PARSES, mode="repaired" if repairs else "strict")
+    if repairs:
+        logger.warning(f"JSON repairs applied: {', '.join(repairs)}", extra={"stage": "parse", "repairs": repairs})
+    return data
 
 # ---------------- Helper: sanitize AI output ----------------
 def sanitize_meal_plan(data: dict) -> dict:
@@ -197,6 +343,10 @@ def sanitize_meal_plan(data: dict) -> dict:
                 elif not isinstance(meal["steps"], list):
                     meal["steps"] = ["Follow recipe instructions"]
 
+    # Meal macros come from the ingredients, replacing the zeros (or model values) set above
+    if LOCAL_MACROS:
+        apply_meal_macros(data["plan"])
+
     # Reduce perceived repetition by ensuring meal names remain unique
     seen_meal_names = {}
     for day in data.get("plan", []):
@@ -238,41 +388,8 @@ def sanitize_meal_plan(data: dict) -> dict:
             data["totals"]["fat_g"] = 0
 
     # Handle groceries
-    if "groceries" not in data or not isinstance(data["groceries"], list):
-        groceries = {
-            "Proteins": set(),
-            "Grains": set(),
-            "Vegetables": set(),
-            "Dairy/Alternatives": set(),
-            "Pantry": set(),
-            "Spices": set()
-        }
-        for day in data.get("plan", []):
-            for meal in day.get("meals", []):
-                for ing in meal.get("ingredients", []):
-                    if isinstance(ing, dict) and "item" in ing:
-                        ing_name = ing["item"]
-                    elif isinstance(ing, str):
-                        ing_name = ing
-                    else:
-                        continue
-                    ing_lower = ing_name.lower()
-                    if any(p in ing_lower for p in ["chicken", "beef", "pork", "fish", "salmon", "tuna", "turkey", "eggs", "tofu", "beans", "lentils"]):
-                        groceries["Proteins"].add(ing_name)
-                    elif any(g in ing_lower for g in ["rice", "quinoa", "oats", "bread", "pasta", "wheat", "barley"]):
-                        groceries["Grains"].add(ing_name)
-                    elif any(v in ing_lower for v in ["broccoli", "spinach", "lettuce", "tomato", "carrot", "onion", "pepper", "cucumber", "berries", "apple", "banana"]):
-                        groceries["Vegetables"].add(ing_name)
-                    elif any(d in ing_lower for d in ["milk", "cheese", "yogurt", "butter", "cream"]):
-                        groceries["Dairy/Alternatives"].add(ing_name)
-                    elif any(sp in ing_lower for sp in ["salt", "pepper", "paprika", "cumin", "curry", "oregano", "basil", "garlic powder"]):
-                        groceries["Spices"].add(ing_name)
-                    else:
-                        groceries["Pantry"].add(ing_name)
-        data["groceries"] = [
-            {"category": cat, "items": sorted(list(items))}
-            for cat, items in groceries.items() if items
-        ]
+    if LOCAL_GROCERIES or "groceries" not in data or not isinstance(data["groceries"], list):
+        data["groceries"] = build_groceries(data.get("plan"))
 
     return data
 
@@ -285,6 +402,98 @@ def map_effort_to_price_style(cooking_effort: str) -> str:
         return "Budget Edition"
     return "Normal Edition"  # quick & easy
 
+def fallback_meal_plan(preferences: MealPreference) -> dict:
+    """
+    Plan returned when generation fails, so the app never hard-fails in front
+    of users. Built offline from the recipe corpus, so it still respects the
+    diet, allergies and meal count; the static mock is the last resort.
+    """
+    try:
+        plan = local_meal_plan(preferences, days=LOCAL_PLAN_DAYS)
+    except Exception as e:
+        logger.exception(f"Local meal plan failed, serving the mock plan: {e}", extra={"stage": "fallback"})
+        metrics.inc(FALLBACK_RESPONSES, kind="mock")
+        return mock_meal_plan()
+    metrics.inc(FALLBACK_RESPONSES, kind="local")
+    return plan
+
+def mock_meal_plan() -> dict:
+    """Static last-resort plan for when even the local planner cannot serve the profile."""
+    return {
+        "plan": [
+            {
+                "day": 1,
+                "meals": [
+                    {
+                        "name": "Breakfast: Oatmeal with berries",
+                        "kcal": 350,
+                        "protein_g": 12,
+                        "carbs_g": 65,
+                        "fat_g": 8,
+                        "ingredients": [
+                            {"item": "Rolled oats", "qty": "1/2 cup"},
+                            {"item": "Mixed berries", "qty": "1/2 cup"},
+                            {"item": "Almond milk", "qty": "1 cup"}
+                        ],
+                        "steps": [
+                            "Cook oats with almond milk for 5 minutes",
+                            "Top with fresh berries",
+                            "Serve warm"
+                        ]
+                    },
+                    {
+                        "name": "Lunch: Grilled chicken salad",
+                        "kcal": 450,
+                        "protein_g": 35,
+                        "carbs_g": 25,
+                        "fat_g": 20,
+                        "ingredients": [
+                            {"item": "Chicken breast", "qty": "150g"},
+                            {"item": "Mixed greens", "qty": "2 cups"},
+                            {"item": "Olive oil", "qty": "1 tbsp"}
+                        ],
+                        "steps": [
+                            "Grill chicken breast until cooked through",
+                            "Toss greens with olive oil",
+                            "Slice chicken and serve over salad"
+                        ]
+                    },
+                    {
+                        "name": "Dinner: Salmon with quinoa",
+                        "kcal": 500,
+                        "protein_g": 40,
+                        "carbs_g": 45,
+                        "fat_g": 25,
+                        "ingredients": [
+                            {"item": "Salmon fillet", "qty": "150g"},
+                            {"item": "Quinoa", "qty": "1/2 cup"},
+                            {"item": "Broccoli", "qty": "1 cup"}
+                        ],
+                        "steps": [
+                            "Cook quinoa according to package directions",
+                            "Pan-sear salmon for 4-5 minutes per side",
+                            "Steam broccoli until tender",
+                            "Serve salmon over quinoa with broccoli"
+                        ]
+                    }
+                ]
+            }
+        ],
+        "totals": {
+            "kcal": 1300,
+            "protein_g": 87,
+            "carbs_g": 135,
+            "fat_g": 53
+        },
+        "groceries": [
+            {"category": "Proteins", "items": ["Chicken breast", "Salmon fillet"]},
+            {"category": "Grains", "items": ["Rolled oats", "Quinoa"]},
+            {"category": "Vegetables", "items": ["Mixed greens", "Broccoli", "Mixed berries"]},
+            {"category": "Dairy/Alternatives", "items": ["Almond milk"]},
+            {"category": "Pantry", "items": ["Olive oil"]}
+        ]
+    }
+
 # ---------------- Endpoints ----------------
 @app.get("/health")
 async def health_check():
@@ -294,59 +503,101 @@ async def health_check():
         "service": "NutriAI Worker Service",
         "version": "3b87804-fixed",
         "has_mealsPerDay": True,
-        "has_retry_logic": True
+        "has_retry_logic": True,
+        "max_inflight_generations": MAX_INFLIGHT_GENERATIONS,
+        "plan_cache": plan_cache.stats(),
+        "single_flight": generation_flights.stats(),
+        "retries": retry_policy.stats(),
+        "jobs": job_runner.stats(),
+        "meal_store": meal_store.stats(),
+        "prompt_tokens": GENERATION_PROMPT.token_report()
     }
 
-@app.post("/generate")
-async def generate_meal_plan(preferences: MealPreference):
-    """Generate a personalized meal plan using GPT-4.1"""
-    try:
-        print(f"🤖 Generating meal plan for: {preferences.age}yo {preferences.sex}, {preferences.goal} goal")
-        print(f"🔍 Requesting {preferences.mealsPerDay} meals per day")
-        if preferences.includeProteinShakes:
-            print(f"🥤 Including protein shakes as requested")
-
-        # ---------- FINAL SYSTEM PROMPT ----------
-        meals_count = preferences.mealsPerDay
-        price_style = map_effort_to_price_style(preferences.cookingEffort)
-        system_prompt = f"""
+def compile_generation_prompt(local_groceries: bool, local_macros: bool = False) -> PromptTemplate:
+    """
+    The generation prompt, compiled once at import: every instruction sits in
+    a byte-identical system prefix (so upstream prefix caching applies) and
+    the profile is the only per-request part, as compact JSON. With
+    ``local_macros`` the model is not asked for kcal, macros or totals.
+    """
+    if local_macros:
+        meal_nutrition = """
+- ingredients: array of {"item": string, "qty": string} with measurable amounts (g, ml, cups, spoons or pieces); grains, pasta and legumes by dry weight unless the qty says "cooked\""""
+        day_summary = ""
+        meal_macros_shape = ""
+        day_summary_shape = ""
+        totals_shape = ""
+        plan_keys = "plan"
+    else:
+        meal_nutrition = """
+- kcal, protein_g, carbs_g, fat_g
+- ingredients: array of {"item": string, "qty": string} with precise amounts (metric + US for main items)"""
+        day_summary = """
+- daily_nutrition_summary: calories + macros (protein_g, carbs_g, fat_g)"""
+        meal_macros_shape = """
+          "kcal": 0,
+          "protein_g": 0,
+          "carbs_g": 0,
+          "fat_g": 0,"""
+        day_summary_shape = """,
+      "daily_nutrition_summary": {
+        "kcal": 0, "protein_g": 0, "carbs_g": 0, "fat_g": 0
+      }"""
+        totals_shape = """,
+  "totals": { "kcal": 0, "protein_g": 0, "carbs_g": 0, "fat_g": 0 }"""
+        plan_keys = "plan/totals"
+    if local_groceries:
+        grocery_rules = """3) GROCERY LIST
+- Do NOT include a grocery list; it is built from the ingredients"""
+        grocery_shape = ""
+        grocery_keys = plan_keys
+    else:
+        grocery_rules = """3) GROCERY LIST WITH PRICES (after the full timeframe only)
+- groceries: array of categories with items (no per-meal amounts)
+- Show prices by purchase unit only (e.g., "Rice 1kg = €2.10", "Olive oil 500ml = €4.00")
+- Do NOT tell the user how much to buy or how many units to purchase
+- Include one estimated total grocery cost for the entire plan
+- Prices adapt to pricing style:
+   * Budget Edition → low-cost supermarket
+   * Normal Edition → average supermarket
+   * Gourmet Edition → premium/high-quality
+- The pricing style is derived from cooking effort:
+   * quick & easy → Normal Edition
+   * budget friendly → Budget Edition
+   * gourmet → Gourmet Edition"""
+        grocery_shape = """,
+  "groceries": [
+    { "category": "Proteins", "items": ["Item1", "Item2"] },
+    { "category": "Grains", "items": ["Item1", "Item2"] }
+  ]"""
+        grocery_keys = plan_keys + "/groceries"
+    return PromptTemplate(
+        "main.generate",
+        [
+            ("role", """
 You are a nutritionist creating personalized meal plans. Generate DIFFERENT meals for different user profiles.
 
-CRITICAL: Keep responses SHORT and COMPLETE. Generate only 1 day with EXACTLY {meals_count} meals.
+CRITICAL: Keep responses SHORT and COMPLETE. Generate only timeframe_days day(s) with EXACTLY meals_per_day meals each (both given in the request).
 
 RULES:
-
+"""),
+            ("variety_and_meals", """
 1) VARIETY
 - Do not repeat the same recipes across a week unless explicitly requested.
 - Rotate proteins, cuisines, cooking styles, and flavor profiles.
 
 2) MEAL STRUCTURE (for each meal)
-- name
-- kcal, protein_g, carbs_g, fat_g
-- ingredients: array of {{"item": string, "qty": string}} with precise amounts (metric + US for main items)
+- name""" + meal_nutrition + """
 - steps: clear, numbered, beginner-friendly cooking instructions
 - Seasonings must be written naturally like: "Season with salt, black pepper, paprika." (no vague "to taste", no exact tsp/grams)
 - substitution: at least one realistic fallback for a key ingredient (e.g., "If salmon is unavailable, use trout or chicken")
 - Optional UX fields: labels (icons), prep_note, tip
 
-At the end of each day:
-- daily_nutrition_summary: calories + macros (protein_g, carbs_g, fat_g)
+At the end of each day:""" + day_summary + """
 - substitution_notes if restricted items appear
-
-3) GROCERY LIST WITH PRICES (after the full timeframe only)
-- groceries: array of categories with items (no per-meal amounts)
-- Show prices by purchase unit only (e.g., "Rice 1kg = €2.10", "Olive oil 500ml = €4.00")
-- Do NOT tell the user how much to buy or how many units to purchase
-- Include one estimated total grocery cost for the entire plan
-- Prices adapt to pricing style:
-   * Budget Edition → low-cost supermarket
-   * Normal Edition → average supermarket
-   * Gourmet Edition → premium/high-quality
-- The pricing style is derived from cooking effort:
-   * quick & easy → Normal Edition
-   * budget friendly → Budget Edition
-   * gourmet → Gourmet Edition
-
+"""),
+            ("groceries", grocery_rules),
+            ("adaptation", """
 4) ADAPTATION TO USER PROFILE
 - Adjust calories/portions to age, weight, height, sex, and goal; if calorie_target provided, aim within ±5% daily
 - RESPECT GOAL STRICTLY:
@@ -366,235 +617,567 @@ At the end of each day:
 - Use plain cooking language
 - Highlight with simple labels in text when appropriate: 🌱 vegan, ⏱️ quick, 💪 high protein, 🥗 low carb
 - Provide short prep_note for batch/leftovers when relevant and a brief tip
-
+"""),
+            ("output_format", """
 6) OUTPUT FORMAT (STRICT)
 Return ONLY valid JSON, with this top-level shape:
 
-{{
+{
   "plan": [
-    {{
+    {
       "day": 1,
       "meals": [
-        {{
-          "name": "...",
-          "kcal": 0,
-          "protein_g": 0,
-          "carbs_g": 0,
-          "fat_g": 0,
-          "ingredients": [{{"item": "...", "qty": "..."}}],
+        {
+          "name": "...",""" + meal_macros_shape + """
+          "ingredients": [{"item": "...", "qty": "..."}],
           "steps": ["...", "..."],
           "substitution": "If X unavailable, use Y",
           "labels": ["🌱", "⏱️"],
           "prep_note": "optional short note",
           "tip": "optional short tip"
-        }}
-      ],
-      "daily_nutrition_summary": {{
-        "kcal": 0, "protein_g": 0, "carbs_g": 0, "fat_g": 0
-      }}
-    }}
-  ],
-  "totals": {{ "kcal": 0, "protein_g": 0, "carbs_g": 0, "fat_g": 0 }},
-  "groceries": [
-    {{ "category": "Proteins", "items": ["Item1", "Item2"] }},
-    {{ "category": "Grains", "items": ["Item1", "Item2"] }}
-  ]
-}}
+        }
+      ]""" + day_summary_shape + """
+    }
+  ]""" + totals_shape + grocery_shape + """
+}
 
-- Use keys exactly as shown for plan/totals/groceries to avoid schema issues.
+- Use keys exactly as shown for """ + grocery_keys + """ to avoid schema issues.
 - Do NOT include markdown, code fences, commentary, or explanations—JSON only.
 - CRITICAL: Ensure all JSON is valid with proper quotes, commas, and brackets.
 - Double-check that all strings are properly quoted with double quotes.
 - Make sure there are no trailing commas before closing brackets or braces.
+"""),
+        ],
+        "{payload}",
+    )
+
+GENERATION_PROMPT = compile_generation_prompt(LOCAL_GROCERIES, LOCAL_MACROS)
+
+def build_generation_messages(preferences: MealPreference, cache_key: str, regenerate: bool = False) -> list:
+    """The compiled system prompt plus this profile's payload."""
+    price_style = map_effort_to_price_style(preferences.cookingEffort)
+
+    # ---------- USER MESSAGE (profile + knobs) ----------
+    user_payload = {
+        "profile": {
+            "age": preferences.age,
+            "weight_kg": preferences.weightKg,
+            "height_cm": preferences.heightCm,
+            "sex": preferences.sex,
+            "goal": preferences.goal,  # "lose weight" | "maintain" | "gain weight"
+            "diet_type": preferences.dietType,  # omnivore | vegan | vegetarian | keto | mediterranean | paleo
+            "cooking_effort": preferences.cookingEffort,  # quick and easy | gourmet | budget friendly
+            "calorie_target": preferences.caloriesTarget if preferences.caloriesTarget else None,
+            "allergies": preferences.allergies or [],
+            "dislikes": preferences.dislikes or [],
+            "avoid_meals": preferences.recentMeals or [],
+        },
+        # generation knobs
+        "timeframe_days": 1,
+        "meals_per_day": preferences.mealsPerDay,
+        "include_protein_shakes": preferences.includeProteinShakes,
+        "pricing_style_from_effort": price_style,
+        "diversity_requirements": {
+            "no_repeat_within_week": True,
+            "rotate_cuisines": True,
+            "rotate_proteins": True
+        },
+        # Derived from the normalized profile so identical profiles send identical
+        # prompts; a regenerate request adds a timestamp to force fresh output.
+        "nonce": f"{cache_key[:16]}_{int(time())}" if regenerate else cache_key[:16]
+    }
+
+    return [
+        {"role": "system", "content": GENERATION_PROMPT.prefix},
+        {"role": "assistant", "content": "Return ONLY one valid JSON object. No markdown."},
+        {"role": "user", "content": GENERATION_PROMPT.render(payload=json.dumps(user_payload, separators=(",", ":")))}
+    ]
+
+def find_meal_count_defects(meal_plan_data: dict, expected_meals: int) -> List[PlanDefect]:
+    """Per-day meal count defects: "extra_meals" can be trimmed, "meal_count" needs new meals."""
+    plan = meal_plan_data.get("plan") or []
+    if not plan:
+        return [PlanDefect("structure", "No meals found in response structure")]
+    defects = []
+    for day_idx, day in enumerate(plan):
+        if not isinstance(day, dict):
+            return [PlanDefect("structure", f"Day {day_idx + 1} is not an object")]
+        actual_meals = len(day["meals"])
+        if actual_meals > expected_meals:
+            defects.append(PlanDefect("extra_meals", f"Day {day_idx + 1} has {actual_meals} meals, expected {expected_meals}", day=day_idx + 1))
+        elif actual_meals < expected_meals:
+            defects.append(PlanDefect("meal_count", f"Day {day_idx + 1} has {actual_meals} meals, expected {expected_meals}", day=day_idx + 1, meal_index=actual_meals))
+    return defects
+
+def recompute_totals(meal_plan_data: dict) -> None:
+    """Recompute average daily totals from the meals after meals were added or removed."""
+    meal_plan_data["totals"] = plan_totals(meal_plan_data["plan"])
+
+def reconcile_plan_totals(meal_plan_data: dict) -> None:
+    """Totals come from the meals; whatever the model summed up is only compared and counted."""
+    corrected = reconcile_totals(meal_plan_data).corrected
+    # With LOCAL_MACROS the model reports no totals, so there is nothing to correct
+    if not LOCAL_MACROS:
+        for field in corrected:
+            metrics.inc(TOTALS_CORRECTIONS, field=field)
+
+def flag_off_target_days(preferences: MealPreference, meal_plan_data: dict) -> dict:
+    """Log and count the days whose meals miss the requested calorie target."""
+    missed = off_target_days(daily_macros(meal_plan_data.get("plan")), preferences.caloriesTarget)
+    if missed:
+        logger.warning(f"Days {missed} miss the {preferences.caloriesTarget} kcal target", extra={"stage": "nutrition", "days": missed})
+        metrics.inc(OFF_TARGET_DAYS, len(missed))
+    return meal_plan_data
+
+async def generate_missing_meals(preferences: MealPreference, existing: List[str], missing: int, deadline: Deadline) -> List[dict]:
+    """Ask the model for just ``missing`` meals that complete a day already holding ``existing``."""
+    expected_meals = preferences.mealsPerDay
+    if LOCAL_MACROS:
+        meal_example = '{"name": "...", "ingredients": [{"item": "...", "qty": "amount in g, ml, cups, spoons or pieces"}], "steps": ["..."]}'
+    else:
+        meal_example = '{"name": "...", "kcal": 450, "protein_g": 25, "carbs_g": 40, "fat_g": 15, "ingredients": [{"item": "...", "qty": "..."}], "steps": ["..."]}'
+    prompt = f"""
+A {preferences.dietType} day plan needs {expected_meals} meals but only has: {', '.join(existing) if existing else 'none'}.
+Create exactly {missing} additional meal(s) to complete the day.
+- Daily calorie target: {preferences.caloriesTarget or 'balanced'} kcal
+- Never use: {', '.join(preferences.allergies) if preferences.allergies else 'None'}
+- Avoid: {', '.join(preferences.dislikes) if preferences.dislikes else 'None'}
+- Cooking effort: {preferences.cookingEffort}
+
+Return JSON only:
+{{"meals": [{meal_example}]}}
 """
+    async with upstream_slots:
+        response = await create_completion(
+            "missing_meals",
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": "You are a nutritionist. Respond with JSON only."},
+                {"role": "user", "content": prompt},
+            ],
+            max_tokens=300 + 350 * missing,
+            temperature=0.3,
+            response_format={"type": "json_object"},
+            timeout=deadline.timeout(OPENAI_TIMEOUT_SECONDS),
+        )
+    extra = sanitize_meal_plan({"plan": [soft_json_parse(response.choices[0].message.content)]})
+    new_meals = [meal for meal in extra["plan"][0]["meals"] if isinstance(meal, dict)]
+    if len(new_meals) < missing:
+        raise ValueError(f"Expected {missing} meals, got {len(new_meals)}")
+    return new_meals[:missing]
+
+def find_allergen_defects(meal_plan_data: dict, preferences: MealPreference) -> List[PlanDefect]:
+    """Meals whose name, ingredients or steps mention an allergy or dislike, synonyms included."""
+    matcher = compile_matcher(preferences.allergies, preferences.dislikes)
+    if matcher.empty:
+        return []
+    defects = []
+    for day_idx, day in enumerate(meal_plan_data.get("plan") or []):
+        for meal_idx, meal in enumerate(day.get("meals") or []):
+            matches = matcher.find_in_meal(meal)
+            if not matches:
+                continue
+            allergy = next((match for match in matches if match.category == "allergy"), None)
+            match = allergy or matches[0]
+            defects.append(PlanDefect(
+                "allergen" if allergy else "dislike",
+                f"'{match.term}' found in Day {day_idx + 1}, Meal {meal_idx + 1}: {match.text}",
+                day=day_idx + 1,
+                meal_index=meal_idx,
+            ))
+    return defects
+
+async def screen_allergens(preferences: MealPreference, meal_plan_data: dict, deadline: Deadline) -> dict:
+    """
+    Replace meals that mention an allergy or dislike with new ones, asked for
+    together per day, and rebuild totals and groceries. Raises ValueError if
+    any flagged meal remains, so the attempt is retried.
+    """
+    defects = find_allergen_defects(meal_plan_data, preferences)
+    if not defects:
+        return meal_plan_data
+    logger.warning(f"{len(defects)} meal(s) flagged: {defects[0].reason}", extra={"stage": "allergens", "flagged": len(defects)})
+
+    for day_number in sorted({defect.day for defect in defects}):
+        meals = meal_plan_data["plan"][day_number - 1]["meals"]
+        flagged = sorted({defect.meal_index for defect in defects if defect.day == day_number})
+        kept = [meal.get("name", "") for index, meal in enumerate(meals) if index not in flagged]
+        replacements = iter(await generate_missing_meals(preferences, kept, len(flagged), deadline))
+        for index in flagged:
+            meals[index] = next(replacements)
+
+    meal_plan_data.pop("groceries", None)
+    meal_plan_data = sanitize_meal_plan(meal_plan_data)
+    recompute_totals(meal_plan_data)
+    remaining = find_allergen_defects(meal_plan_data, preferences)
+    if remaining:
+        raise ValueError(f"Meal still violates the profile after replacement: {remaining[0].reason}")
+    logger.info(f"Replaced {len(defects)} flagged meal(s)", extra={"stage": "allergens"})
+    return meal_plan_data
+
+async def complete_stored_day(preferences: MealPreference, stored: List[Optional[StoredMeal]], deadline: Deadline) -> dict:
+    """A 1-day plan of meals from the meal store, with only the empty slots generated."""
+    meals = [entry.meal if entry else None for entry in stored]
+    missing = meals.count(None)
+    if missing:
+        logger.info(f"Generating {missing} meal(s) around {len(meals) - missing} stored meal(s)", extra={"stage": "meal_store"})
+        new_meals = iter(await generate_missing_meals(preferences, [meal["name"] for meal in meals if meal], missing, deadline))
+        meals = [meal or next(new_meals) for meal in meals]
+    meal_plan_data = sanitize_meal_plan({"plan": [{"day": 1, "meals": meals}]})
+    recompute_totals(meal_plan_data)
+    return await screen_allergens(preferences, meal_plan_data, deadline)
+
+async def repair_meal_counts(preferences: MealPreference, meal_plan_data: dict, defects: List[PlanDefect], deadline: Deadline) -> dict:
+    """
+    Trim surplus meals locally and ask the model for only the missing meals
+    with a small prompt, instead of regenerating the whole plan.
+    """
+    expected_meals = preferences.mealsPerDay
+    for defect in defects:
+        if defect.kind == "extra_meals":
+            del meal_plan_data["plan"][defect.day - 1]["meals"][expected_meals:]
+
+    for defect in defects:
+        if defect.kind != "meal_count":
+            continue
+        day = meal_plan_data["plan"][defect.day - 1]
+        missing = expected_meals - len(day["meals"])
+        logger.info(f"Generating {missing} missing meal(s) for day {defect.day}", extra={"stage": "repair", "day": defect.day})
+        existing = [meal.get("name", "") for meal in day["meals"]]
+        day["meals"].extend(await generate_missing_meals(preferences, existing, missing, deadline))
+
+    recompute_totals(meal_plan_data)
+    logger.info(f"Meal counts repaired for {len(defects)} day(s)", extra={"stage": "repair"})
+    return meal_plan_data
+
+async def generation_attempt(preferences: MealPreference, messages: list, deadline: Deadline) -> dict:
+    """One upstream call, parsed and sanitized, with meal counts fixed in place where possible."""
+    async with upstream_slots:
+        response = await create_completion(
+            "plan",
+            model="gpt-4o",
+            messages=messages,
+            max_tokens=2500,
+            temperature=0.3,
+            response_format={"type": "json_object"},
+            timeout=deadline.timeout(OPENAI_TIMEOUT_SECONDS),
+        )
+
+    ai_response = response.choices[0].message.content.strip()
 
-        # ---------- USER MESSAGE (profile + knobs) ----------
-        user_payload = {
-            "profile": {
-                "age": preferences.age,
-                "weight_kg": preferences.weightKg,
-                "height_cm": preferences.heightCm,
-                "sex": preferences.sex,
-                "goal": preferences.goal,  # "lose weight" | "maintain" | "gain weight"
-                "diet_type": preferences.dietType,  # omnivore | vegan | vegetarian | keto | mediterranean | paleo
-                "cooking_effort": preferences.cookingEffort,  # quick and easy | gourmet | budget friendly
-                "calorie_target": preferences.caloriesTarget if preferences.caloriesTarget else None,
-                "allergies": preferences.allergies or [],
-                "dislikes": preferences.dislikes or [],
-                "avoid_meals": preferences.recentMeals or [],
-            },
-            # generation knobs
-            "timeframe_days": 1,
+    # Strict parse; if fails, soft repair
+    try:
+        meal_plan_data = json.loads(ai_response)
+        metrics.inc(JSON_PARSES, mode="strict")
+    except json.JSONDecodeError as e1:
+        logger.warning(f"Strict JSON parse failed: {e1}", extra={"stage": "parse", "chars": len(ai_response)})
+        log_payload(logger, "Malformed response payload", ai_response, LOG_PAYLOAD_SAMPLE_RATE, stage="parse")
+        try:
+            meal_plan_data = soft_json_parse(ai_response)
+        except Exception as e2:
+            logger.error(f"soft_json_parse failed: {e2}", extra={"stage": "parse", "chars": len(ai_response)})
+            raise ValueError(f"Bad AI JSON response: {str(e2)}") from e2
+
+    meal_plan_data = sanitize_meal_plan(meal_plan_data)
+    logger.debug("Plan sanitized", extra={"stage": "sanitize", "keys": list(meal_plan_data.keys())})
+    reconcile_plan_totals(meal_plan_data)
+    
+    # CRITICAL: Validate meal count matches request
+    defects = find_meal_count_defects(meal_plan_data, preferences.mealsPerDay)
+    if not defects:
+        return await screen_allergens(preferences, meal_plan_data, deadline)
+    logger.warning(f"Meal count mismatch: {'; '.join(defect.reason for defect in defects)}", extra={"stage": "validate"})
+
+    # Fix the affected days in place; only an empty plan needs a full retry
+    if all(defect.kind in ("extra_meals", "meal_count") for defect in defects):
+        try:
+            meal_plan_data = await repair_meal_counts(preferences, meal_plan_data, defects, deadline)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.warning(f"Partial meal regeneration failed: {e}", extra={"stage": "repair"})
+        else:
+            return await screen_allergens(preferences, meal_plan_data, deadline)
+    raise ValueError(f"AI generated the wrong number of meals: {defects[0].reason}") from PlanValidationError(defects)
+
+async def run_generation(preferences: MealPreference, cache_key: str, regenerate: bool = False) -> dict:
+    """
+    Call the model under the retry policy (backoff with jitter, one deadline
+    for all attempts, shared retry budget) and return a sanitized plan with
+    the requested meal count.
+    """
+    logger.info(
+        "Generating meal plan",
+        extra={
+            "stage": "generate",
+            "goal": preferences.goal,
             "meals_per_day": preferences.mealsPerDay,
-            "include_protein_shakes": preferences.includeProteinShakes,
-            "pricing_style_from_effort": price_style,
-            "diversity_requirements": {
-                "no_repeat_within_week": True,
-                "rotate_cuisines": True,
-                "rotate_proteins": True
-            },
-            "nonce": f"{int(time())}_{preferences.age}_{preferences.goal}_{preferences.sex}_{preferences.dietType}"
-        }
+            "protein_shakes": preferences.includeProteinShakes,
+        },
+    )
 
-        # -------- OpenAI Call with Retry Logic --------
-        max_retries = 5
-        meal_plan_data = None
-        
-        for attempt in range(1, max_retries + 1):
+    # Reuse proven meals from the meal store; only the empty slots cost tokens
+    if not regenerate and MEAL_STORE_MAX_FILL > 0:
+        stored = (await meal_store.lookup(preferences, days=1, max_fill=MEAL_STORE_MAX_FILL))[0]
+        if any(stored):
+            logger.info(f"Reusing {len(stored) - stored.count(None)}/{len(stored)} meals from the meal store", extra={"stage": "meal_store"})
             try:
-                print(f"🔄 Attempt {attempt} of {max_retries}")
-                
-                response = openai_client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "assistant", "content": "Return ONLY one valid JSON object. No markdown."},
-                        {"role": "user", "content": json.dumps(user_payload)}
-                    ],
-                    max_tokens=2500,
-                    temperature=0.3,
-                    response_format={"type": "json_object"}
-                )
+                return flag_off_target_days(preferences, await retry_policy.run(lambda deadline: complete_stored_day(preferences, stored, deadline)))
+            except Exception as e:
+                logger.warning(f"Completing stored meals failed, generating the full plan: {e}", extra={"stage": "meal_store"})
 
-                ai_response = response.choices[0].message.content.strip()
-                print(f"✅ AI JSON received: {len(ai_response)} chars")
-
-                # Strict parse; if fails, soft repair
-                try:
-                    meal_plan_data = json.loads(ai_response)
-                    print("✅ JSON parsed strictly")
-                except json.JSONDecodeError as e1:
-                    print(f"⚠️ Strict JSON parse failed: {e1}")
-                    try:
-                        meal_plan_data = soft_json_parse(ai_response)
-                        print("✅ soft_json_parse succeeded")
-                    except Exception as e2:
-                        print(f"❌ soft_json_parse failed: {e2}")
-                        print(f"Raw response (head): {ai_response[:400]}...")
-                        print(f"Raw response (tail): ...{ai_response[-400:]}")
-                        raise HTTPException(status_code=502, detail=f"Bad AI JSON response: {str(e2)}")
-
-                meal_plan_data = sanitize_meal_plan(meal_plan_data)
-                print(f"🔍 Keys after sanitization: {list(meal_plan_data.keys())}")
-                
-                # CRITICAL: Validate meal count matches request
-                if meal_plan_data.get("plan") and len(meal_plan_data["plan"]) > 0:
-                    meals = meal_plan_data["plan"][0].get("meals", [])
-                    actual_meal_count = len(meals)
-                    expected_meal_count = preferences.mealsPerDay
-                    print(f"🔍 MEAL COUNT CHECK: Got {actual_meal_count} meals, expected {expected_meal_count}")
-                    
-                    if actual_meal_count == expected_meal_count:
-                        print(f"✅ MEAL COUNT MATCHES: {actual_meal_count} meals generated as expected")
-                        return meal_plan_data
+    messages = build_generation_messages(preferences, cache_key, regenerate)
+
+    # -------- OpenAI Call with Retry Logic --------
+    try:
+        return flag_off_target_days(preferences, await retry_policy.run(lambda deadline: generation_attempt(preferences, messages, deadline)))
+    except Exception as e:
+        logger.error(f"Generation failed: {e}", extra={"stage": "generate"})
+        raise HTTPException(status_code=502, detail=f"Failed to generate meal plan: {str(e)}")
+
+async def generate_and_cache(preferences: MealPreference, cache_key: str, regenerate: bool) -> JSONPayload:
+    meal_plan_data = await run_generation(preferences, cache_key, regenerate)
+    # Serialized once, for the cache and every response sharing this generation
+    plan = JSONPayload.from_data(meal_plan_data)
+    await plan_cache.set_payload(cache_key, plan)
+    await meal_store.add_plan(meal_plan_data, preferences)
+    return plan
+
+async def cached_or_generated_plan(
+    preferences: MealPreference,
+    regenerate: bool = False,
+    idempotency_key: Optional[str] = None,
+    endpoint: str = "generate",
+) -> JSONPayload:
+    """
+    Serve the cached plan for this profile, or generate one (coalescing
+    identical in-flight requests). With LOCAL_PLAN_FAST_PATH, profiles the
+    recipe corpus fully covers are planned locally without calling the model.
+    The end-to-end time is recorded with where the plan came from. Plans
+    come back as JSON bytes, cached ones exactly as stored.
+    """
+    with metrics.timer(GENERATION_SECONDS, endpoint=endpoint, source="generated") as labels:
+        if LOCAL_PLAN_FAST_PATH and not regenerate and is_simple_profile(preferences):
+            logger.info("Serving local meal plan for simple profile", extra={"stage": "local_plan"})
+            labels["source"] = "local"
+            return JSONPayload.from_data(local_meal_plan(preferences, days=LOCAL_PLAN_DAYS))
+
+        cache_key = plan_cache_key(preferences, scope=PLAN_CACHE_SCOPE)
+        if regenerate:
+            plan_cache.record_bypass()
+        else:
+            cached_plan = await plan_cache.get_payload(cache_key)
+            if cached_plan is not None:
+                logger.info("Serving meal plan from cache", extra={"stage": "cache"})
+                labels["source"] = "cache"
+                return cached_plan
+
+        return await generation_flights.do(
+            flight_key(cache_key, idempotency_key, regenerate),
+            lambda: generate_and_cache(preferences, cache_key, regenerate),
+        )
+
+@app.post("/generate")
+async def generate_meal_plan(
+    preferences: MealPreference,
+    regenerate: bool = False,
+    idempotency_key: Optional[str] = Header(None),
+):
+    """Generate a personalized meal plan using GPT-4.1"""
+    try:
+        return json_response(await cached_or_generated_plan(preferences, regenerate, idempotency_key))
+
+    except Exception as e:
+        # Fall back to an offline plan so the app never hard-fails in front of users
+        logger.exception(f"Meal plan generation error, returning the local plan: {e}", extra={"stage": "fallback"})
+        return json_response(fallback_meal_plan(preferences))
+
+@app.post("/generate/batch")
+async def generate_meal_plan_batch(request: BatchGenerateRequest, regenerate: bool = False):
+    """
+    Generate plans for several profiles (e.g. family members) in one call.
+    Identical profiles are generated once and up to BATCH_CONCURRENCY run at
+    a time. Results come back in request order, each with its plan or error.
+    """
+    profiles = request.profiles
+    if not 1 <= len(profiles) <= MAX_BATCH_PROFILES:
+        raise HTTPException(status_code=422, detail=f"Send between 1 and {MAX_BATCH_PROFILES} profiles, got {len(profiles)}")
+
+    keys = [plan_cache_key(preferences, scope=PLAN_CACHE_SCOPE) for preferences in profiles]
+    logger.info(f"Batch of {len(profiles)} profiles ({len(set(keys))} unique)", extra={"stage": "batch"})
+    outcomes = await gather_unique(
+        keys,
+        lambda index: cached_or_generated_plan(profiles[index], regenerate, endpoint="batch"),
+        BATCH_CONCURRENCY,
+    )
+
+    results = []
+    for index, outcome in enumerate(outcomes):
+        if isinstance(outcome, Exception):
+            logger.warning(f"Batch profile {index} failed: {outcome}", extra={"stage": "batch"})
+            detail = outcome.detail if isinstance(outcome, HTTPException) else str(outcome)
+            results.append({"index": index, "status": "error", "error": detail})
+        else:
+            results.append({"index": index, "status": "ok", "plan": outcome.data()})
+    return json_response({"results": results, "unique_profiles": len(set(keys))})
+
+async def stream_generation(preferences: MealPreference, cache_key: str, deadline: Deadline, regenerate: bool = False) -> AsyncIterator[dict]:
+    """
+    Yield a "meal" event as soon as the model finishes each meal, then the
+    sanitized "plan". The stream is abandoned once ``deadline`` passes.
+    """
+    messages = build_generation_messages(preferences, cache_key, regenerate)
+    scanner = MealStreamScanner()
+
+    async with upstream_slots:
+        stream = await create_completion(
+            "stream",
+            model="gpt-4o",
+            messages=messages,
+            max_tokens=2500,
+            temperature=0.3,
+            response_format={"type": "json_object"},
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout=deadline.timeout(OPENAI_TIMEOUT_SECONDS),
+        )
+        async for chunk in stream:
+            # The timeout bounds each read, not the whole stream
+            if deadline.expired:
+                raise DeadlineExceeded("Request deadline exceeded while streaming")
+            # The final chunk carries the usage for the whole stream and no choices
+            metrics.record_usage("gpt-4o", chunk)
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            for day_index, meal_index, meal in scanner.feed(chunk.choices[0].delta.content):
+                if LOCAL_MACROS:
+                    apply_meal_macros([{"meals": [meal]}])
+                yield {"type": "meal", "day": day_index + 1, "index": meal_index, "meal": meal}
+
+    # The scanner has already parsed (and if needed repaired) the whole stream
+    try:
+        meal_plan_data = scanner.close()
+    except ValueError:
+        metrics.inc(JSON_PARSES, mode="failed")
+        raise
+    metrics.inc(JSON_PARSES, mode="repaired" if scanner.repairs else "strict")
+    if scanner.repairs:
+        logger.warning(f"JSON repairs applied: {', '.join(scanner.repairs)}", extra={"stage": "parse", "repairs": scanner.repairs})
+    if not isinstance(meal_plan_data, dict):
+        raise ValueError("Expected a JSON object")
+
+    meal_plan_data = sanitize_meal_plan(meal_plan_data)
+    meals = meal_plan_data["plan"][0]["meals"] if meal_plan_data["plan"] else []
+    if len(meals) != preferences.mealsPerDay:
+        raise ValueError(f"AI generated {len(meals)} meals instead of {preferences.mealsPerDay}")
+    # Meals were already streamed, so a flagged meal sends the client back to the regular path
+    defects = find_allergen_defects(meal_plan_data, preferences)
+    if defects:
+        raise ValueError(f"Streamed plan violates the profile: {defects[0].reason}")
+    reconcile_plan_totals(meal_plan_data)
+    yield {"type": "plan", "plan": flag_off_target_days(preferences, meal_plan_data)}
+
+def plan_event_lines(plan: JSONPayload, **extra) -> List[bytes]:
+    """Replay a finished plan as the NDJSON lines a live stream produces; the plan itself is sent as stored."""
+    lines = [
+        event_line({"type": "meal", "day": day.get("day", day_idx + 1), "index": meal_idx, "meal": meal})
+        for day_idx, day in enumerate(plan.data().get("plan", []))
+        for meal_idx, meal in enumerate(day.get("meals", []))
+    ]
+    lines.append(plan_event_line(plan, **extra))
+    return lines
+
+@app.post("/generate/stream")
+async def generate_meal_plan_stream(preferences: MealPreference, regenerate: bool = False):
+    """
+    Stream a meal plan as NDJSON. Each line is an event:
+    - {"type": "meal", "day", "index", "meal"} as soon as a meal is complete
+    - {"type": "reset", "reason"} if the streamed attempt failed; discard earlier meals
+    - {"type": "plan", "plan"} last, with the sanitized plan including totals and groceries
+    """
+    cache_key = plan_cache_key(preferences, scope=PLAN_CACHE_SCOPE)
+
+    async def events():
+        # Timed until the last event is sent, not just until the response starts
+        with metrics.timer(GENERATION_SECONDS, endpoint="stream", source="generated") as labels:
+            if regenerate:
+                plan_cache.record_bypass()
+            else:
+                cached_plan = await plan_cache.get_payload(cache_key)
+                if cached_plan is not None:
+                    labels["source"] = "cache"
+                    for line in plan_event_lines(cached_plan, cached=True):
+                        yield line
+                    return
+
+            try:
+                # The stream gets the same overall deadline a non-streamed attempt would
+                deadline = Deadline(retry_policy.deadline_seconds)
+                async for event in stream_generation(preferences, cache_key, deadline, regenerate):
+                    if event["type"] == "plan":
+                        plan = JSONPayload.from_data(event["plan"])
+                        await plan_cache.set_payload(cache_key, plan)
+                        await meal_store.add_plan(event["plan"], preferences)
+                        yield plan_event_line(plan)
                     else:
-                        print(f"🚨 MEAL COUNT MISMATCH: Expected {expected_meal_count}, got {actual_meal_count}")
-                        if attempt < max_retries:
-                            print(f"🔄 Retrying... (attempt {attempt + 1}/{max_retries})")
-                            continue
-                        else:
-                            raise HTTPException(
-                                status_code=502, 
-                                detail=f"AI generated {actual_meal_count} meals instead of {expected_meal_count} after {max_retries} attempts."
-                            )
-                else:
-                    print("⚠️ No meals found in response structure")
-                    if attempt < max_retries:
-                        print(f"🔄 Retrying... (attempt {attempt + 1}/{max_retries})")
-                        continue
-            except HTTPException:
-                raise  # Re-raise HTTP exceptions immediately
+                        yield event_line(event)
+                return
             except Exception as e:
-                print(f"❌ Error on attempt {attempt}: {e}")
-                if attempt >= max_retries:
-                    raise HTTPException(status_code=502, detail=f"Failed after {max_retries} attempts: {str(e)}")
-                print(f"🔄 Retrying... (attempt {attempt + 1}/{max_retries})")
-        
-        raise HTTPException(status_code=502, detail="Failed to generate meal plan after all retries")
+                logger.warning(f"Streamed generation failed: {e}", extra={"stage": "stream"})
+                yield event_line({"type": "reset", "reason": str(e)})
 
-    except Exception as e:
-        print(f"❌ Meal plan generation error: {e}")
-        print(f"❌ Error type: {type(e).__name__}")
-        print(f"❌ Error details: {str(e)}")
-        import traceback
-        print(f"❌ Full traceback: {traceback.format_exc()}")
-        # Keep your mock so the app never hard-fails in front of users
-        print("🔄 Returning mock response due to error")
-        mock_response = {
-            "plan": [
-                {
-                    "day": 1,
-                    "meals": [
-                        {
-                            "name": "Breakfast: Oatmeal with berries",
-                            "kcal": 350,
-                            "protein_g": 12,
-                            "carbs_g": 65,
-                            "fat_g": 8,
-                            "ingredients": [
-                                {"item": "Rolled oats", "qty": "1/2 cup"},
-                                {"item": "Mixed berries", "qty": "1/2 cup"},
-                                {"item": "Almond milk", "qty": "1 cup"}
-                            ],
-                            "steps": [
-                                "Cook oats with almond milk for 5 minutes",
-                                "Top with fresh berries",
-                                "Serve warm"
-                            ]
-                        },
-                        {
-                            "name": "Lunch: Grilled chicken salad",
-                            "kcal": 450,
-                            "protein_g": 35,
-                            "carbs_g": 25,
-                            "fat_g": 20,
-                            "ingredients": [
-                                {"item": "Chicken breast", "qty": "150g"},
-                                {"item": "Mixed greens", "qty": "2 cups"},
-                                {"item": "Olive oil", "qty": "1 tbsp"}
-                            ],
-                            "steps": [
-                                "Grill chicken breast until cooked through",
-                                "Toss greens with olive oil",
-                                "Slice chicken and serve over salad"
-                            ]
-                        },
-                        {
-                            "name": "Dinner: Salmon with quinoa",
-                            "kcal": 500,
-                            "protein_g": 40,
-                            "carbs_g": 45,
-                            "fat_g": 25,
-                            "ingredients": [
-                                {"item": "Salmon fillet", "qty": "150g"},
-                                {"item": "Quinoa", "qty": "1/2 cup"},
-                                {"item": "Broccoli", "qty": "1 cup"}
-                            ],
-                            "steps": [
-                                "Cook quinoa according to package directions",
-                                "Pan-sear salmon for 4-5 minutes per side",
-                                "Steam broccoli until tender",
-                                "Serve salmon over quinoa with broccoli"
-                            ]
-                        }
-                    ]
-                }
-            ],
-            "totals": {
-                "kcal": 1300,
-                "protein_g": 87,
-                "carbs_g": 135,
-                "fat_g": 53
-            },
-            "groceries": [
-                {"category": "Proteins", "items": ["Chicken breast", "Salmon fillet"]},
-                {"category": "Grains", "items": ["Rolled oats", "Quinoa"]},
-                {"category": "Vegetables", "items": ["Mixed greens", "Broccoli", "Mixed berries"]},
-                {"category": "Dairy/Alternatives", "items": ["Almond milk"]},
-                {"category": "Pantry", "items": ["Olive oil"]}
-            ]
-        }
-        return mock_response
+            # Fall back to the regular generation path (with retries), then the local plan
+            try:
+                plan = await generation_flights.do(
+                    flight_key(cache_key, None, regenerate),
+                    lambda: generate_and_cache(preferences, cache_key, regenerate),
+                )
+                fallback = {}
+            except Exception as e:
+                logger.error(f"Meal plan generation error, streaming the local plan: {e}", extra={"stage": "fallback"})
+                labels["source"] = "fallback"
+                plan, fallback = JSONPayload.from_data(fallback_meal_plan(preferences)), {"fallback": True}
+            for line in plan_event_lines(plan, **fallback):
+                yield line
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@app.post("/jobs", status_code=202)
+async def submit_job(preferences: MealPreference, regenerate: bool = False):
+    """
+    Queue a meal plan generation and return its job ID right away, so slow
+    generations are not cut off by proxy or platform request timeouts.
+    """
+    try:
+        job = await job_runner.submit({"preferences": preferences.model_dump(mode="json"), "regenerate": regenerate})
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=f"Too many queued jobs: {str(e)}")
+    logger.info("Queued generation job", extra={"stage": "jobs", "job_id": job["id"]})
+    return job_summary(job)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = Query(0, ge=0)):
+    """Job status, progress and result; ?wait=N long-polls up to N seconds for it to finish."""
+    job = await job_runner.wait(job_id, min(wait, JOB_MAX_WAIT_SECONDS))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events with every status/progress change of a job, ending with its result."""
+    if await job_runner.store.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(
+        job_event_stream(job_runner, job_id, JOB_EVENTS_MAX_SECONDS, JOB_EVENTS_HEARTBEAT_SECONDS),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Latency, token, retry, JSON repair and fallback metrics for every worker process, in the Prometheus text format."""
+    return Response(await metrics.render(), media_type=METRICS_CONTENT_TYPE)
 
 @app.get("/")
 async def root():
@@ -603,12 +1186,16 @@ async def root():
         "version": "1.1.1",
         "endpoints": {
             "health": "/health",
-            "generate": "/generate"
+            "generate": "/generate",
+            "generate_stream": "/generate/stream",
+            "generate_batch": "/generate/batch",
+            "jobs": "/jobs",
+            "metrics": "/metrics"
         }
     }
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", "8420"))
-    print(f"🚀 Starting NutriAI Worker Service on port {port}...")
+    logger.info(f"Starting NutriAI Worker Service on port {port}")
     uvicorn.run(app, host="0.0.0.0", port=port, log_level="info")
@@ -5,8 +5,6 @@ Simple FastAPI service for AI meal plan generation
 """
 
 import os
-import json
-import re
 from datetime import datetime
 from time import time
 from typing import List, Dict
@@ -17,6 +15,8 @@ from pydantic import BaseModel
 from openai import OpenAI
 from dotenv import load_dotenv
 
+from worker.services.json_stream import parse_json_with_repairs
+
 # Load environment variables
 load_dotenv()
 
@@ -170,36 +170,14 @@ CRITICAL: Return ONLY valid JSON. No markdown, no explanations, no extra text.""
         ai_response = response.choices[0].message.content.strip()
         print(f"✅ AI JSON received: {len(ai_response)} chars")
 
-        # Clean up JSON
-        ai_response = ai_response.replace('```json', '').replace('```', '').strip()
-        ai_response = ai_response.replace("'", '"')
-        ai_response = re.sub(r',(\s*[}\]])', r'\1', ai_response)
-
-        # Try to fix unterminated strings/objects
-        if ai_response.count('{') != ai_response.count('}'):
-            print("🔧 Attempting to fix unbalanced braces...")
-            brace_count = 0
-            last_valid_pos = 0
-            for i, char in enumerate(ai_response):
-                if char == '{':
-                    brace_count += 1
-                elif char == '}':
-                    brace_count -= 1
-                    if brace_count == 0:
-                        last_valid_pos = i + 1
-            
-            if last_valid_pos > 0:
-                ai_response = ai_response[:last_valid_pos]
-                while ai_response.count('[') > ai_response.count(']'):
-                    ai_response += ']'
-                while ai_response.count('{') > ai_response.count('}'):
-                    ai_response += '}'
-                print(f"🔧 Truncated response to {len(ai_response)} characters")
-
         # Parse JSON
         try:
-            meal_plan_data = json.loads(ai_response)
-            print("✅ JSON parsed successfully")
+            # Single pass: strips fences, trailing commas and inner quotes, and
+            # closes a truncated tail without touching apostrophes
+            meal_plan_data, repairs = parse_json_with_repairs(ai_response)
+            if not isinstance(meal_plan_data, dict):
+                raise ValueError("Expected a JSON object")
+            print(f"✅ JSON parsed successfully{' (repairs: ' + ', '.join(repairs) + ')' if repairs else ''}")
             
             # Ensure required fields exist
             if "plan" not in meal_plan_data:
@@ -211,7 +189,7 @@ CRITICAL: Return ONLY valid JSON. No markdown, no explanations, no extra text.""
             
             return meal_plan_data
             
-        except json.JSONDecodeError as e:
+        except ValueError as e:
             print(f"❌ JSON parsing failed: {e}")
             print(f"Raw response (head): {ai_response[:400]}...")
             print(f"Raw response (tail): ...{ai_response[-400:]}")
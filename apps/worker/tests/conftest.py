@@ -0,0 +1,44 @@
+import atexit
+import os
+import shutil
+import tempfile
+import pytest
+
+# main.py opens its stores at import, so point them away from the shared temp files before any test imports it
+_STORE_DIR = tempfile.mkdtemp(prefix="wellplate-tests-")
+atexit.register(shutil.rmtree, _STORE_DIR, True)
+_STORE_FILES = {
+    "JOBS_PATH": "jobs.sqlite3",
+    "MEAL_STORE_PATH": "meals.sqlite3",
+    "METRICS_PATH": "metrics.sqlite3",
+    "PLAN_CACHE_PATH": "plan-cache.sqlite3",
+}
+for _name, _file in _STORE_FILES.items():
+    os.environ[_name] = os.path.join(_STORE_DIR, _file)
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+
+from worker.config import settings  # noqa: E402
+from worker.schemas import MealPreference  # noqa: E402
+
+@pytest.fixture(autouse=True)
+def isolated_store_paths(monkeypatch, tmp_path):
+    """Give every test its own job, meal, metrics and plan cache files."""
+    for name, file in _STORE_FILES.items():
+        monkeypatch.setattr(settings, name, str(tmp_path / file))
+        monkeypatch.setenv(name, str(tmp_path / file))
+
+@pytest.fixture
+def make_preferences():
+    """Build a MealPreference for a typical profile, with any field overridden."""
+    def make(**overrides):
+        values = dict(
+            age=30, weightKg=70.0, heightCm=170, sex="male", goal="maintain",
+            dietType="omnivore", cookingEffort="quick", caloriesTarget=2000,
+        )
+        values.update(overrides)
+        return MealPreference(**values)
+    return make
+
+@pytest.fixture
+def sample_preferences(make_preferences):
+    return make_preferences(allergies=["nuts"], dislikes=["mushrooms"])
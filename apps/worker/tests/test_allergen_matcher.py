@@ -0,0 +1,125 @@
+import time
+import pytest
+from worker.schemas import MealPreference
+from worker.services.allergen_matcher import allergen_tags, compile_matcher, tags_for_term
+from worker.services.openai_client import OpenAIClient
+
+@pytest.mark.parametrize("text, expected", [
+    ("Almond flour pancakes", ["almond"]),
+    ("Basil pesto pasta", ["pesto"]),
+    ("Greek yogurt with honey", ["yogurt"]),
+    ("Toast with ghee", ["ghee"]),
+    ("Fried egg on toast", ["egg"]),
+    ("Walnuts and raisins", ["walnut"]),
+])
+def test_group_terms_expand_to_synonyms(text, expected):
+    """Test that allergy groups match ingredients the naive substring test missed."""
+    matcher = compile_matcher(["Tree nuts", "milk allergy", "eggs"])
+    assert [match.text for match in matcher.find(text)] == expected
+
+@pytest.mark.parametrize("text", [
+    "Coconut milk curry",
+    "Roasted eggplant",
+    "Peanut butter toast",
+    "Nutmeg spiced oats",
+    "Butternut squash soup",
+    "Water chestnut stir-fry",
+    "Sprinkle with nutritional yeast",
+])
+def test_safe_phrases_and_word_boundaries_avoid_false_positives(text):
+    """Test that look-alike ingredients are not flagged."""
+    matcher = compile_matcher(["nuts", "dairy", "eggs"])
+    assert matcher.find(text) == []
+
+def test_dislikes_literal_terms_and_allergy_precedence():
+    """Test that dislikes match literally (plurals included) and an allergy wins over a dislike of the same group."""
+    matcher = compile_matcher(["fish"], ["mushrooms", "salmon", "kiwi"])
+    matches = matcher.find("Grilled salmon with mushroom sauce and kiwi")
+    assert {(match.term, match.category) for match in matches} == {
+        ("fish", "allergy"), ("salmon", "dislike"), ("mushrooms", "dislike"), ("kiwi", "dislike"),
+    }
+    assert [match.category for match in compile_matcher(["nuts"], ["tree nuts"]).find("cashews")] == ["allergy"]
+    assert compile_matcher(["fish"], ["mushrooms", "salmon", "kiwi"]) is matcher
+    assert compile_matcher().empty
+
+def test_dislikes_are_not_expanded_to_allergen_groups():
+    """Test that a disliked food flags itself, its plural and true synonyms, not the rest of its allergen group."""
+    matcher = compile_matcher([], ["cheese", "eggplant", "scallions", "chicken breast"])
+    assert matcher.find("Greek yogurt with butter, cream and whole milk") == []
+    assert [match.text for match in matcher.find("Grilled cheeses on toast")] == ["cheese"]
+    assert [(match.term, match.text) for match in matcher.find("Aubergine stir-fry with spring onions")] == [
+        ("eggplant", "aubergine"), ("scallions", "spring onions"),
+    ]
+    # Aliases broader than the dislike itself are not synonyms
+    assert matcher.find("Chicken thighs with rice") == []
+    # The same word as an allergy still covers the whole group
+    assert [match.text for match in compile_matcher(["cheese"]).find("Greek yogurt")] == ["yogurt"]
+
+@pytest.mark.parametrize("text, expected", [
+    ("Peach cobbler", []),
+    ("Roast cornish hen", []),
+    ("Grilled eggplant", []),
+    ("Hamburger with fries", []),
+    ("Peas and sweet corn", ["pea", "corn"]),
+    ("Scrambled eggs with ham", ["egg", "ham"]),
+    ("Strawberry smoothie", ["strawberry"]),
+    ("Berry bowl with cherry tomatoes", ["berry", "tomato"]),
+])
+def test_literal_terms_end_at_a_word_boundary_and_match_their_plurals(text, expected):
+    """Test that literal terms are whole words up to a plural ending, with "-ies" plurals and kinds of the food."""
+    matcher = compile_matcher(["pea", "corn"], ["egg", "ham", "berries", "tomato"])
+    assert [match.text for match in matcher.find(text)] == expected
+    assert compile_matcher([], ["tomatoes", "berries"]).find("Tomato-free salsa, berry-free jam") == []
+
+@pytest.mark.parametrize("text, expected", [
+    ("Gluten-free bread with jam", []),
+    ("Gluten free pasta and wheat bread", ["wheat", "bread"]),
+    ("Dairy-free cheese with oat crackers", ["cracker"]),
+    ("Lactose-free milk, then plain yogurt", ["yogurt"]),
+])
+def test_free_negates_the_rest_of_its_phrase(text, expected):
+    """Test that "<allergen>-free" rules out that group in its own phrase only."""
+    matcher = compile_matcher(["gluten", "dairy"])
+    assert [match.text for match in matcher.find(text)] == expected
+
+def test_term_lookup_and_tags():
+    """Test that free-text allergies resolve onto the table's groups."""
+    assert tags_for_term("Lactose intolerance") == ["dairy"]
+    assert tags_for_term("Peanuts") == ["peanuts"]
+    assert sorted(tags_for_term("seafood")) == ["fish", "shellfish"]
+    assert tags_for_term("kiwi") == []
+    assert allergen_tags("Salmon glazed with soy sauce and sesame seeds") == {"fish", "soy", "sesame", "gluten"}
+
+def test_validation_flags_synonyms_and_dislikes_per_meal():
+    """Test that plan validation reports one defect per offending term and meal, with its location."""
+    client = OpenAIClient()
+    preferences = MealPreference(
+        age=30, weightKg=70.0, heightCm=170, sex="male", goal="maintain", dietType="omnivore",
+        allergies=["tree nuts"], dislikes=["cilantro"], cookingEffort="quick",
+    )
+    meal = {"kcal": 500, "protein_g": 30.0, "carbs_g": 50.0, "fat_g": 15.0}
+    data = {
+        "plan": [
+            {"day": 1, "meals": [
+                {**meal, "name": "Pancakes", "ingredients": [{"item": "Almond flour", "qty": "80g"}, {"item": "Almonds", "qty": "10g"}], "steps": ["Cook"]},
+                {**meal, "name": "Coconut curry", "ingredients": [{"item": "Coconut milk", "qty": "200ml"}], "steps": ["Top with cilantro"]},
+            ]},
+        ],
+        "totals": {"kcal": 2000},
+        "groceries": [],
+    }
+    defects = [d for d in client._find_plan_defects(data, preferences) if d.kind in ("allergen", "dislike")]
+    assert [(d.kind, d.day, d.meal_index) for d in defects] == [("allergen", 1, 0), ("dislike", 1, 1)]
+
+def test_scan_is_fast_for_a_full_week():
+    """Test that a 7-day, 6-meal plan is scanned in a few milliseconds."""
+    matcher = compile_matcher(["nuts", "dairy", "gluten", "shellfish"], ["mushrooms", "olives"])
+    meal = {
+        "name": "Chicken and vegetable rice bowl",
+        "ingredients": [{"item": f"ingredient {i}", "qty": "1"} for i in range(10)],
+        "steps": ["Cook the rice and vegetables, then combine everything in a bowl"] * 4,
+    }
+    start = time.perf_counter()
+    for _ in range(42):
+        assert matcher.find_in_meal(meal) == []
+    assert time.perf_counter() - start < 0.05
@@ -0,0 +1,49 @@
+import random
+from fastapi.testclient import TestClient
+from benchmarks.fake_llm import FakeLLMConfig, create_app, describe_request, malform, make_content
+from benchmarks.load import parse_counter, percentile
+from worker.services.json_stream import parse_json_with_repairs
+from worker.services.openai_client import OpenAIClient
+
+def test_fake_answers_the_shape_each_prompt_asks_for(make_preferences):
+    """Test that the fake reads days, meal counts and the calorie target from the worker's prompts."""
+    client = OpenAIClient(object())
+    preferences = make_preferences(mealsPerDay=4, caloriesTarget=2400)
+    themes = client._day_themes(preferences)
+
+    shape = describe_request(client._days_messages(preferences, [3, 4], themes))
+    assert (shape.kind, shape.days, shape.meals_per_day, shape.calorie_target) == ("plan", [3, 4], 4, 2400)
+    week = make_content(random.Random(0), describe_request(client._week_messages(preferences)), wrong_count=False)
+    assert client._find_plan_defects(week, preferences) == []
+
+    wrong = make_content(random.Random(0), describe_request(client._week_messages(preferences)), wrong_count=True)
+    assert sorted({len(day["meals"]) for day in wrong["plan"]}) != [4]
+
+def test_malformed_responses_are_repairable_except_prose():
+    """Test that injected JSON faults are the kinds the repairing parser is meant to recover."""
+    rng = random.Random(0)
+    content = '{"meals": [{"name": "Oats", "kcal": 400}]}'
+    for kind in ("fence", "trailing_comma"):
+        assert parse_json_with_repairs(malform(rng, content, kind))[0] == {"meals": [{"name": "Oats", "kcal": 400}]}
+    assert "{" not in malform(rng, content, "prose")
+
+def test_fake_server_counts_calls_and_injects_errors():
+    """Test the fake's completions, usage and error injection over HTTP."""
+    app = create_app(FakeLLMConfig(latency="fixed:0", tokens_per_second=0, error_rate=1.0, seed=1))
+    with TestClient(app) as http:
+        response = http.post("/v1/chat/completions", json={"model": "gpt-4o", "messages": [{"role": "user", "content": "Create a 1-day meal plan"}]})
+        assert response.status_code in (429, 500) and "error" in response.json()
+        assert http.get("/stats").json()["errors"] == 1
+
+    app = create_app(FakeLLMConfig(latency="fixed:0", tokens_per_second=0, seed=1))
+    with TestClient(app) as http:
+        body = http.post("/v1/chat/completions", json={"model": "gpt-4o", "messages": [{"role": "user", "content": "Create a 1-day meal plan"}]}).json()
+        assert body["usage"]["completion_tokens"] > 0
+        assert len(parse_json_with_repairs(body["choices"][0]["message"]["content"])[0]["plan"][0]["meals"]) == 3
+
+def test_load_report_helpers():
+    """Test nearest-rank percentiles and summing a counter across label sets."""
+    values = [float(value) for value in range(1, 101)]
+    assert (percentile(values, 50), percentile(values, 99), percentile([], 95)) == (50.0, 99.0, 0.0)
+    text = 'x_total{cause="parse"} 2\nx_total{cause="timeout"} 3\nx_total_other 9\n'
+    assert parse_counter(text, "x_total") == 5
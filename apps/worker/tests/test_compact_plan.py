@@ -0,0 +1,46 @@
+import asyncio
+from worker.services.compact_plan import CompactPlan
+from worker.services.local_planner import local_meal_plan
+from worker.services.plan_cache import PlanCache
+from worker.services.plan_payload import JSONPayload, validated_plan_payload
+
+def test_round_trip_rebuilds_the_same_json(make_preferences):
+    """Test that a plan converted to CompactPlan and back serializes to identical bytes."""
+    plan = validated_plan_payload(local_meal_plan(make_preferences(mealsPerDay=6))).data()
+    plan["groceries"][0]["quantities"] = {"Oats": "80 g", "Milk": "1 l"}
+    plan["plan"][0]["meals"][0]["steps"] = ["", "Line\nbreak", ""]
+    payload = JSONPayload.from_data(plan)
+
+    compact = CompactPlan.from_payload(payload)
+    assert compact is not None
+    assert compact.to_payload().body == payload.body
+    assert compact.to_dict() == payload.data()
+    assert len(compact.kcal) == len(compact.names) == 42
+
+def test_plans_share_pooled_strings(make_preferences):
+    """Test that ingredient names and quantities from different plans are the same objects."""
+    first = CompactPlan.from_payload(validated_plan_payload(local_meal_plan(make_preferences())))
+    second = CompactPlan.from_payload(validated_plan_payload(local_meal_plan(make_preferences(age=31))))
+    shared = set(first.items) & set(second.items)
+    assert shared
+    for item in shared:
+        assert first.items[first.items.index(item)] is second.items[second.items.index(item)]
+
+def test_other_shapes_are_not_compacted(make_preferences):
+    """Test that plans CompactPlan cannot rebuild exactly stay as JSON in the cache."""
+    main_plan = {"plan": [{"day": 1, "meals": [{"name": "Oats", "kcal": 400, "ingredients": ["oats"], "instructions": "Cook"}]}]}
+    assert CompactPlan.from_payload(JSONPayload.from_data(main_plan)) is None
+
+    plan = local_meal_plan(make_preferences())
+    cache = PlanCache(path=None)
+
+    async def scenario():
+        await cache.set("main", main_plan)
+        await cache.set_payload("worker", validated_plan_payload(plan))
+        return await cache.get("main"), await cache.get_payload("worker")
+
+    main_hit, worker_hit = asyncio.run(scenario())
+    assert main_hit == main_plan
+    assert isinstance(cache._memory["main"][1], bytes)
+    assert isinstance(cache._memory["worker"][1], CompactPlan)
+    assert worker_hit.body == validated_plan_payload(plan).body
@@ -0,0 +1,76 @@
+import asyncio
+import json
+import re
+from types import SimpleNamespace
+import pytest
+from worker.config import settings
+from worker.schemas import MealPlanResponse, MealPreference
+from worker.services.openai_client import OpenAIClient
+
+class FakeCompletions:
+    """Stands in for AsyncOpenAI.chat.completions and answers per-day prompts."""
+
+    def __init__(self, meals_per_day):
+        self.meals_per_day = meals_per_day
+        self.active = 0
+        self.max_active = 0
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(0.01)
+        self.active -= 1
+
+        prompt = kwargs["messages"][-1]["content"]
+        days = [int(d) for d in re.search(r"Create days ([\d, ]+) of", prompt).group(1).split(",")]
+        plan = [
+            {
+                # Models often restart numbering at 1; the client renumbers
+                "day": index + 1,
+                "meals": [
+                    {
+                        "name": f"Day {day} meal {m}",
+                        "kcal": 600,
+                        "protein_g": 40.0,
+                        "carbs_g": 60.0,
+                        "fat_g": 20.0,
+                        "ingredients": [{"item": "Rice", "qty": "80g"}],
+                        "steps": ["Cook"],
+                    }
+                    for m in range(self.meals_per_day)
+                ],
+            }
+            for index, day in enumerate(days)
+        ]
+        content = json.dumps({"plan": plan, "groceries": [{"category": "grains", "items": ["Rice", "rice"]}]})
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+@pytest.fixture
+def preferences():
+    return MealPreference(
+        age=30, weightKg=70.0, heightCm=170, sex="male", goal="maintain",
+        dietType="omnivore", cookingEffort="quick", caloriesTarget=1800, allergies=["shrimp"]
+    )
+
+def test_fan_out_generates_groups_concurrently_and_merges(monkeypatch, preferences):
+    """Test that day groups run in parallel and merge into one validated week."""
+    monkeypatch.setattr(settings, "GENERATION_DAYS_PER_REQUEST", 2)
+    completions = FakeCompletions(preferences.mealsPerDay)
+    client = OpenAIClient(SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+
+    plan = asyncio.run(client.generate_meal_plan(preferences))
+
+    assert completions.calls == 4
+    assert completions.max_active == 4
+    assert [day["day"] for day in plan["plan"]] == [1, 2, 3, 4, 5, 6, 7]
+    assert plan["totals"] == {"kcal": 1800, "protein_g": 120.0, "carbs_g": 180.0, "fat_g": 60.0}
+    assert plan["groceries"] == [{"category": "Grains", "items": ["Rice"], "quantities": {"Rice": "1.7 kg"}}]
+    MealPlanResponse(**plan)
+
+def test_day_themes_rotate_and_skip_allergens(preferences):
+    """Test that every day gets a distinct theme and allergenic proteins are skipped."""
+    themes = OpenAIClient(SimpleNamespace())._day_themes(preferences)
+    assert len(set(themes.values())) == 7
+    assert not any("shrimp" in theme for theme in themes.values())
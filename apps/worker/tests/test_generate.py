@@ -2,21 +2,6 @@ import pytest
 from worker.schemas import MealPreference, MealPlanRequest, MealPlanResponse
 from worker.services.openai_client import OpenAIClient
 
-@pytest.fixture
-def sample_preferences():
-    return MealPreference(
-        age=30,
-        weightKg=70.0,
-        heightCm=170,
-        sex="male",
-        goal="maintain",
-        dietType="omnivore",
-        allergies=["nuts"],
-        dislikes=["mushrooms"],
-        cookingEffort="quick",
-        caloriesTarget=2000
-    )
-
 @pytest.fixture
 def sample_meal_plan_response():
     return {
@@ -141,3 +126,163 @@ def test_openai_client_allergen_validation():
     
     with pytest.raises(ValueError, match="Allergen 'nuts' found"):
         client._validate_and_clean_response(test_data, preferences)
+
+def test_app_lifespan_shares_one_openai_client(monkeypatch):
+    """Test that the lifespan creates a single pooled client and closes it on shutdown."""
+    from fastapi.testclient import TestClient
+    from worker.config import settings
+    from worker.main import app
+
+    monkeypatch.setattr(settings, "OPENAI_WARMUP_CONNECTIONS", 0)
+    with TestClient(app) as test_client:
+        shared = app.state.openai_client
+        assert isinstance(shared, OpenAIClient)
+        assert test_client.get("/health/").status_code == 200
+        assert app.state.openai_client is shared
+    assert shared.client._client.is_closed
+
+def test_stream_endpoint_emits_meals_then_plan(monkeypatch, sample_preferences, sample_meal_plan_response):
+    """Test that /generate/stream sends meal events before the final plan."""
+    import json
+    from fastapi.testclient import TestClient
+    from worker.config import settings
+    from worker.main import app
+    from worker.routers.generate import get_openai_client
+
+    class StreamingClient:
+        async def stream_meal_plan(self, preferences, deadline=None):
+            for day in sample_meal_plan_response["plan"]:
+                for idx, meal in enumerate(day["meals"]):
+                    yield {"type": "meal", "day": day["day"], "index": idx, "meal": meal}
+            yield {"type": "plan", "plan": sample_meal_plan_response}
+
+    monkeypatch.setattr(settings, "OPENAI_WARMUP_CONNECTIONS", 0)
+    monkeypatch.setattr(settings, "PLAN_CACHE_PATH", "")
+    monkeypatch.setattr(settings, "MEAL_STORE_PATH", "")
+    app.dependency_overrides[get_openai_client] = lambda: StreamingClient()
+    try:
+        with TestClient(app) as test_client:
+            response = test_client.post(
+                "/generate/stream",
+                json={"preferences": sample_preferences.model_dump(mode="json")},
+            )
+    finally:
+        app.dependency_overrides.clear()
+
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert [event["type"] for event in events] == ["meal", "plan"]
+    assert events[0]["meal"]["name"] == "Greek Yogurt Parfait"
+    assert events[1]["plan"]["totals"]["kcal"] == 2000
+
+def test_batch_endpoint_dedupes_profiles_and_reports_errors(monkeypatch, sample_preferences, sample_meal_plan_response):
+    """Test that /generate/batch generates identical profiles once and returns per-profile errors."""
+    from fastapi.testclient import TestClient
+    from worker.config import settings
+    from worker.main import app
+    from worker.routers.generate import get_openai_client
+
+    class BatchClient:
+        def __init__(self):
+            self.calls = 0
+
+        async def generate_meal_plan(self, preferences, deadline=None, prefilled=None):
+            self.calls += 1
+            if preferences.age == 99:
+                raise ValueError("Invalid API key")
+            return sample_meal_plan_response
+
+    batch_client = BatchClient()
+    failing = sample_preferences.model_copy(update={"age": 99})
+    monkeypatch.setattr(settings, "OPENAI_WARMUP_CONNECTIONS", 0)
+    monkeypatch.setattr(settings, "PLAN_CACHE_PATH", "")
+    monkeypatch.setattr(settings, "MEAL_STORE_PATH", "")
+    monkeypatch.setattr(settings, "RETRY_MAX_ATTEMPTS", 1)
+    app.dependency_overrides[get_openai_client] = lambda: batch_client
+    try:
+        with TestClient(app) as test_client:
+            profiles = [p.model_dump(mode="json") for p in (sample_preferences, sample_preferences, failing)]
+            response = test_client.post("/generate/batch", json={"profiles": profiles})
+            too_many = test_client.post("/generate/batch", json={"profiles": profiles * 4})
+    finally:
+        app.dependency_overrides.clear()
+
+    body = response.json()
+    assert response.status_code == 200
+    assert body["unique_profiles"] == 2
+    assert batch_client.calls == 2
+    assert [result["status"] for result in body["results"]] == ["ok", "ok", "error"]
+    assert body["results"][1]["plan"]["totals"]["kcal"] == 2000
+    assert "Invalid API key" in body["results"][2]["error"]
+    assert too_many.status_code == 422
+
+def test_generate_validates_once_and_serves_cached_plans_as_stored(monkeypatch, sample_preferences, sample_meal_plan_response):
+    """Test that /generate/ rejects invalid plans, and repeats of a valid one are the cached bytes."""
+    from fastapi.testclient import TestClient
+    from worker.config import settings
+    from worker.main import app
+    from worker.routers.generate import get_openai_client
+
+    class PlanClient:
+        def __init__(self):
+            self.calls = 0
+
+        async def generate_meal_plan(self, preferences, deadline=None, prefilled=None):
+            self.calls += 1
+            if preferences.age == 99:
+                return {**sample_meal_plan_response, "totals": {"kcal": 90000, "protein_g": 1, "carbs_g": 1, "fat_g": 1}}
+            return sample_meal_plan_response
+
+    plan_client = PlanClient()
+    monkeypatch.setattr(settings, "OPENAI_WARMUP_CONNECTIONS", 0)
+    monkeypatch.setattr(settings, "PLAN_CACHE_PATH", "")
+    monkeypatch.setattr(settings, "MEAL_STORE_PATH", "")
+    monkeypatch.setattr(settings, "RETRY_MAX_ATTEMPTS", 1)
+    app.dependency_overrides[get_openai_client] = lambda: plan_client
+    try:
+        with TestClient(app) as test_client:
+            body = {"preferences": sample_preferences.model_dump(mode="json")}
+            first = test_client.post("/generate/", json=body)
+            second = test_client.post("/generate/", json=body)
+            invalid = test_client.post("/generate/", json={"preferences": {**body["preferences"], "age": 99}})
+    finally:
+        app.dependency_overrides.clear()
+
+    assert first.status_code == 200
+    assert first.headers["content-type"] == "application/json"
+    assert MealPlanResponse(**first.json()).model_dump(mode="json") == first.json()
+    assert second.content == first.content
+    assert plan_client.calls == 2
+    assert invalid.status_code == 500
+
+def test_jobs_endpoint_returns_id_then_result(monkeypatch, tmp_path, sample_preferences, sample_meal_plan_response):
+    """Test that POST /jobs returns immediately and GET /jobs/{id}?wait= returns the plan."""
+    from fastapi.testclient import TestClient
+    from worker.config import settings
+    from worker.main import app
+
+    class JobClient:
+        async def generate_meal_plan(self, preferences, deadline=None, prefilled=None):
+            return sample_meal_plan_response
+
+        async def warm_up(self, connections):
+            pass
+
+        async def aclose(self):
+            pass
+
+    monkeypatch.setattr(settings, "OPENAI_WARMUP_CONNECTIONS", 0)
+    monkeypatch.setattr(settings, "PLAN_CACHE_PATH", "")
+    monkeypatch.setattr(settings, "MEAL_STORE_PATH", "")
+    monkeypatch.setattr(settings, "JOBS_PATH", str(tmp_path / "jobs.sqlite3"))
+    monkeypatch.setattr(OpenAIClient, "create_shared", classmethod(lambda cls, metrics=None: JobClient()))
+    with TestClient(app) as test_client:
+        submitted = test_client.post("/jobs/", json={"preferences": sample_preferences.model_dump(mode="json")})
+        job = test_client.get(f"/jobs/{submitted.json()['id']}", params={"wait": 5}).json()
+        missing = test_client.get("/jobs/does-not-exist")
+
+    assert submitted.status_code == 202
+    assert "result" not in submitted.json()
+    assert job["status"] == "succeeded"
+    assert job["result"]["totals"]["kcal"] == 2000
+    assert missing.status_code == 404
@@ -0,0 +1,78 @@
+import pytest
+from worker.config import settings
+from worker.schemas import MealPreference
+from worker.services.ingredients import IngredientIndex, build_groceries, categorize_ingredient, load_ingredient_index, normalize_ingredient
+from worker.services.openai_client import OpenAIClient
+
+@pytest.mark.parametrize("name, canonical, category", [
+    ("Red bell peppers (sliced)", "Bell pepper", "Vegetables"),
+    ("Freshly ground black pepper", "Black pepper", "Spices"),
+    ("pepper", "Black pepper", "Spices"),
+    ("red pepper flakes", "Chili flakes", "Spices"),
+    ("2 large eggs", "Eggs", "Proteins"),
+    ("Cherry tomatoes, halved", "Cherry tomatoes", "Vegetables"),
+    ("Coconut milk", "Coconut milk", "Dairy/Alternatives"),
+    ("Peanut butter", "Peanut butter", "Pantry"),
+    ("Frozen mixed berries", "Mixed berries", "Fruits"),
+])
+def test_names_resolve_to_canonical_entries(name, canonical, category):
+    """Test that aliases, plurals and preparation words resolve through the hash index."""
+    assert tuple(categorize_ingredient(name)) == (canonical, category)
+
+def test_token_fallback_prefers_the_head_noun_and_unknowns_go_to_other():
+    """Test that unindexed names fall back to their rightmost indexed words, and unknown names keep their text."""
+    assert tuple(categorize_ingredient("Grilled chicken strips")) == ("Chicken breast", "Proteins")
+    assert tuple(categorize_ingredient("Roasted red peppers")) == ("Bell pepper", "Vegetables")
+    assert tuple(categorize_ingredient("olive oil spray")) == ("Olive oil", "Pantry")
+    assert tuple(categorize_ingredient("Dragon fruit jam")) == ("Dragon fruit jam", "Other")
+    assert normalize_ingredient("Sweet Potatoes (peeled, cubed)") == "sweet potato"
+
+def test_kinds_are_same_category_compounds_of_the_head_noun():
+    """Test that "berries" has strawberries and blueberries as kinds, and short heads like "nuts" have none."""
+    index = load_ingredient_index()
+    kinds = index.kinds("berries")
+    assert {"Strawberries", "strawberry", "Blueberries"} <= set(kinds)
+    assert "Mixed berries" not in kinds
+    assert index.kinds("nuts") == [] and index.kinds("dragon fruit jam") == []
+
+def test_lookups_are_cached():
+    """Test that the taxonomy is loaded once and repeated names hit the LRU cache."""
+    index = IngredientIndex([{"name": "Tofu", "category": "Proteins", "aliases": ["firm tofu"]}], ["Proteins"])
+    assert index.categorize("Firm tofu").canonical == "Tofu"
+    assert index.categorize("Firm tofu").canonical == "Tofu"
+    assert index.lookup.cache_info().hits == 1
+    assert index.categories == ["Proteins", "Other"]
+    assert load_ingredient_index() is load_ingredient_index()
+
+def test_build_groceries_deduplicates_in_category_order():
+    """Test that the grocery list merges spellings of one ingredient, totals its amounts and follows the taxonomy's category order."""
+    plan = [
+        {"day": 1, "meals": [
+            {"ingredients": [{"item": "Black pepper", "qty": "pinch"}, {"item": "Chicken breasts", "qty": "200g"}]},
+            {"ingredients": [{"item": "chicken breast", "qty": "150g"}, "Spinach", {"item": "Mystery sauce"}]},
+        ]},
+        {"day": 2, "meals": [{"ingredients": [{"item": "Baby spinach", "qty": "1 cup"}, {"item": "", "qty": "1"}]}]},
+        "not a day",
+    ]
+    assert build_groceries(plan) == [
+        {"category": "Proteins", "items": ["Chicken breast"], "quantities": {"Chicken breast": "350 g"}},
+        # 1 cup of spinach weighs about 31 g; the bare string adds nothing
+        {"category": "Vegetables", "items": ["Spinach"], "quantities": {"Spinach": "31 g"}},
+        {"category": "Spices", "items": ["Black pepper"], "quantities": {"Black pepper": "1 pinch"}},
+        {"category": "Other", "items": ["Mystery sauce"], "quantities": {}},
+    ]
+    assert build_groceries(None) == []
+
+def test_prompts_only_ask_for_groceries_without_local_lists(monkeypatch):
+    """Test that the model is asked for a grocery list only when LOCAL_GROCERIES is off."""
+    client = OpenAIClient(object())
+    preferences = MealPreference(
+        age=30, weightKg=70.0, heightCm=170, sex="male", goal="maintain", dietType="omnivore", cookingEffort="quick",
+    )
+    themes = client._day_themes(preferences)
+    monkeypatch.setattr(settings, "LOCAL_GROCERIES", True)
+    assert "grocer" not in str(client._week_messages(preferences)).lower()
+    assert "grocer" not in str(client._days_messages(preferences, [1, 2], themes)).lower()
+    monkeypatch.setattr(settings, "LOCAL_GROCERIES", False)
+    assert '"groceries"' in client._week_messages(preferences)[0]["content"]
+    assert '"groceries"' in client._days_messages(preferences, [1, 2], themes)[0]["content"]
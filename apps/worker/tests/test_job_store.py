@@ -0,0 +1,155 @@
+import asyncio
+import json
+import os
+import time
+import pytest
+from worker.services.job_store import FAILED, QUEUED, SUCCEEDED, JobQueueFull, JobRunner, JobStore, job_event_stream
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(path=str(tmp_path / "jobs.sqlite3"))
+
+def test_jobs_run_in_background_and_report_progress(store):
+    """Test that submit returns at once and wait returns the finished job with its result."""
+    release = asyncio.Event()
+
+    async def handler(request, report):
+        await report({"stage": "generating"})
+        await release.wait()
+        if request["name"] == "bad":
+            raise ValueError("upstream failed")
+        return {"plan": request["name"]}
+
+    async def scenario():
+        runner = JobRunner(store, handler, workers=2)
+        await runner.start()
+        try:
+            good = await runner.submit({"name": "good"})
+            bad = await runner.submit({"name": "bad"})
+            assert good["status"] == QUEUED
+
+            running = await runner.wait(good["id"], timeout=0.05)
+            assert running["status"] == "running"
+            assert running["progress"] == {"stage": "generating"}
+
+            release.set()
+            finished = await runner.wait(good["id"], timeout=5)
+            failed = await runner.wait(bad["id"], timeout=5)
+            return finished, failed, runner.stats()
+        finally:
+            await runner.stop()
+
+    finished, failed, stats = asyncio.run(scenario())
+    assert finished["status"] == SUCCEEDED
+    assert finished["result"] == {"plan": "good"}
+    assert failed["status"] == FAILED
+    assert failed["error"] == "upstream failed"
+    assert stats["succeeded"] == 1 and stats["failed"] == 1
+
+def test_finished_jobs_survive_restart(store, tmp_path):
+    """Test that results are read back from SQLite by a new store instance."""
+    async def handler(request, report):
+        return {"ok": True}
+
+    async def scenario():
+        runner = JobRunner(store, handler, workers=1)
+        await runner.start()
+        job = await runner.submit({})
+        await runner.wait(job["id"], timeout=5)
+        await runner.stop()
+        return job["id"]
+
+    job_id = asyncio.run(scenario())
+    reopened = JobStore(path=str(tmp_path / "jobs.sqlite3"))
+    job = asyncio.run(reopened.get(job_id))
+    assert job["status"] == SUCCEEDED
+    assert job["result"] == {"ok": True}
+
+def test_orphaned_jobs_are_claimed_and_rerun(store):
+    """Test that unfinished jobs whose owner stopped renewing its lease are picked up, even under a reused pid."""
+    orphan = asyncio.run(store.create({"name": "orphan"}, owner=f"{os.getpid()}-crashed"))
+    store._update(orphan["id"], status="running", heartbeat_at=time.time() - 120)
+    # Owned by a runner in another live process, which keeps its lease fresh
+    alive = asyncio.run(store.create({"name": "alive"}, owner="elsewhere"))
+
+    async def handler(request, report):
+        return {"plan": request["name"]}
+
+    async def scenario():
+        runner = JobRunner(store, handler, workers=1, lease_seconds=60)
+        await runner.start()
+        try:
+            return await runner.wait(orphan["id"], timeout=5), await store.get(alive["id"]), runner.stats()
+        finally:
+            await runner.stop()
+
+    finished, untouched, stats = asyncio.run(scenario())
+    assert finished["result"] == {"plan": "orphan"}
+    assert untouched["status"] == QUEUED
+    assert stats["recovered"] == 1
+
+def test_leases_are_renewed_while_the_runner_lives(store):
+    """Test that a live runner's jobs keep a fresh heartbeat, so nobody else claims them."""
+    release = asyncio.Event()
+
+    async def handler(request, report):
+        await release.wait()
+        return {}
+
+    async def scenario():
+        runner = JobRunner(store, handler, workers=1, lease_seconds=0.3)
+        await runner.start()
+        try:
+            job = await runner.submit({})
+            await asyncio.sleep(0.5)
+            claimed = await store.claim_orphans("other-runner", lease_seconds=0.3, limit=10)
+            release.set()
+            await runner.wait(job["id"], timeout=5)
+            return claimed
+        finally:
+            await runner.stop()
+
+    assert asyncio.run(scenario()) == []
+
+def test_watchers_leave_no_signals_behind(store):
+    """Test that watching jobs of other processes, or dropping an event stream early, does not leak wake-up events."""
+    async def handler(request, report):
+        await asyncio.sleep(10)
+
+    async def scenario():
+        runner = JobRunner(store, handler, workers=1, poll_interval=0.01)
+        foreign = await store.create({}, owner="elsewhere")
+        assert (await runner.wait(foreign["id"], timeout=0.05))["status"] == QUEUED
+        await runner.start()
+        try:
+            job = await runner.submit({})
+            stream = job_event_stream(runner, job["id"], max_seconds=5, heartbeat_seconds=1)
+            await stream.__anext__()
+            assert job["id"] in runner._signals
+            await stream.aclose()
+            return runner._signals
+        finally:
+            await runner.stop()
+
+    assert asyncio.run(scenario()) == {}
+
+def test_queue_limit_and_event_stream(store):
+    """Test that a full queue rejects submissions and SSE ends with the finished job."""
+    async def handler(request, report):
+        await report({"stage": "generating"})
+        return {"done": True}
+
+    async def scenario():
+        runner = JobRunner(store, handler, workers=1, max_queued=1)
+        job = await runner.submit({})
+        with pytest.raises(JobQueueFull):
+            await runner.submit({})
+        await runner.start()
+        events = [event async for event in job_event_stream(runner, job["id"], max_seconds=5, heartbeat_seconds=1)]
+        await runner.stop()
+        return events
+
+    events = asyncio.run(scenario())
+    payloads = [json.loads(event.split("data: ", 1)[1]) for event in events if event.startswith("event: job")]
+    assert payloads[-1]["status"] == SUCCEEDED
+    assert payloads[-1]["result"] == {"done": True}
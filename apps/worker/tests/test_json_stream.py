@@ -0,0 +1,84 @@
+import json
+import pytest
+from worker.services.json_stream import (
+    IncrementalJSONParser,
+    JSONRepairError,
+    MealStreamScanner,
+    parse_json_with_repairs,
+)
+
+def _plan_text():
+    return json.dumps({
+        "plan": [
+            {"day": 1, "meals": [
+                {"name": "Oats {with} \"berries\"", "kcal": 350, "ingredients": [{"item": "Oats", "qty": "50g"}]},
+                {"name": "Salad", "kcal": 450, "ingredients": []}
+            ]},
+            {"day": 2, "meals": [{"name": "Soup", "kcal": 400, "ingredients": []}]}
+        ],
+        "totals": {"kcal": 1200, "meals": [{"name": "not a meal"}]},
+        "groceries": [{"category": "Produce", "items": ["Oats"]}]
+    })
+
+def test_meals_are_emitted_as_soon_as_they_close():
+    """Test that each meal is returned from the chunk that completes it."""
+    text = _plan_text()
+    scanner = MealStreamScanner()
+    emitted = []
+    for i in range(0, len(text), 7):
+        emitted.extend((i, event) for event in scanner.feed(text[i:i + 7]))
+
+    assert [(day, idx, meal["name"]) for _, (day, idx, meal) in emitted] == [
+        (0, 0, 'Oats {with} "berries"'),
+        (0, 1, "Salad"),
+        (1, 0, "Soup"),
+    ]
+    # The first meal arrives long before the document is complete
+    assert emitted[0][0] < len(text) // 2
+    assert json.loads(scanner.text) == json.loads(text)
+
+def test_truncated_stream_keeps_completed_meals():
+    """Test that meals finished before a truncation are still emitted."""
+    text = _plan_text()
+    cut = text.index("Soup")
+    meals = MealStreamScanner().feed(text[:cut])
+    assert [meal["name"] for _, _, meal in meals] == ['Oats {with} "berries"', "Salad"]
+
+@pytest.mark.parametrize("text, expected, repairs", [
+    ('{"a": 1}', {"a": 1}, []),
+    ('```json\n{"a": [1, 2,],}\n```', {"a": [1, 2]}, ["stripped_preamble", "trailing_comma", "trailing_text"]),
+    ('{"tip": "Prep tomorrow"s lunch", "note": "it\'s fine"}', {"tip": "Prep tomorrow's lunch", "note": "it's fine"}, ["inner_quote"]),
+    ('{"qty": "6" roll"}', {"qty": '6" roll'}, ["inner_quote"]),
+    ('{"a": 1\n "b": {"c": true} "d": [1 2]}', {"a": 1, "b": {"c": True}, "d": [1, 2]}, ["missing_comma"]),
+    ('{"a": "x" "b": 2, "c": "y"  "d": "z"}', {"a": "x", "b": 2, "c": "y", "d": "z"}, ["missing_comma"]),
+    ('{"tip": "Say "cheese" twice", "n": 1}', {"tip": 'Say "cheese" twice', "n": 1}, ["inner_quote"]),
+    ('{"ok": True, "none": None}', {"ok": True, "none": None}, ["python_literal"]),
+    ('[1, ñ, 2]', [1, 2], ["skipped_garbage"]),
+    ('{"plan": [{"name": "Sal', {"plan": [{"name": "Sal"}]}, ["truncated"]),
+    ('{"plan": [{"kcal": 30', {"plan": [{"kcal": 30}]}, ["truncated"]),
+    ('{"plan": [{"kcal":', {"plan": [{}]}, ["truncated"]),
+    ('{"emoji": "\\ud83d\\ude00", "esc": "a\\"b\\\\c\\n"}', {"emoji": "\U0001F600", "esc": 'a"b\\c\n'}, []),
+])
+def test_parser_repairs(text, expected, repairs):
+    """Test that common model glitches are repaired and reported in one pass."""
+    value, applied = parse_json_with_repairs(text)
+    assert value == expected
+    assert applied == repairs
+
+def test_parser_is_resumable_at_any_chunk_boundary():
+    """Test that chunking never changes the result, even inside numbers and escapes."""
+    text = json.dumps({"a": [-12.5e2, 0, 1234], "b": "xé\"y", "c": [True, None]}, ensure_ascii=True)
+    text = "```json\n" + text[:-1] + ', "d": "x" "e": "y",}\n```'
+    expected, repairs = parse_json_with_repairs(text)
+    assert expected["d"] == "x" and repairs == ["stripped_preamble", "missing_comma", "trailing_comma", "trailing_text"]
+    for size in (1, 2, 3, 5):
+        parser = IncrementalJSONParser()
+        for i in range(0, len(text), size):
+            parser.feed(text[i:i + size])
+        assert parser.close() == expected
+        assert parser.repairs == repairs
+
+def test_parser_rejects_text_without_json():
+    """Test that text with no object or array raises a JSONRepairError."""
+    with pytest.raises(JSONRepairError):
+        parse_json_with_repairs("Sorry, I cannot help with that.")
@@ -0,0 +1,56 @@
+import time
+import pytest
+from worker.schemas import MealPlanResponse
+from worker.services.local_planner import is_simple_profile, load_corpus, local_meal_plan
+
+def recipe_lookup():
+    return {recipe["name"]: recipe for recipe in load_corpus().recipes}
+
+@pytest.mark.parametrize("diet", ["omnivore", "vegan", "vegetarian", "mediterranean", "diabetes-friendly"])
+@pytest.mark.parametrize("meals_per_day", [3, 4, 6])
+def test_plan_respects_diet_meal_count_and_calories(diet, meals_per_day, make_preferences):
+    """Test that every day has the requested meals, all fitting the diet, near the calorie target."""
+    plan = local_meal_plan(make_preferences(dietType=diet, mealsPerDay=meals_per_day))
+    recipes = recipe_lookup()
+
+    assert [day["day"] for day in plan["plan"]] == [1, 2, 3, 4, 5, 6, 7]
+    for day in plan["plan"]:
+        assert len(day["meals"]) == meals_per_day
+        if diet != "omnivore":
+            assert all(diet in recipes[meal["name"]]["diets"] for meal in day["meals"])
+    assert abs(plan["totals"]["kcal"] - 2000) <= 200
+    MealPlanResponse(**plan)
+
+def test_plan_excludes_allergens_and_dislikes(make_preferences):
+    """Test that allergy terms (including synonyms) and dislikes never appear."""
+    preferences = make_preferences(allergies=["Tree Nuts", "shrimp", "milk"], dislikes=["salmon"], mealsPerDay=5)
+    recipes = recipe_lookup()
+
+    for day in local_meal_plan(preferences)["plan"]:
+        for meal in day["meals"]:
+            recipe = recipes[meal["name"]]
+            assert not {"nuts", "shellfish", "dairy"} & set(recipe["allergens"])
+            assert "salmon" not in meal["name"].lower()
+
+def test_plan_is_deterministic_varied_and_fast(make_preferences):
+    """Test that a profile always gets the same plan, with little repetition, in milliseconds."""
+    preferences = make_preferences(mealsPerDay=3)
+    local_meal_plan(preferences)
+    start = time.perf_counter()
+    plan = local_meal_plan(preferences)
+    elapsed = time.perf_counter() - start
+
+    assert plan == local_meal_plan(preferences)
+    names = [meal["name"] for day in plan["plan"] for meal in day["meals"]]
+    assert len(set(names)) >= 15
+    assert elapsed < 0.1
+
+def test_protein_shake_and_simple_profile_detection(make_preferences):
+    """Test that shakes replace a snack when requested and free-text profiles are not 'simple'."""
+    plan = local_meal_plan(make_preferences(mealsPerDay=4, includeProteinShakes=True), days=1)
+    recipes = recipe_lookup()
+    assert [recipes[m["name"]]["slot"] for m in plan["plan"][0]["meals"]] == ["breakfast", "main", "main", "shake"]
+
+    assert is_simple_profile(make_preferences(allergies=["peanut"]))
+    assert not is_simple_profile(make_preferences(dislikes=["cilantro"]))
+    assert not is_simple_profile(make_preferences(allergies=["kiwi"]))
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import os
+from types import SimpleNamespace
+import pytest
+
+# main.py reads its settings and creates its upstream client at import
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+
+import main  # noqa: E402
+from worker.services.meal_store import MealStore  # noqa: E402
+from worker.services.metrics import Metrics  # noqa: E402
+from worker.services.nutrition import plan_totals  # noqa: E402
+from worker.services.plan_cache import PlanCache, plan_cache_key  # noqa: E402
+from worker.services.retry_policy import Deadline, DeadlineExceeded  # noqa: E402
+
+@pytest.fixture
+def preferences():
+    return main.MealPreference(
+        age=30, weightKg=70.0, heightCm=170, sex="male", goal="maintain",
+        dietType="omnivore", allergies=[], dislikes=[], cookingEffort="quick and easy", caloriesTarget=1800,
+    )
+
+@pytest.fixture
+def metrics(monkeypatch):
+    metrics = Metrics(path=None)
+    monkeypatch.setattr(main, "metrics", metrics)
+    return metrics
+
+def completion(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps(content)))])
+
+def day_without_macros(meals_per_day):
+    return {"plan": [{"day": 1, "meals": [
+        {
+            "name": f"Chicken pasta {index}",
+            "ingredients": [{"item": "Chicken breast", "qty": "150 g"}, {"item": "Pasta", "qty": "100 g"}, {"item": "Olive oil", "qty": "1 tbsp"}],
+            "steps": ["Cook"],
+        }
+        for index in range(meals_per_day)
+    ]}]}
+
+def test_local_macros_prompt_leaves_out_nutrition():
+    """Test that the LOCAL_MACROS prompt asks for measurable quantities instead of kcal, macros and totals."""
+    prompt = main.compile_generation_prompt(False, local_macros=True).prefix
+    assert '"kcal"' not in prompt and '"totals"' not in prompt and "daily_nutrition_summary" not in prompt
+    assert "dry weight" in prompt
+    assert '"kcal"' in main.compile_generation_prompt(False).prefix
+
+def test_local_macros_are_computed_from_the_ingredients(monkeypatch, preferences, metrics):
+    """Test that with LOCAL_MACROS each meal's macros and the totals come from the nutrition table."""
+    monkeypatch.setattr(main, "LOCAL_MACROS", True)
+
+    async def create_completion(kind, **kwargs):
+        return completion(day_without_macros(preferences.mealsPerDay))
+
+    monkeypatch.setattr(main, "create_completion", create_completion)
+    plan = asyncio.run(main.generation_attempt(preferences, [], Deadline(30)))
+
+    meal = plan["plan"][0]["meals"][0]
+    assert meal["kcal"] == pytest.approx(150 * 1.2 + 100 * 3.52 + 13.8 * 8.84, abs=5)
+    assert meal["protein_g"] > 30 and meal["carbs_g"] > 60
+    assert plan["totals"] == plan_totals(plan["plan"])
+    # The model was not asked for totals, so filling them in is not a correction
+    assert "wellplate_totals_corrections_total{" not in asyncio.run(metrics.render())
+
+def test_streamed_plans_get_totals_computed_from_the_meals(monkeypatch, preferences, metrics):
+    """Test that a streamed plan, and the copy cached for later requests, carry totals summed from the meals."""
+    cache = PlanCache(path=None)
+    monkeypatch.setattr(main, "plan_cache", cache)
+    monkeypatch.setattr(main, "meal_store", MealStore(path=None, enabled=False))
+    meals = [
+        {"name": f"Meal {index}", "kcal": 600, "protein_g": 40, "carbs_g": 60, "fat_g": 20,
+         "ingredients": [{"item": "Rice", "qty": "80 g"}], "steps": ["Cook"]}
+        for index in range(preferences.mealsPerDay)
+    ]
+    content = json.dumps({"plan": [{"day": 1, "meals": meals}], "totals": {"kcal": 9000, "protein_g": 1, "carbs_g": 1, "fat_g": 1}})
+
+    async def chunks():
+        for start in range(0, len(content), 40):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content[start:start + 40]))])
+
+    async def create_completion(kind, **kwargs):
+        return chunks()
+
+    monkeypatch.setattr(main, "create_completion", create_completion)
+
+    async def scenario():
+        response = await main.generate_meal_plan_stream(preferences)
+        lines = [json.loads(line) async for line in response.body_iterator]
+        return lines, await cache.get_payload(plan_cache_key(preferences, scope=main.PLAN_CACHE_SCOPE))
+
+    lines, cached = asyncio.run(scenario())
+    expected = {"kcal": 600 * preferences.mealsPerDay, "protein_g": 40.0 * preferences.mealsPerDay,
+                "carbs_g": 60.0 * preferences.mealsPerDay, "fat_g": 20.0 * preferences.mealsPerDay}
+    assert [line["type"] for line in lines] == ["meal"] * preferences.mealsPerDay + ["plan"]
+    assert lines[-1]["plan"]["totals"] == expected
+    assert cached.data()["totals"] == expected
+    assert 'wellplate_totals_corrections_total{field="kcal"} 1' in asyncio.run(metrics.render())
+
+def test_streaming_keeps_to_the_request_deadline(monkeypatch, preferences, metrics):
+    """Test that the streamed call gets a timeout capped by the deadline and a stalling stream is abandoned."""
+    calls = []
+
+    async def chunks():
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content='{"plan": [{"day": 1, '))])
+        await asyncio.sleep(0.2)
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content='"meals": []}]}'))])
+
+    async def create_completion(kind, **kwargs):
+        calls.append(kwargs)
+        return chunks()
+
+    monkeypatch.setattr(main, "create_completion", create_completion)
+
+    async def scenario():
+        return [event async for event in main.stream_generation(preferences, "key", Deadline(0.1))]
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(scenario())
+    assert 0 < calls[0]["timeout"] <= 0.1
@@ -0,0 +1,134 @@
+import asyncio
+import functools
+import json
+from types import SimpleNamespace
+import pytest
+from worker.config import settings
+from worker.schemas import MealPlanResponse
+from worker.services.meal_store import MealStore, meal_key
+from worker.services.openai_client import OpenAIClient
+
+@pytest.fixture
+def make_preferences(make_preferences):
+    # Stored meals are vegetarian unless a test says otherwise
+    return functools.partial(make_preferences, dietType="vegetarian")
+
+def make_meal(name, kcal, *items):
+    return {
+        "name": name, "kcal": kcal, "protein_g": 30.0, "carbs_g": 50.0, "fat_g": 15.0,
+        "ingredients": [{"item": item, "qty": "100g"} for item in items], "steps": ["Cook"],
+    }
+
+def stored_plan(days):
+    """Validated-looking 3-meal days around 540/700/760 kcal, each day with distinct meals."""
+    return {
+        "plan": [
+            {
+                "day": day,
+                "meals": [
+                    make_meal(f"Breakfast: Oat Bowl {day}", 540, "Oats", "Almond butter" if day == 1 else "Banana"),
+                    make_meal(f"Lunch: Bean Salad {day}", 700, "Black beans", "Mushrooms" if day == 2 else "Tomato"),
+                    make_meal(f"Dinner: Lentil Curry {day}", 760, "Lentils", "Rice"),
+                ],
+            }
+            for day in range(1, days + 1)
+        ],
+        "groceries": [{"category": "Grains", "items": ["Oats", "Rice"]}, {"category": "Legumes", "items": ["Lentils"]}],
+    }
+
+def test_lookup_fills_slots_with_fitting_unrepeated_meals(tmp_path, make_preferences):
+    """Test that stored meals fill matching slots, skipping allergens, dislikes, recent meals and repeats."""
+    store = MealStore(path=str(tmp_path / "meals.sqlite3"))
+    assert asyncio.run(store.add_plan(stored_plan(6), make_preferences())) == 18
+    assert asyncio.run(store.add_plan(stored_plan(1), make_preferences())) == 0
+
+    preferences = make_preferences(dietType="vegan")
+    # Meals stored for vegetarians do not suit vegans
+    assert not any(asyncio.run(store.lookup(preferences, days=2))[0])
+
+    # main.py profiles carry the user's recent meals
+    preferences = {
+        **make_preferences(allergies=["tree nuts"], dislikes=["mushroom"]).model_dump(),
+        "recentMeals": ["Dinner: Lentil Curry 3"],
+    }
+    slots = asyncio.run(store.lookup(preferences, days=7))
+    names = [entry.meal["name"] for day in slots for entry in day if entry]
+
+    # 5 breakfasts and 10 lunches or dinners (both fill "main" slots) remain eligible
+    assert len(names) == len(set(names)) == 15
+    assert "Breakfast: Oat Bowl 1" not in names
+    assert "Lunch: Bean Salad 2" not in names
+    assert "Dinner: Lentil Curry 3" not in names
+    assert all(day[0] is None or day[0].meal["name"].startswith("Breakfast") for day in slots)
+    dinner = next(entry for day in slots for entry in day if entry and entry.meal["name"].startswith("Dinner"))
+    assert {"category": "Grains", "items": ["Rice"]} in dinner.groceries
+
+    half = asyncio.run(store.lookup(make_preferences(), days=2, max_fill=0.5))
+    assert sum(entry is not None for day in half for entry in day) == 3
+    assert store.stats()["stored"] == 18
+
+def test_lookup_requires_a_calorie_fit_and_disabled_store_is_inert(tmp_path, make_preferences):
+    """Test that meals far from the slot's calorie target are not reused, and an empty path disables the store."""
+    store = MealStore(path=str(tmp_path / "meals.sqlite3"))
+    asyncio.run(store.add_plan(stored_plan(3), make_preferences()))
+    assert not any(entry for day in asyncio.run(store.lookup(make_preferences(caloriesTarget=3200), days=1)) for entry in day)
+
+    disabled = MealStore(path="")
+    assert asyncio.run(disabled.add_plan(stored_plan(1), make_preferences())) == 0
+    assert asyncio.run(disabled.lookup(make_preferences(), days=2)) == [[None] * 3, [None] * 3]
+    assert meal_key("Breakfast: Oat Bowl") == meal_key("oat bowl")
+
+def test_protein_shakes_are_stored_and_reused_in_the_shake_slot(tmp_path, make_preferences):
+    """Test that plans with protein shakes store the shake under the shake slot, not as a snack."""
+    store = MealStore(path=str(tmp_path / "meals.sqlite3"))
+    preferences = make_preferences(mealsPerDay=4, includeProteinShakes=True)
+    plan = stored_plan(2)
+    for day in plan["plan"]:
+        day["meals"][0]["kcal"] = 500
+        day["meals"].append(make_meal(f"Vanilla Protein Shake {day['day']}", 240, "Whey protein", "Milk"))
+    assert asyncio.run(store.add_plan(plan, preferences)) == 8
+
+    slots = asyncio.run(store.lookup(preferences, days=2))
+    assert [day[3].meal["name"].startswith("Vanilla Protein Shake") for day in slots] == [True, True]
+
+    # Without shakes the fourth slot is a snack, which no stored shake fills
+    slots = asyncio.run(store.lookup(make_preferences(mealsPerDay=4), days=2))
+    assert [day[3] for day in slots] == [None, None]
+
+class SlotCompletions:
+    """Answers whole-day prompts and missing-slot prompts, recording which were asked for."""
+
+    def __init__(self):
+        self.prompts = []
+
+    async def create(self, **kwargs):
+        prompt = kwargs["messages"][-1]["content"]
+        self.prompts.append(prompt)
+        if "Create days" in prompt:
+            meals = [make_meal(f"Fresh meal {i}", 660, "Quinoa") for i in range(3)]
+            content = {"plan": [{"day": 1, "meals": meals}], "groceries": [{"category": "Grains", "items": ["Quinoa"]}]}
+        else:
+            content = {"meals": [make_meal("Fresh dinner", 760, "Tofu")], "groceries": [{"category": "Protein", "items": ["Tofu"]}]}
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps(content)))])
+
+def test_generation_only_requests_the_empty_slots(monkeypatch, tmp_path, make_preferences):
+    """Test that full days cost no call, a day with one gap gets a one-meal call and an empty day is generated whole."""
+    monkeypatch.setattr(settings, "GENERATION_DAYS_PER_REQUEST", 2)
+    store = MealStore(path=str(tmp_path / "meals.sqlite3"))
+    asyncio.run(store.add_plan(stored_plan(7), make_preferences()))
+    preferences = make_preferences()
+    prefilled = asyncio.run(store.lookup(preferences, days=7))
+    prefilled[5][2] = None
+    prefilled[6] = [None, None, None]
+
+    completions = SlotCompletions()
+    client = OpenAIClient(SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    plan = asyncio.run(client.generate_meal_plan(preferences, prefilled=prefilled))
+
+    assert len(completions.prompts) == 2
+    assert sum("Create days 7 of" in prompt for prompt in completions.prompts) == 1
+    assert sum("Create exactly 1 meal(s) for these slots, in order: dinner" in prompt for prompt in completions.prompts) == 1
+    assert [meal["name"] for meal in plan["plan"][5]["meals"]][2] == "Fresh dinner"
+    assert [meal["name"] for meal in plan["plan"][6]["meals"]] == ["Fresh meal 0", "Fresh meal 1", "Fresh meal 2"]
+    assert "Tofu" in next(category["items"] for category in plan["groceries"] if category["category"] == "Proteins")
+    MealPlanResponse(**plan)
@@ -0,0 +1,86 @@
+import asyncio
+import json
+from types import SimpleNamespace
+from worker.services.json_stream import JSONRepairError
+from worker.services.metrics import GENERATION_RETRIES, GENERATION_SECONDS, JSON_PARSES, UPSTREAM_TOKENS, Metrics
+from worker.services.openai_client import OpenAIClient
+from worker.services.plan_defects import PlanDefect, PlanValidationError
+from worker.services.retry_policy import RetryBudget, RetryPolicy, retry_cause
+
+def test_render_exposes_counters_and_cumulative_histograms():
+    """Test that counters and histograms render in the Prometheus text format."""
+    metrics = Metrics(path=None)
+    metrics.inc(JSON_PARSES, mode="strict")
+    metrics.inc(JSON_PARSES, mode="strict")
+    metrics.observe(GENERATION_SECONDS, 0.3, endpoint="generate")
+    metrics.observe(GENERATION_SECONDS, 7.0, endpoint="generate")
+    text = asyncio.run(metrics.render())
+
+    assert "# TYPE wellplate_json_parse_total counter" in text
+    assert 'wellplate_json_parse_total{mode="strict"} 2' in text
+    assert "# TYPE wellplate_generation_duration_seconds histogram" in text
+    assert 'wellplate_generation_duration_seconds_bucket{endpoint="generate",le="0.25"} 0' in text
+    assert 'wellplate_generation_duration_seconds_bucket{endpoint="generate",le="0.5"} 1' in text
+    assert 'wellplate_generation_duration_seconds_bucket{endpoint="generate",le="10"} 2' in text
+    assert 'wellplate_generation_duration_seconds_bucket{endpoint="generate",le="+Inf"} 2' in text
+    assert 'wellplate_generation_duration_seconds_count{endpoint="generate"} 2' in text
+    buckets = [line for line in text.splitlines() if line.startswith("wellplate_generation_duration_seconds_bucket")]
+    assert buckets[-1].endswith('le="+Inf"} 2')
+
+def test_processes_sharing_a_file_report_host_totals(tmp_path):
+    """Test that two worker processes' counters add up in the shared file, whichever one is scraped."""
+    path = str(tmp_path / "metrics.sqlite3")
+    first, second = Metrics(path=path), Metrics(path=path)
+    first.inc(UPSTREAM_TOKENS, 1200, model="gpt-4o", direction="input")
+    second.inc(UPSTREAM_TOKENS, 300, model="gpt-4o", direction="input")
+    asyncio.run(second.flush())
+
+    text = asyncio.run(first.render())
+    assert 'wellplate_upstream_tokens_total{direction="input",model="gpt-4o"} 1500' in text
+    assert text == asyncio.run(second.render())
+
+def test_retries_are_counted_by_cause():
+    """Test that the retry policy reports each retried error and causes are told apart."""
+    metrics = Metrics(path=None)
+    policy = RetryPolicy(
+        RetryBudget(),
+        base_delay=0,
+        on_retry=lambda error: metrics.inc(GENERATION_RETRIES, cause=retry_cause(error)),
+    )
+    failures = [
+        PlanValidationError([PlanDefect("meal_count", "Day 1 has 2 meals instead of 3", day=1)]),
+        ValueError("Bad AI JSON response"),
+    ]
+    failures[1].__cause__ = JSONRepairError("No JSON object found in model output")
+
+    async def operation(deadline):
+        if failures:
+            raise failures.pop(0)
+        return "ok"
+
+    assert asyncio.run(policy.run(operation)) == "ok"
+    text = asyncio.run(metrics.render())
+    assert 'wellplate_generation_retries_total{cause="meal_count"} 1' in text
+    assert 'wellplate_generation_retries_total{cause="parse"} 1' in text
+    assert retry_cause(PlanValidationError([PlanDefect("allergen", "Contains peanuts", day=1, meal_index=0)])) == "validation"
+
+def test_client_records_tokens_and_parse_mode():
+    """Test that completions report their usage and whether their JSON needed repairs."""
+    class Completions:
+        async def create(self, **kwargs):
+            usage = SimpleNamespace(prompt_tokens=900, completion_tokens=150, prompt_tokens_details=SimpleNamespace(cached_tokens=768))
+            content = '{"meal": {"name": "Oats",}}'
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+    client = OpenAIClient(SimpleNamespace(chat=SimpleNamespace(completions=Completions())))
+    response = asyncio.run(client._create("meal", model="gpt-4o", messages=[]))
+    assert client._parse_content(response.choices[0].message.content) == {"meal": {"name": "Oats"}}
+    assert client._parse_content(json.dumps({"meal": {}})) == {"meal": {}}
+
+    text = asyncio.run(client.metrics.render())
+    assert 'wellplate_upstream_tokens_total{direction="input",model="gpt-4o"} 900' in text
+    assert 'wellplate_upstream_tokens_total{direction="cached_input",model="gpt-4o"} 768' in text
+    assert 'wellplate_upstream_tokens_total{direction="output",model="gpt-4o"} 150' in text
+    assert 'wellplate_upstream_request_duration_seconds_count{kind="meal",model="gpt-4o",outcome="ok"} 1' in text
+    assert 'wellplate_json_parse_total{mode="repaired"} 1' in text
+    assert 'wellplate_json_parse_total{mode="strict"} 1' in text
@@ -0,0 +1,41 @@
+import pytest
+from worker.services.nutrition import daily_macros, off_target_days, plan_totals, reconcile_totals
+
+def meal(kcal, protein=20.0, carbs=50.0, fat=10.0):
+    return {"name": "Meal", "kcal": kcal, "protein_g": protein, "carbs_g": carbs, "fat_g": fat}
+
+def test_daily_sums_skip_malformed_days_and_meals():
+    """Test that per-day sums cover every day position, counting broken entries as nothing."""
+    plan = [
+        {"day": 1, "meals": [meal(500), meal(700, protein="lots")]},
+        None,
+        {"day": 3, "meals": [meal(600), "not a meal", {"kcal": True}]},
+        {"day": 4},
+    ]
+    daily = daily_macros(plan)
+    assert daily.tolist() == [[1200, 20, 100, 20], [0, 0, 0, 0], [600, 20, 50, 10], [0, 0, 0, 0]]
+    assert plan_totals(plan) == {"kcal": 450, "protein_g": 10.0, "carbs_g": 37.5, "fat_g": 7.5}
+    assert plan_totals([]) == {"kcal": 0, "protein_g": 0.0, "carbs_g": 0.0, "fat_g": 0.0}
+
+def test_days_off_the_calorie_target_are_flagged():
+    """Test that only days beyond the tolerance are flagged, by position."""
+    daily = daily_macros([{"meals": [meal(kcal)]} for kcal in (2000, 2250, 1750, 1810)])
+    assert off_target_days(daily, 2000) == [2, 3]
+    assert off_target_days(daily, 2000, tolerance=0.2) == []
+    assert off_target_days(daily, None) == []
+
+def test_reconcile_overwrites_only_inconsistent_totals():
+    """Test that totals are always recomputed, and only real disagreements are reported."""
+    data = {
+        "plan": [{"meals": [meal(600), meal(601)]}, {"meals": [meal(600), meal(600)]}],
+        "totals": {"kcal": 1200, "protein_g": 40.4, "carbs_g": 700, "fat_g": 20},
+    }
+    summary = reconcile_totals(data, calorie_target=1500)
+    assert data["totals"] == {"kcal": 1200, "protein_g": 40.0, "carbs_g": 100.0, "fat_g": 20.0}
+    assert summary.corrected == ["carbs_g"]
+    assert summary.off_target_days == [1, 2]
+    assert summary.daily[:, 0].tolist() == pytest.approx([1201, 1200])
+
+    missing = {"plan": [{"meals": [meal(600)]}]}
+    assert reconcile_totals(missing).corrected == ["kcal", "protein_g", "carbs_g", "fat_g"]
+    assert missing["totals"]["kcal"] == 600
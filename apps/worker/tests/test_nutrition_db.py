@@ -0,0 +1,88 @@
+import asyncio
+import json
+import os
+import numpy as np
+import pytest
+from worker.config import settings
+from worker.schemas import MealPlanResponse
+from worker.services.local_planner import RECIPES_PATH
+from worker.services.nutrition import plan_totals
+from worker.services.nutrition_db import NUTRITION_PATH, NutritionTable, load_nutrition_table
+from worker.services.ingredients import load_ingredient_index
+from tests.test_partial_regeneration import RepairingCompletions, client_for
+
+def test_quantities_resolve_to_grams_of_the_right_row():
+    """Test that weights, volumes, counts and named units become grams, with cooked and category rows."""
+    table = load_nutrition_table()
+    assert table.resolve("Chicken breast", "200 g").grams == 200
+    assert table.resolve("Milk", "1 cup").grams == pytest.approx(240 * 1.03, rel=0.01)
+    assert table.resolve("Olive oil", "1 tbsp").grams == pytest.approx(15 * 0.92, rel=0.05)
+    assert table.resolve("Eggs", "2").grams == 100
+    assert table.resolve("Garlic", "2 cloves").grams == 6
+    assert table.resolve("Salt", "to taste").grams == 0
+
+    dry, cooked = table.resolve("Rice", "100g"), table.resolve("Rice", "1 cup cooked")
+    assert dry.row != cooked.row == table.resolve("Cooked rice", "1 cup").row
+    assert table.per_100g[dry.row][0] > 2 * table.per_100g[cooked.row][0]
+    # Ingredients the table does not list fall back to their category's row
+    assert table.resolve("Dragonfruit jam", "50 g").row == table.resolve("Unheard-of relish", "50 g").row
+
+def test_table_is_compiled_once_and_memory_mapped(tmp_path):
+    """Test that the compiled array is written once per source version and mapped read-only."""
+    with open(NUTRITION_PATH, encoding="utf-8") as f:
+        source = json.load(f)
+    first = NutritionTable(source, load_ingredient_index(), arrays_dir=str(tmp_path))
+    files = os.listdir(tmp_path)
+    assert len(files) == 1 and files[0].endswith(".npy")
+    assert isinstance(first.table, np.memmap) and not first.table.flags.writeable
+
+    second = NutritionTable(source, load_ingredient_index(), arrays_dir=str(tmp_path))
+    assert os.listdir(tmp_path) == files
+    assert np.array_equal(first.table, second.table)
+    assert len(first) == len(source["ingredients"])
+
+    source["ingredients"]["Rice"]["per_100g"][0] += 1
+    NutritionTable(source, load_ingredient_index(), arrays_dir=str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 2
+
+def test_recipe_corpus_macros_are_close_to_the_computed_ones():
+    """Test that the bundled recipes' stated kcal agree with the table for typical meals."""
+    with open(RECIPES_PATH, encoding="utf-8") as f:
+        recipes = json.load(f)["recipes"]
+    computed = load_nutrition_table().meal_macros(recipes)
+    stated = np.array([recipe["kcal"] for recipe in recipes], dtype=float)
+    error = np.abs(computed[:, 0] - stated) / stated
+    assert np.median(error) < 0.2
+    assert np.percentile(error, 75) < 0.35
+
+def local_meal(name, grams_of_pasta=100):
+    return {
+        "name": name,
+        "ingredients": [
+            {"item": "Chicken breast", "qty": "150 g"},
+            {"item": "Pasta", "qty": f"{grams_of_pasta} g"},
+            {"item": "Olive oil", "qty": "1 tbsp"},
+        ],
+        "steps": ["Cook"],
+    }
+
+def test_local_macros_fill_meals_and_repair_those_over_the_limits(monkeypatch, make_preferences):
+    """Test that with LOCAL_MACROS the model is not asked for macros and oversized meals are regenerated."""
+    preferences = make_preferences(caloriesTarget=1800, allergies=["shrimp"])
+    monkeypatch.setattr(settings, "LOCAL_MACROS", True)
+    monkeypatch.setattr(settings, "GENERATION_DAYS_PER_REQUEST", 7)
+    week = {"plan": [{"day": day, "meals": [local_meal(f"Day {day} meal {m}") for m in range(preferences.mealsPerDay)]} for day in range(1, 8)]}
+    week["plan"][2]["meals"][1] = local_meal("Pasta mountain", grams_of_pasta=400)
+    completions = RepairingCompletions(week, preferences.mealsPerDay)
+    client = client_for(completions)
+
+    assert '"kcal"' not in client._week_messages(preferences)[0]["content"]
+    plan = asyncio.run(client.generate_meal_plan(preferences))
+
+    assert len(completions.prompts) == 2
+    assert '"kcal"' not in completions.prompts[1]
+    assert plan["plan"][2]["meals"][1]["name"] == "Replacement meal"
+    meal = plan["plan"][0]["meals"][0]
+    assert meal["kcal"] == pytest.approx(150 * 1.2 + 100 * 3.52 + 13.8 * 8.84, abs=5)
+    assert plan["totals"] == plan_totals(plan["plan"])
+    MealPlanResponse(**plan)
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import re
+from types import SimpleNamespace
+import pytest
+from worker.config import settings
+from worker.schemas import MealPlanResponse
+from worker.services.openai_client import OpenAIClient
+from worker.services.plan_defects import PlanValidationError
+from worker.services.retry_policy import Deadline
+
+def make_meal(name, item="Rice"):
+    return {
+        "name": name,
+        "kcal": 600,
+        "protein_g": 40.0,
+        "carbs_g": 60.0,
+        "fat_g": 20.0,
+        "ingredients": [{"item": item, "qty": "80g"}],
+        "steps": ["Cook"],
+    }
+
+def make_week(meals_per_day):
+    return {
+        "plan": [
+            {"day": day, "meals": [make_meal(f"Day {day} meal {m}") for m in range(meals_per_day)]}
+            for day in range(1, 8)
+        ],
+        "totals": {"kcal": 1800, "protein_g": 120.0, "carbs_g": 180.0, "fat_g": 60.0},
+        "groceries": [{"category": "Grains", "items": ["Rice"]}],
+    }
+
+class RepairingCompletions:
+    """Returns a flawed week first, then answers day and meal repair prompts."""
+
+    def __init__(self, week, meals_per_day):
+        self.week = week
+        self.meals_per_day = meals_per_day
+        self.prompts = []
+
+    async def create(self, **kwargs):
+        prompt = kwargs["messages"][-1]["content"]
+        self.prompts.append(prompt)
+        days = re.search(r"Create days ([\d, ]+) of", prompt)
+        if days:
+            day = int(days.group(1))
+            content = {
+                "plan": [{"day": 1, "meals": [make_meal(f"New day {day} meal {m}") for m in range(self.meals_per_day)]}],
+                "groceries": [{"category": "Vegetables", "items": ["Spinach"]}],
+            }
+        elif prompt.lstrip().startswith("Replace the"):
+            content = {"meal": make_meal("Replacement meal", item="Tofu")}
+        else:
+            content = self.week
+        await asyncio.sleep(0)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps(content)))])
+
+@pytest.fixture
+def preferences(make_preferences):
+    return make_preferences(caloriesTarget=1800, allergies=["shrimp"])
+
+def client_for(completions):
+    return OpenAIClient(SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+
+def test_only_defective_day_and_meal_are_regenerated(monkeypatch, preferences):
+    """Test that a short day and an allergen meal are repaired without regenerating the week."""
+    monkeypatch.setattr(settings, "GENERATION_DAYS_PER_REQUEST", 7)
+    week = make_week(preferences.mealsPerDay)
+    week["plan"][3]["meals"].pop()
+    week["plan"][1]["meals"][1] = make_meal("Shrimp pasta", item="Shrimp")
+    completions = RepairingCompletions(week, preferences.mealsPerDay)
+
+    plan = asyncio.run(client_for(completions).generate_meal_plan(preferences))
+
+    assert len(completions.prompts) == 3
+    assert plan["plan"][3]["meals"][0]["name"] == "New day 4 meal 0"
+    assert plan["plan"][3]["day"] == 4
+    assert plan["plan"][1]["meals"][1]["name"] == "Replacement meal"
+    assert plan["plan"][0]["meals"][0]["name"] == "Day 1 meal 0"
+    # The grocery list follows the repaired meals, without the allergen
+    assert plan["groceries"] == [
+        {"category": "Proteins", "items": ["Tofu"], "quantities": {"Tofu": "80 g"}},
+        {"category": "Grains", "items": ["Rice"], "quantities": {"Rice": "1.6 kg"}},
+    ]
+    MealPlanResponse(**plan)
+
+def test_missing_days_are_appended_and_extra_days_dropped(monkeypatch, preferences):
+    """Test that missing tail days are generated and surplus days are trimmed locally."""
+    monkeypatch.setattr(settings, "GENERATION_DAYS_PER_REQUEST", 7)
+    short_week = make_week(preferences.mealsPerDay)
+    del short_week["plan"][5:]
+    completions = RepairingCompletions(short_week, preferences.mealsPerDay)
+    plan = asyncio.run(client_for(completions).generate_meal_plan(preferences))
+    assert [day["meals"][0]["name"] for day in plan["plan"][5:]] == ["New day 6 meal 0", "New day 7 meal 0"]
+
+    long_week = make_week(preferences.mealsPerDay)
+    long_week["plan"].append(long_week["plan"][0])
+    completions = RepairingCompletions(long_week, preferences.mealsPerDay)
+    plan = asyncio.run(client_for(completions).generate_meal_plan(preferences))
+    assert len(plan["plan"]) == 7
+    assert len(completions.prompts) == 1
+
+def test_unrepairable_defects_raise_with_structured_list(monkeypatch, preferences):
+    """Test that plan-wide problems raise PlanValidationError for a full retry."""
+    monkeypatch.setattr(settings, "GENERATION_DAYS_PER_REQUEST", 7)
+    week = make_week(preferences.mealsPerDay)
+    for day in week["plan"]:
+        for meal in day["meals"]:
+            meal["kcal"] = 60
+    completions = RepairingCompletions(week, preferences.mealsPerDay)
+
+    with pytest.raises(PlanValidationError) as excinfo:
+        asyncio.run(client_for(completions).generate_meal_plan(preferences))
+
+    assert [defect.kind for defect in excinfo.value.defects] == ["totals"]
+    assert len(completions.prompts) == 1
+
+def test_wrong_model_totals_are_recomputed_without_a_retry(monkeypatch, preferences):
+    """Test that totals the meals do not add up to are replaced instead of failing the plan."""
+    monkeypatch.setattr(settings, "GENERATION_DAYS_PER_REQUEST", 7)
+    week = make_week(preferences.mealsPerDay)
+    week["totals"] = {"kcal": 12600, "protein_g": 840.0, "carbs_g": 1260.0, "fat_g": 420.0}
+    completions = RepairingCompletions(week, preferences.mealsPerDay)
+    client = client_for(completions)
+
+    plan = asyncio.run(client.generate_meal_plan(preferences))
+
+    per_day = preferences.mealsPerDay
+    assert plan["totals"] == {"kcal": 600 * per_day, "protein_g": 40.0 * per_day, "carbs_g": 60.0 * per_day, "fat_g": 20.0 * per_day}
+    assert len(completions.prompts) == 1
+    assert 'wellplate_totals_corrections_total{field="kcal"} 1' in asyncio.run(client.metrics.render())
+
+class StreamingCompletions(RepairingCompletions):
+    """Streams the week in chunks and records the timeout of every call."""
+
+    def __init__(self, week, meals_per_day):
+        super().__init__(week, meals_per_day)
+        self.timeouts = []
+
+    async def create(self, **kwargs):
+        self.timeouts.append(kwargs.get("timeout"))
+        if not kwargs.get("stream"):
+            return await super().create(**kwargs)
+        self.prompts.append(kwargs["messages"][-1]["content"])
+        content = json.dumps(self.week)
+
+        async def chunks():
+            for start in range(0, len(content), 200):
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content[start:start + 200]))], usage=None)
+
+        return chunks()
+
+def test_streamed_plan_repairs_keep_to_the_deadline(monkeypatch, preferences):
+    """Test that the stream and the repairs of its plan get timeouts capped by the request deadline."""
+    monkeypatch.setattr(settings, "OPENAI_TIMEOUT_SECONDS", 60.0)
+    week = make_week(preferences.mealsPerDay)
+    week["plan"][3]["meals"].pop()
+    completions = StreamingCompletions(week, preferences.mealsPerDay)
+
+    async def collect():
+        return [event async for event in client_for(completions).stream_meal_plan(preferences, Deadline(5))]
+
+    events = asyncio.run(collect())
+
+    assert events[-1]["plan"]["plan"][3]["meals"][0]["name"] == "New day 4 meal 0"
+    assert len(completions.timeouts) == 2
+    assert all(timeout is not None and timeout <= 5 for timeout in completions.timeouts)
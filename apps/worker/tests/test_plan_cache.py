@@ -0,0 +1,103 @@
+import asyncio
+import pytest
+from worker.schemas import MealPreference
+from worker.services.plan_cache import PlanCache, normalize_preferences, plan_cache_key
+from worker.services.plan_payload import JSONPayload
+
+@pytest.fixture
+def base_profile():
+    return dict(
+        age=30,
+        weightKg=70.0,
+        heightCm=170,
+        sex="male",
+        goal="maintain",
+        dietType="omnivore",
+        allergies=["nuts", "Shellfish"],
+        dislikes=["mushrooms"],
+        cookingEffort="quick",
+        caloriesTarget=2010
+    )
+
+@pytest.fixture
+def sample_plan():
+    return {"plan": [{"day": 1, "meals": []}], "totals": {"kcal": 2000}, "groceries": []}
+
+def test_normalization_ignores_order_case_and_small_calorie_changes(base_profile):
+    """Test that near-identical profiles share a cache key."""
+    variant = dict(base_profile, allergies=["shellfish", "NUTS"], caloriesTarget=1990)
+    assert plan_cache_key(MealPreference(**base_profile), "t") == plan_cache_key(MealPreference(**variant), "t")
+
+    different = dict(base_profile, caloriesTarget=2300)
+    assert plan_cache_key(MealPreference(**base_profile), "t") != plan_cache_key(MealPreference(**different), "t")
+
+def test_normalization_maps_free_text_values_to_enum_values():
+    """Test that main.py's free-text values normalize like worker.schemas enums."""
+    canonical = normalize_preferences({
+        "goal": "lose weight",
+        "cookingEffort": "quick and easy",
+        "dietType": "Vegan",
+        "recentMeals": ["Tofu Scramble", "tofu scramble"],
+    })
+    assert canonical["goal"] == "lose"
+    assert canonical["cookingEffort"] == "quick"
+    assert canonical["dietType"] == "vegan"
+    assert canonical["recentMeals"] == ["tofu scramble"]
+
+def test_memory_tier_lru_and_ttl(sample_plan):
+    """Test LRU eviction and TTL expiry of the in-process tier."""
+    async def scenario():
+        cache = PlanCache(path=None, max_entries=2, ttl_seconds=60)
+        await cache.set("a", sample_plan)
+        await cache.set("b", sample_plan)
+        assert await cache.get("a") == sample_plan  # "a" becomes most recent
+        await cache.set("c", sample_plan)  # evicts "b"
+        assert await cache.get("b") is None
+
+        expired = PlanCache(path=None, ttl_seconds=-1)
+        await expired.set("a", sample_plan)
+        assert await expired.get("a") is None
+        return cache.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["memory_hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["memory_entries"] == 2
+
+def test_shared_tier_is_visible_to_other_instances(tmp_path, sample_plan):
+    """Test that a plan cached by one process is served from SQLite to another."""
+    path = str(tmp_path / "plans.sqlite3")
+
+    async def scenario():
+        await PlanCache(path=path).set("key", sample_plan)
+        other = PlanCache(path=path)
+        plan = await other.get("key")
+        return plan, other.stats()
+
+    plan, stats = asyncio.run(scenario())
+    assert plan == sample_plan
+    assert stats["shared_hits"] == 1
+
+def test_cached_plans_are_private_copies(sample_plan):
+    """Test that mutating a returned plan does not corrupt the cache."""
+    async def scenario():
+        cache = PlanCache(path=None)
+        await cache.set("key", sample_plan)
+        (await cache.get("key"))["plan"].clear()
+        return await cache.get("key")
+
+    assert asyncio.run(scenario()) == sample_plan
+
+def test_payloads_round_trip_as_stored_bytes(tmp_path, sample_plan):
+    """Test that a stored payload comes back byte for byte, from either tier."""
+    path = str(tmp_path / "plans.sqlite3")
+
+    async def scenario():
+        payload = JSONPayload.from_data(sample_plan)
+        await PlanCache(path=path).set_payload("key", payload)
+        hit = await PlanCache(path=path).get_payload("key")
+        return payload.body, hit
+
+    body, hit = asyncio.run(scenario())
+    assert hit.body == body
+    assert hit.data() == sample_plan
@@ -0,0 +1,26 @@
+import json
+from benchmarks.postprocess import MANIFEST_PATH, compare, load_corpus, outcome_mismatches
+
+def test_corpus_outcomes_match_the_manifest():
+    """Test that every post-processing stage still handles every corpus case as recorded."""
+    with open(MANIFEST_PATH) as f:
+        expected = json.load(f)["outcomes"]
+    cases = load_corpus()
+    assert len(cases) == 24
+    assert outcome_mismatches(cases, expected) == []
+
+def test_compare_flags_stage_slowdowns_and_allocation_growth():
+    """Test that a stage slower across a size fails, while one noisy case or a slower machine does not."""
+    baseline = {f"sanitize_meal_plan:7day/{case}": {"us": 100.0, "peak_kib": 10.0} for case in ("clean", "fenced", "truncated")}
+
+    noisy = {**baseline, "sanitize_meal_plan:7day/clean": {"us": 160.0, "peak_kib": 10.0}}
+    assert compare(noisy, baseline) == []
+
+    slower_machine = {key: {"us": 190.0, "peak_kib": 10.0} for key in baseline}
+    assert compare(slower_machine, baseline, speed=2.0) == []
+
+    regressed = {key: {"us": 150.0, "peak_kib": 10.0} for key in baseline}
+    assert compare(regressed, baseline) == ["sanitize_meal_plan on 7day: 1.50x the baseline time (geometric mean of 3 cases)"]
+
+    grown = {**baseline, "sanitize_meal_plan:7day/fenced": {"us": 100.0, "peak_kib": 20.0}}
+    assert compare(grown, baseline) == ["sanitize_meal_plan:7day/fenced: peak 20.0KiB vs 10.0KiB baseline"]
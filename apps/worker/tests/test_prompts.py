@@ -0,0 +1,36 @@
+from worker.config import settings
+from worker.services.openai_client import OpenAIClient
+from worker.services.plan_prompts import day_group_prompt, week_plan_prompt
+from worker.services.prompts import PromptTemplate, count_tokens
+
+def test_template_keeps_static_sections_in_the_prefix():
+    """Test that a compiled template renders only the suffix per request and reports tokens per section."""
+    template = PromptTemplate("demo", [("role", "\nYou plan meals.\n"), ("format", "Return JSON.")], "Profile: {age}")
+    assert template.prefix == "You plan meals.\n\nReturn JSON."
+    assert template.messages(age=30) == [
+        {"role": "system", "content": "You plan meals.\n\nReturn JSON."},
+        {"role": "user", "content": "Profile: 30"},
+    ]
+    report = template.token_report("Profile: 30")
+    assert set(report["sections"]) == {"role", "format"}
+    assert report["total"] == template.prefix_tokens + count_tokens("Profile: 30") > 0
+
+def test_plan_prompts_share_a_byte_identical_prefix_across_profiles(make_preferences):
+    """Test that different profiles only differ in the user message, which carries their values."""
+    client = OpenAIClient(object())
+    first = make_preferences()
+    second = make_preferences(age=52, sex="female", mealsPerDay=5, allergies=["peanuts"], includeProteinShakes=True)
+
+    week = [client._week_messages(first), client._week_messages(second)]
+    assert week[0][0] == week[1][0]
+    assert week[0][0]["content"] == week_plan_prompt(settings.LOCAL_GROCERIES).prefix
+    assert "EXACTLY 5, in this order: breakfast, lunch, dinner, afternoon snack, evening snack" in week[1][1]["content"]
+    assert "52-year-old female" in week[1][1]["content"] and "peanuts" in week[1][1]["content"]
+    assert "Protein powder: No" in week[0][1]["content"]
+
+    themes = client._day_themes(first)
+    days = [client._days_messages(first, [1, 2], themes), client._days_messages(second, [7], themes)]
+    assert days[0][0] == days[1][0]
+    assert days[1][1]["content"].startswith("Create days 7 of")
+    assert week_plan_prompt(settings.LOCAL_GROCERIES) is week_plan_prompt(settings.LOCAL_GROCERIES)
+    assert day_group_prompt(True).prefix != day_group_prompt(False).prefix
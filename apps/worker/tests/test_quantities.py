@@ -0,0 +1,56 @@
+import pytest
+from worker.services.ingredients import load_ingredient_index
+from worker.services.quantities import Quantity, format_quantities, parse_quantity
+
+@pytest.mark.parametrize("text, expected", [
+    ("150g", Quantity(150.0, "g")),
+    ("1,5 kg", Quantity(1500.0, "g")),
+    ("1 lb", Quantity(453.592, "g")),
+    ("1/2 cup", Quantity(120.0, "ml")),
+    ("1 1/2 cups", Quantity(360.0, "ml")),
+    ("½ cup", Quantity(120.0, "ml")),
+    ("2 fl oz", Quantity(59.147, "ml")),
+    ("2 large", Quantity(2.0, "")),
+    ("3 eggs", Quantity(3.0, "")),
+    ("2-3 cloves", Quantity(3.0, "clove")),
+    ("1 serving", Quantity(1.0, "serving")),
+    ("a pinch", Quantity(1.0, "pinch")),
+    ("1 scoop (30g)", Quantity(30.0, "g")),
+    ("100g (3.5 oz)", Quantity(100.0, "g")),
+])
+def test_parse_quantity(text, expected):
+    """Test that metric, US, fractional, ranged and named amounts parse to base units."""
+    quantity = parse_quantity(text)
+    assert quantity.unit == expected.unit
+    assert quantity.amount == pytest.approx(expected.amount)
+
+def test_unparseable_amounts_and_memoization():
+    """Test that amounts without a number are skipped and repeated strings are parsed once."""
+    assert parse_quantity("to taste") is None
+    assert parse_quantity("") is None
+    parse_quantity.cache_clear()
+    for _ in range(3):
+        parse_quantity("1 tbsp")
+    assert parse_quantity.cache_info().hits == 2
+
+def test_format_quantities():
+    """Test that totals are rounded, scaled to kg/l and listed metric first."""
+    assert format_quantities({"g": 1234.0}) == "1.2 kg"
+    assert format_quantities({"clove": 3.0, "ml": 30.0, "": 2.5}) == "30 ml + 2.5 + 3 cloves"
+    assert format_quantities({"pinch": 2.0}) == "2 pinches"
+
+def test_aggregate_sums_across_days_with_densities():
+    """Test that one ingredient's grams, cups and spellings add up over the week."""
+    meal = {"ingredients": [
+        {"item": "Salmon fillets", "qty": "150g"},
+        {"item": "Rolled oats", "qty": "1 cup"},
+        {"item": "Garlic", "qty": "2 cloves"},
+        {"item": "Salt", "qty": "to taste"},
+    ]}
+    plan = [{"day": day, "meals": [meal, {"ingredients": [{"item": "oats", "qty": "40g"}]}]} for day in range(1, 8)]
+    totals = load_ingredient_index().aggregate(plan)
+    assert totals["Proteins"]["Salmon fillet"] == {"g": pytest.approx(1050.0)}
+    # 1 cup of oats is about 98 g (0.41 g/ml), plus 40 g, each day
+    assert totals["Grains"]["Rolled oats"]["g"] == pytest.approx(7 * (240 * 0.41 + 40))
+    assert totals["Vegetables"]["Garlic"] == {"clove": 14.0}
+    assert totals["Spices"]["Sea salt"] == {}
@@ -0,0 +1,116 @@
+import asyncio
+import httpx
+import openai
+import pytest
+from worker.services.retry_policy import (
+    Deadline,
+    DeadlineExceeded,
+    RetryBudget,
+    RetryBudgetExhausted,
+    RetryPolicy,
+    is_retryable,
+)
+
+def status_error(status_code, headers=None):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(status_code, request=request, headers=headers or {})
+    return openai.APIStatusError("upstream error", response=response, body=None)
+
+def flaky(failures):
+    """Operation that raises each of ``failures`` in turn, then succeeds."""
+    calls = []
+
+    async def operation(deadline):
+        calls.append(deadline.remaining())
+        if len(calls) <= len(failures):
+            raise failures[len(calls) - 1]
+        return "ok"
+
+    return operation, calls
+
+def test_classification():
+    """Test that transient upstream errors retry and client errors do not."""
+    assert is_retryable(status_error(429))
+    assert is_retryable(status_error(503))
+    assert not is_retryable(status_error(401))
+    assert not is_retryable(status_error(400))
+    assert is_retryable(ValueError("bad JSON from model"))
+    try:
+        try:
+            raise status_error(401)
+        except Exception as e:
+            raise Exception("Failed to generate meal plan") from e
+    except Exception as wrapped:
+        assert not is_retryable(wrapped)
+
+def test_retries_with_backoff_until_success():
+    """Test that transient failures are retried and the deadline is shared across attempts."""
+    policy = RetryPolicy(RetryBudget(), base_delay=0.001, max_delay=0.01, deadline_seconds=5)
+    operation, calls = flaky([status_error(503), ValueError("bad JSON")])
+
+    assert asyncio.run(policy.run(operation)) == "ok"
+    assert len(calls) == 3
+    assert calls[0] >= calls[1] >= calls[2]
+
+def test_non_retryable_error_is_raised_immediately():
+    """Test that an auth error is not retried."""
+    policy = RetryPolicy(RetryBudget(), base_delay=0.001)
+    operation, calls = flaky([status_error(401)])
+
+    with pytest.raises(openai.APIStatusError):
+        asyncio.run(policy.run(operation))
+    assert len(calls) == 1
+
+def test_deadline_stops_slow_attempts():
+    """Test that an attempt still running at the deadline is cancelled."""
+    policy = RetryPolicy(RetryBudget(), deadline_seconds=0.05)
+
+    async def operation(deadline):
+        await asyncio.sleep(1)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(policy.run(operation))
+    assert policy.stats()["deadline_exceeded"] == 1
+
+def test_retry_after_beyond_deadline_gives_up():
+    """Test that a Retry-After longer than the time left ends the request instead of sleeping."""
+    policy = RetryPolicy(RetryBudget(), deadline_seconds=1)
+    operation, calls = flaky([status_error(429, {"retry-after": "20"})])
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(policy.run(operation))
+    assert len(calls) == 1
+
+def test_budget_caps_retries_to_fraction_of_traffic():
+    """Test that once the burst is spent, retries are limited to the configured ratio."""
+    budget = RetryBudget(ratio=0.1, min_per_second=0, burst=2)
+    policy = RetryPolicy(budget, base_delay=0.0001, max_delay=0.0001)
+
+    async def always_failing(deadline):
+        raise status_error(503)
+
+    async def run_many(count):
+        outcomes = []
+        for _ in range(count):
+            try:
+                await policy.run(always_failing)
+            except RetryBudgetExhausted:
+                outcomes.append("budget")
+            except openai.APIStatusError:
+                outcomes.append("failed")
+        return outcomes
+
+    outcomes = asyncio.run(run_many(20))
+    stats = budget.stats()
+    assert stats["requests"] == 20
+    # Burst of 2 plus 0.1 per request
+    assert stats["retries"] <= 2 + 0.1 * 20
+    assert outcomes.count("budget") >= 15
+
+def test_deadline_timeout_is_capped():
+    """Test that per-call timeouts never exceed the time left or the cap."""
+    deadline = Deadline(10)
+    assert deadline.timeout(cap=2) == 2
+    assert 9 < deadline.timeout() <= 10
+    with pytest.raises(DeadlineExceeded):
+        Deadline(0).timeout()
@@ -0,0 +1,58 @@
+import asyncio
+from worker.services.single_flight import SingleFlight, flight_key
+
+def test_concurrent_identical_calls_share_one_execution():
+    """Test that concurrent calls with the same key run the work once."""
+    calls = 0
+
+    async def generate():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"plan": []}
+
+    async def scenario():
+        flights = SingleFlight()
+        results = await asyncio.gather(*(flights.do("same", generate) for _ in range(5)))
+        return results, flights.stats()
+
+    results, stats = asyncio.run(scenario())
+    assert calls == 1
+    assert all(result is results[0] for result in results)
+    assert stats == {"leaders": 1, "coalesced": 4, "inflight": 0}
+
+def test_errors_are_shared_and_key_is_released():
+    """Test that a failure propagates to every waiter and the next call starts fresh."""
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def scenario():
+        flights = SingleFlight()
+        results = await asyncio.gather(flights.do("k", fail), flights.do("k", fail), return_exceptions=True)
+        assert all(isinstance(r, ValueError) for r in results)
+        return await flights.do("k", lambda: asyncio.sleep(0, result="ok"))
+
+    assert asyncio.run(scenario()) == "ok"
+
+def test_cancelled_waiter_does_not_cancel_shared_work():
+    """Test that a disconnecting caller leaves the generation running for others."""
+    async def generate():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def scenario():
+        flights = SingleFlight()
+        first = asyncio.ensure_future(flights.do("k", generate))
+        second = asyncio.ensure_future(flights.do("k", generate))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(scenario()) == "done"
+
+def test_flight_key_scopes():
+    """Test that idempotency scope and regenerate flag separate flights."""
+    assert flight_key("abc") == flight_key("abc", "  ")
+    assert flight_key("abc", "req-1") != flight_key("abc", "req-2")
+    assert flight_key("abc", regenerate=True) != flight_key("abc")
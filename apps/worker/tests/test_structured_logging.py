@@ -0,0 +1,66 @@
+import io
+import json
+import logging
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from worker.services import structured_logging
+from worker.services.structured_logging import RequestIDMiddleware, configure_logging, log_payload, request_id_var, stop_logging
+
+def read_records(stream):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+def test_records_are_json_with_request_id_fields_and_traceback():
+    """Test that records pass through the queue as JSON lines carrying the request ID, extra fields and tracebacks."""
+    stream = io.StringIO()
+    configure_logging("INFO", stream=stream)
+    log = logging.getLogger("tests.structured")
+    token = request_id_var.set("req-1")
+    try:
+        log.info("Plan received", extra={"stage": "parse", "days": 7})
+        log.debug("not written")
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            log.exception("Generation failed")
+    finally:
+        request_id_var.reset(token)
+        stop_logging()
+
+    records = read_records(stream)
+    assert [record["message"] for record in records] == ["Plan received", "Generation failed"]
+    assert records[0]["request_id"] == "req-1"
+    assert records[0]["stage"] == "parse" and records[0]["days"] == 7
+    assert "ValueError: boom" in records[1]["exc"]
+
+def test_payloads_are_sampled_and_truncated(monkeypatch):
+    """Test that raw payloads are logged only for the sampled fraction of calls, cut to max_chars."""
+    stream = io.StringIO()
+    configure_logging("INFO", stream=stream)
+    log = logging.getLogger("tests.structured")
+    try:
+        log_payload(log, "never", "x" * 10, sample_rate=0)
+        monkeypatch.setattr(structured_logging.random, "random", lambda: 0.5)
+        log_payload(log, "skipped", "x" * 10, sample_rate=0.2)
+        log_payload(log, "sampled", "x" * 10, sample_rate=0.8, max_chars=4, stage="parse")
+    finally:
+        stop_logging()
+
+    records = read_records(stream)
+    assert len(records) == 1
+    assert records[0]["payload"] == "xxxx" and records[0]["payload_chars"] == 10
+
+def test_middleware_assigns_and_echoes_request_ids():
+    """Test that each request gets an ID visible to handlers and echoed in X-Request-ID."""
+    app = FastAPI()
+    app.add_middleware(RequestIDMiddleware)
+
+    @app.get("/")
+    async def root():
+        return {"request_id": request_id_var.get()}
+
+    client = TestClient(app)
+    given = client.get("/", headers={"X-Request-ID": "abc123"})
+    generated = client.get("/")
+    assert given.json() == {"request_id": "abc123"}
+    assert given.headers["x-request-id"] == "abc123"
+    assert generated.headers["x-request-id"] == generated.json()["request_id"] != "-"
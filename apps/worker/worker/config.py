@@ -1,10 +1,83 @@
 from pydantic_settings import BaseSettings
+from worker.services.job_store import DEFAULT_JOBS_PATH
+from worker.services.meal_store import DEFAULT_MEAL_STORE_PATH
+from worker.services.metrics import DEFAULT_METRICS_PATH
+from worker.services.plan_cache import DEFAULT_CACHE_PATH
 
 class Settings(BaseSettings):
     OPENAI_API_KEY: str
     ALLOWED_ORIGINS: str = "http://localhost:4321"
     PORT: int = 8420
     
+    # Shared upstream connection pool (one per process)
+    OPENAI_MAX_CONNECTIONS: int = 64
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS: int = 32
+    OPENAI_KEEPALIVE_EXPIRY_SECONDS: float = 60.0
+    OPENAI_TIMEOUT_SECONDS: float = 90.0
+    OPENAI_HTTP2: bool = True
+    OPENAI_WARMUP_CONNECTIONS: int = 2
+    
+    # Days requested per upstream call; below 7 the week is generated as concurrent groups
+    GENERATION_DAYS_PER_REQUEST: int = 2
+    # Rounds of targeted day/meal regeneration before a whole-plan retry
+    PLAN_REPAIR_ROUNDS: int = 2
+    # Offline plans from the bundled recipe corpus: serve them directly for
+    # profiles the corpus fully covers, and/or when generation fails
+    LOCAL_PLAN_FAST_PATH: bool = False
+    LOCAL_PLAN_FALLBACK: bool = False
+    # /generate/batch: max profiles per call and how many generate at once
+    BATCH_MAX_PROFILES: int = 10
+    BATCH_MAX_CONCURRENCY: int = 4
+    # Build grocery lists from the bundled ingredient taxonomy instead of asking the model
+    LOCAL_GROCERIES: bool = True
+    # Compute each meal's kcal and macros from its ingredients with the bundled
+    # nutrition table instead of asking the model for them
+    LOCAL_MACROS: bool = False
+    
+    # Retry policy: overall deadline per request, backoff, and a process-wide
+    # budget that keeps retries to RETRY_BUDGET_RATIO of request volume
+    GENERATION_DEADLINE_SECONDS: float = 120.0
+    RETRY_MAX_ATTEMPTS: int = 5
+    RETRY_BASE_DELAY_SECONDS: float = 0.5
+    RETRY_MAX_DELAY_SECONDS: float = 8.0
+    RETRY_BUDGET_RATIO: float = 0.2
+    RETRY_BUDGET_MIN_PER_SECOND: float = 1.0
+    RETRY_BUDGET_BURST: float = 10.0
+    
+    # Background jobs (POST /jobs); state lives in a SQLite file shared by all worker processes
+    JOBS_PATH: str = DEFAULT_JOBS_PATH
+    JOB_WORKERS: int = 4
+    JOB_MAX_QUEUED: int = 100
+    JOB_TTL_SECONDS: float = 7 * 24 * 3600.0
+    JOB_MAX_WAIT_SECONDS: float = 55.0
+    JOB_EVENTS_MAX_SECONDS: float = 600.0
+    JOB_EVENTS_HEARTBEAT_SECONDS: float = 15.0
+    
+    # Store of validated meals (SQLite + FTS5), reused to fill up to
+    # MEAL_STORE_MAX_FILL of a new plan's slots; 0 only records meals
+    MEAL_STORE_ENABLED: bool = True
+    MEAL_STORE_PATH: str = DEFAULT_MEAL_STORE_PATH
+    MEAL_STORE_MAX_MEALS: int = 20000
+    MEAL_STORE_MAX_FILL: float = 1.0
+    
+    # Logging: JSON lines (or "text") written by a background thread; raw model
+    # responses are logged for LOG_PAYLOAD_SAMPLE_RATE of calls only
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "json"
+    LOG_PAYLOAD_SAMPLE_RATE: float = 0.01
+    
+    # Plan cache (in-process LRU + SQLite file shared by all worker processes)
+    PLAN_CACHE_ENABLED: bool = True
+    PLAN_CACHE_PATH: str = DEFAULT_CACHE_PATH
+    PLAN_CACHE_MAX_ENTRIES: int = 1024
+    PLAN_CACHE_TTL_SECONDS: float = 86400.0
+    
+    # /metrics (Prometheus text); each process flushes its counters into this
+    # SQLite file every METRICS_FLUSH_SECONDS and on every scrape
+    METRICS_ENABLED: bool = True
+    METRICS_PATH: str = DEFAULT_METRICS_PATH
+    METRICS_FLUSH_SECONDS: float = 10.0
+    
     @property
     def allowed_origins_list(self) -> list[str]:
         """Parse ALLOWED_ORIGINS string into a list"""
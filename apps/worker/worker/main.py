@@ -1,12 +1,88 @@
+import asyncio
+from contextlib import asynccontextmanager
+from functools import partial
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from worker.routers import health, generate
+from worker.routers import health, generate, jobs, metrics
 from worker.config import settings
+from worker.services.ingredients import load_ingredient_index
+from worker.services.job_store import JobRunner, JobStore
+from worker.services.meal_store import MealStore
+from worker.services.metrics import GENERATION_RETRIES, Metrics
+from worker.services.nutrition_db import load_nutrition_table
+from worker.services.openai_client import OpenAIClient
+from worker.services.plan_prompts import day_group_prompt, week_plan_prompt
+from worker.services.plan_cache import PlanCache
+from worker.services.retry_policy import RetryBudget, RetryPolicy, retry_cause
+from worker.services.single_flight import SingleFlight
+from worker.services.structured_logging import RequestIDMiddleware, configure_logging, stop_logging
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Log records are written by a background thread, never on the event loop
+    configure_logging(settings.LOG_LEVEL, json_format=settings.LOG_FORMAT == "json")
+    # Counters are recorded in memory and flushed to a file shared by all worker processes
+    app.state.metrics = Metrics(path=settings.METRICS_PATH, enabled=settings.METRICS_ENABLED)
+    metrics_flusher = asyncio.create_task(app.state.metrics.flush_periodically(settings.METRICS_FLUSH_SECONDS))
+    # One pooled upstream client per process, shared by every request
+    app.state.openai_client = OpenAIClient.create_shared(app.state.metrics)
+    await app.state.openai_client.warm_up(settings.OPENAI_WARMUP_CONNECTIONS)
+    app.state.plan_cache = PlanCache(
+        path=settings.PLAN_CACHE_PATH,
+        max_entries=settings.PLAN_CACHE_MAX_ENTRIES,
+        ttl_seconds=settings.PLAN_CACHE_TTL_SECONDS,
+        enabled=settings.PLAN_CACHE_ENABLED,
+    )
+    app.state.generation_flights = SingleFlight()
+    # Load the ingredient taxonomy before the first plan needs a grocery list
+    load_ingredient_index()
+    # Map the compiled nutrition table before the first plan needs meal macros
+    if settings.LOCAL_MACROS:
+        load_nutrition_table()
+    # Compile the plan prompts once; their static prefixes are byte-identical across requests
+    app.state.prompts = [
+        week_plan_prompt(settings.LOCAL_GROCERIES, settings.LOCAL_MACROS),
+        day_group_prompt(settings.LOCAL_GROCERIES, settings.LOCAL_MACROS),
+    ]
+    app.state.meal_store = MealStore(
+        path=settings.MEAL_STORE_PATH,
+        max_meals=settings.MEAL_STORE_MAX_MEALS,
+        enabled=settings.MEAL_STORE_ENABLED,
+    )
+    app.state.retry_policy = RetryPolicy(
+        RetryBudget(
+            ratio=settings.RETRY_BUDGET_RATIO,
+            min_per_second=settings.RETRY_BUDGET_MIN_PER_SECOND,
+            burst=settings.RETRY_BUDGET_BURST,
+        ),
+        max_attempts=settings.RETRY_MAX_ATTEMPTS,
+        deadline_seconds=settings.GENERATION_DEADLINE_SECONDS,
+        base_delay=settings.RETRY_BASE_DELAY_SECONDS,
+        max_delay=settings.RETRY_MAX_DELAY_SECONDS,
+        on_retry=lambda error: app.state.metrics.inc(GENERATION_RETRIES, cause=retry_cause(error)),
+    )
+    # Background generation jobs; unfinished jobs of dead processes are picked up
+    app.state.job_runner = JobRunner(
+        JobStore(path=settings.JOBS_PATH, ttl_seconds=settings.JOB_TTL_SECONDS),
+        handler=partial(jobs.run_generation_job, app.state),
+        workers=settings.JOB_WORKERS,
+        max_queued=settings.JOB_MAX_QUEUED,
+    )
+    await app.state.job_runner.start()
+    try:
+        yield
+    finally:
+        await app.state.job_runner.stop()
+        await app.state.openai_client.aclose()
+        metrics_flusher.cancel()
+        await asyncio.gather(metrics_flusher, return_exceptions=True)
+        stop_logging()
 
 app = FastAPI(
     title="WellPlate Worker Service",
     description="AI-powered meal plan generation service",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # CORS middleware
@@ -16,11 +92,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
+# Every request gets an ID that appears in its log lines and the X-Request-ID response header
+app.add_middleware(RequestIDMiddleware)
 
 # Include routers
 app.include_router(health.router, prefix="/health", tags=["health"])
 app.include_router(generate.router, prefix="/generate", tags=["generate"])
+app.include_router(jobs.router, prefix="/jobs", tags=["jobs"])
+app.include_router(metrics.router, prefix="/metrics", tags=["metrics"])
 
 @app.get("/")
 async def root():
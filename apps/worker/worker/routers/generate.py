@@ -1,73 +1,327 @@
-from fastapi import APIRouter, HTTPException
-from worker.schemas import MealPlanRequest, MealPlanResponse, MealPreference
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from worker.config import settings
+from worker.schemas import (
+    BatchMealPlanRequest,
+    BatchMealPlanResponse,
+    MealPlanRequest,
+    MealPlanResponse,
+    MealPreference,
+)
+from worker.services.batch import gather_unique
+from worker.services.local_planner import is_simple_profile, local_meal_plan
+from worker.services.meal_store import MealStore
+from worker.services.metrics import FALLBACK_RESPONSES, GENERATION_SECONDS, Metrics
 from worker.services.openai_client import OpenAIClient
+from worker.services.plan_cache import PlanCache, plan_cache_key
+from worker.services.plan_payload import (
+    JSONPayload,
+    batch_response_body,
+    event_line,
+    json_response,
+    plan_event_line,
+    validated_plan_payload,
+)
+from worker.services.retry_policy import Deadline, RetryPolicy
+from worker.services.single_flight import SingleFlight, flight_key
 import logging
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Bump whenever the prompt or validation changes so stale plans are not served
+PLAN_CACHE_SCOPE = "worker.generate:v2"
+
+def get_openai_client(request: Request) -> OpenAIClient:
+    """Return the process-wide client created in the app lifespan."""
+    return request.app.state.openai_client
+
+def get_plan_cache(request: Request) -> PlanCache:
+    """Return the process-wide plan cache created in the app lifespan."""
+    return request.app.state.plan_cache
+
+def get_generation_flights(request: Request) -> SingleFlight:
+    """Return the process-wide single-flight group created in the app lifespan."""
+    return request.app.state.generation_flights
+
+def get_retry_policy(request: Request) -> RetryPolicy:
+    """Return the process-wide retry policy (and budget) created in the app lifespan."""
+    return request.app.state.retry_policy
+
+def get_meal_store(request: Request) -> MealStore:
+    """Return the process-wide meal store created in the app lifespan."""
+    return request.app.state.meal_store
+
+def get_metrics(request: Request) -> Metrics:
+    """Return the process-wide metrics created in the app lifespan."""
+    return request.app.state.metrics
+
+async def _generate_validated_plan(
+    preferences: MealPreference,
+    client: OpenAIClient,
+    plan_cache: PlanCache,
+    flights: SingleFlight,
+    retry_policy: RetryPolicy,
+    regenerate: bool,
+    idempotency_key: Optional[str] = None,
+    meal_store: Optional[MealStore] = None,
+    metrics: Optional[Metrics] = None,
+    endpoint: str = "generate",
+) -> JSONPayload:
+    """
+    Serve a cached plan for this profile when available. Otherwise generate
+    one, sharing a single upstream generation among concurrent identical
+    requests, and cache it. Unless regenerating, slots are filled from the
+    meal store first so only the rest is generated. The local recipe planner
+    can serve simple profiles directly (LOCAL_PLAN_FAST_PATH) and stand in
+    when generation fails (LOCAL_PLAN_FALLBACK). The end-to-end time is
+    recorded with where the plan came from.
+
+    The plan comes back as validated JSON bytes; a cached one is returned as
+    stored, without decoding or validating it again.
+    """
+    metrics = metrics or Metrics(path=None, enabled=False)
+    with metrics.timer(GENERATION_SECONDS, endpoint=endpoint, source="generated") as labels:
+        if settings.LOCAL_PLAN_FAST_PATH and not regenerate and is_simple_profile(preferences):
+            logger.info("Serving local meal plan for simple profile")
+            labels["source"] = "local"
+            return validated_plan_payload(local_meal_plan(preferences))
+
+        cache_key = plan_cache_key(preferences, scope=PLAN_CACHE_SCOPE)
+        if regenerate:
+            plan_cache.record_bypass()
+        else:
+            cached_plan = await plan_cache.get_payload(cache_key)
+            if cached_plan is not None:
+                logger.info("Serving meal plan from cache")
+                labels["source"] = "cache"
+                return cached_plan
+
+        try:
+            return await flights.do(
+                flight_key(cache_key, idempotency_key, regenerate),
+                lambda: _generate_with_retries(
+                    preferences, client, plan_cache, retry_policy, cache_key, meal_store, reuse_meals=not regenerate
+                ),
+            )
+        except Exception as e:
+            if not settings.LOCAL_PLAN_FALLBACK:
+                raise
+            logger.warning(f"Generation failed, serving local meal plan: {str(e)}")
+            try:
+                plan = validated_plan_payload(local_meal_plan(preferences))
+            except Exception as local_error:
+                logger.error(f"Local meal plan failed: {str(local_error)}")
+                raise e
+            metrics.inc(FALLBACK_RESPONSES, kind="local")
+            labels["source"] = "fallback"
+            return plan
+
+async def _generate_with_retries(
+    preferences: MealPreference,
+    client: OpenAIClient,
+    plan_cache: PlanCache,
+    retry_policy: RetryPolicy,
+    cache_key: str,
+    meal_store: Optional[MealStore] = None,
+    reuse_meals: bool = True,
+) -> JSONPayload:
+    """
+    Generate and validate a plan under the retry policy: backoff between
+    attempts, one deadline across all of them, and the shared retry budget.
+    With a meal store, the new plan's meals are stored and, with
+    ``reuse_meals``, proven meals fill up to MEAL_STORE_MAX_FILL of the slots
+    before the upstream call.
+    """
+    prefilled = None
+    if meal_store is not None and reuse_meals and settings.MEAL_STORE_MAX_FILL > 0:
+        prefilled = await meal_store.lookup(preferences, days=7, max_fill=settings.MEAL_STORE_MAX_FILL)
+
+    async def attempt(deadline):
+        meal_plan = await client.generate_meal_plan(preferences, deadline, prefilled)
+        # Validate the response (the only validation it gets) and serialize it once
+        return validated_plan_payload(meal_plan)
+
+    validated_plan = await retry_policy.run(attempt)
+    logger.info("Successfully generated meal plan")
+    await plan_cache.set_payload(cache_key, validated_plan)
+    if meal_store is not None:
+        await meal_store.add_plan(validated_plan.data(), preferences)
+    return validated_plan
+
 @router.post("/", response_model=MealPlanResponse)
-async def generate_meal_plan(request: MealPlanRequest):
+async def generate_meal_plan(
+    request: MealPlanRequest,
+    regenerate: bool = False,
+    idempotency_key: Optional[str] = Header(None),
+    client: OpenAIClient = Depends(get_openai_client),
+    plan_cache: PlanCache = Depends(get_plan_cache),
+    flights: SingleFlight = Depends(get_generation_flights),
+    retry_policy: RetryPolicy = Depends(get_retry_policy),
+    meal_store: MealStore = Depends(get_meal_store),
+    metrics: Metrics = Depends(get_metrics),
+):
     """
     Generate a personalized 7-day meal plan based on user preferences.
+    Pass ?regenerate=true to skip the plan cache.
     """
     try:
-        client = OpenAIClient()
-        
-        # Generate meal plan with retry logic
-        max_retries = 5
-        for attempt in range(max_retries):
-            try:
-                meal_plan = await client.generate_meal_plan(request.preferences)
-                
-                # Validate the response
-                validated_plan = MealPlanResponse(**meal_plan)
-                
-                logger.info(f"Successfully generated meal plan on attempt {attempt + 1}")
-                return validated_plan
-                
-            except Exception as e:
-                logger.warning(f"Attempt {attempt + 1} failed: {str(e)}")
-                if attempt == max_retries - 1:
-                    raise e
-                continue
-        
+        plan = await _generate_validated_plan(
+            request.preferences, client, plan_cache, flights, retry_policy, regenerate, idempotency_key, meal_store, metrics
+        )
     except Exception as e:
         logger.error(f"Failed to generate meal plan: {str(e)}")
         raise HTTPException(
             status_code=500,
             detail=f"Failed to generate meal plan: {str(e)}"
         )
+    # Already validated and serialized; skip response_model's second pass
+    return json_response(plan)
 
 @router.post("/direct", response_model=MealPlanResponse)
-async def generate_meal_plan_direct(preferences: MealPreference):
+async def generate_meal_plan_direct(
+    preferences: MealPreference,
+    regenerate: bool = False,
+    idempotency_key: Optional[str] = Header(None),
+    client: OpenAIClient = Depends(get_openai_client),
+    plan_cache: PlanCache = Depends(get_plan_cache),
+    flights: SingleFlight = Depends(get_generation_flights),
+    retry_policy: RetryPolicy = Depends(get_retry_policy),
+    meal_store: MealStore = Depends(get_meal_store),
+    metrics: Metrics = Depends(get_metrics),
+):
     """
     Generate a personalized 7-day meal plan based on user preferences (direct format).
+    Pass ?regenerate=true to skip the plan cache.
     """
     try:
-        client = OpenAIClient()
-        
-        # Generate meal plan with retry logic
-        max_retries = 5
-        for attempt in range(max_retries):
-            try:
-                meal_plan = await client.generate_meal_plan(preferences)
-                
-                # Validate the response
-                validated_plan = MealPlanResponse(**meal_plan)
-                
-                logger.info(f"Successfully generated meal plan on attempt {attempt + 1}")
-                return validated_plan
-                
-            except Exception as e:
-                logger.warning(f"Attempt {attempt + 1} failed: {str(e)}")
-                if attempt == max_retries - 1:
-                    raise e
-                continue
-        
+        plan = await _generate_validated_plan(
+            preferences, client, plan_cache, flights, retry_policy, regenerate, idempotency_key, meal_store, metrics,
+            endpoint="direct",
+        )
     except Exception as e:
         logger.error(f"Failed to generate meal plan: {str(e)}")
         raise HTTPException(
             status_code=500,
             detail=f"Failed to generate meal plan: {str(e)}"
         )
+    # Already validated and serialized; skip response_model's second pass
+    return json_response(plan)
+
+@router.post("/batch", response_model=BatchMealPlanResponse)
+async def generate_meal_plan_batch(
+    request: BatchMealPlanRequest,
+    regenerate: bool = False,
+    client: OpenAIClient = Depends(get_openai_client),
+    plan_cache: PlanCache = Depends(get_plan_cache),
+    flights: SingleFlight = Depends(get_generation_flights),
+    retry_policy: RetryPolicy = Depends(get_retry_policy),
+    meal_store: MealStore = Depends(get_meal_store),
+    metrics: Metrics = Depends(get_metrics),
+):
+    """
+    Generate plans for several profiles (e.g. family members) in one call.
+    Identical profiles are generated once; up to BATCH_MAX_CONCURRENCY run at
+    a time. Each profile gets its own result or error, in request order.
+    """
+    profiles = request.profiles
+    if len(profiles) > settings.BATCH_MAX_PROFILES:
+        raise HTTPException(
+            status_code=422,
+            detail=f"At most {settings.BATCH_MAX_PROFILES} profiles per batch, got {len(profiles)}"
+        )
+
+    keys = [plan_cache_key(preferences, scope=PLAN_CACHE_SCOPE) for preferences in profiles]
+    outcomes = await gather_unique(
+        keys,
+        lambda index: _generate_validated_plan(
+            profiles[index], client, plan_cache, flights, retry_policy, regenerate,
+            meal_store=meal_store, metrics=metrics, endpoint="batch",
+        ),
+        settings.BATCH_MAX_CONCURRENCY,
+    )
+
+    results = []
+    for index, outcome in enumerate(outcomes):
+        if isinstance(outcome, Exception):
+            logger.error(f"Batch profile {index} failed: {str(outcome)}")
+            results.append((index, f"Failed to generate meal plan: {str(outcome)}"))
+        else:
+            results.append((index, outcome))
+    # Plans are spliced in as the validated bytes they already are
+    return Response(batch_response_body(results, len(set(keys))), media_type="application/json")
+
+@router.post("/stream")
+async def generate_meal_plan_stream(
+    request: MealPlanRequest,
+    regenerate: bool = False,
+    client: OpenAIClient = Depends(get_openai_client),
+    plan_cache: PlanCache = Depends(get_plan_cache),
+    flights: SingleFlight = Depends(get_generation_flights),
+    retry_policy: RetryPolicy = Depends(get_retry_policy),
+    meal_store: MealStore = Depends(get_meal_store),
+    metrics: Metrics = Depends(get_metrics),
+):
+    """
+    Stream a personalized 7-day meal plan as NDJSON events:
+    - {"type": "meal", "day", "index", "meal"} as soon as each meal is complete
+    - {"type": "reset", "reason"} if the streamed attempt failed; discard earlier meals
+    - {"type": "plan", "plan"} last, with the validated plan including totals and groceries
+    - {"type": "error", "detail"} if no plan could be produced
+    """
+    preferences = request.preferences
+    cache_key = plan_cache_key(preferences, scope=PLAN_CACHE_SCOPE)
+
+    def replay(plan: JSONPayload):
+        for day in plan.data()["plan"]:
+            for meal_idx, meal in enumerate(day["meals"]):
+                yield event_line({"type": "meal", "day": day["day"], "index": meal_idx, "meal": meal})
+        yield plan_event_line(plan)
+
+    async def events():
+        # Timed until the last event is sent, not just until the response starts
+        with metrics.timer(GENERATION_SECONDS, endpoint="stream", source="generated") as labels:
+            if regenerate:
+                plan_cache.record_bypass()
+            else:
+                cached_plan = await plan_cache.get_payload(cache_key)
+                if cached_plan is not None:
+                    labels["source"] = "cache"
+                    for line in replay(cached_plan):
+                        yield line
+                    return
+
+            try:
+                # The stream gets the same overall deadline a non-streamed attempt would
+                deadline = Deadline(retry_policy.deadline_seconds)
+                async for event in client.stream_meal_plan(preferences, deadline):
+                    if event["type"] == "plan":
+                        validated_plan = validated_plan_payload(event["plan"])
+                        await plan_cache.set_payload(cache_key, validated_plan)
+                        await meal_store.add_plan(validated_plan.data(), preferences)
+                        yield plan_event_line(validated_plan)
+                    else:
+                        yield event_line(event)
+                return
+            except Exception as e:
+                logger.warning(f"Streamed generation failed: {str(e)}")
+                yield event_line({"type": "reset", "reason": str(e)})
+
+            # Fall back to the regular generation path with retries
+            try:
+                plan = await flights.do(
+                    flight_key(cache_key, None, regenerate),
+                    lambda: _generate_with_retries(
+                        preferences, client, plan_cache, retry_policy, cache_key, meal_store, reuse_meals=not regenerate
+                    ),
+                )
+            except Exception as e:
+                logger.error(f"Failed to generate meal plan: {str(e)}")
+                labels["outcome"] = "error"
+                yield event_line({"type": "error", "detail": f"Failed to generate meal plan: {str(e)}"})
+                return
+            for line in replay(plan):
+                yield line
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
@@ -1,16 +1,28 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 
 router = APIRouter()
 
 @router.get("/")
-async def health_check():
+async def health_check(request: Request):
     """
     Health check endpoint for monitoring and load balancers.
     """
+    plan_cache = getattr(request.app.state, "plan_cache", None)
+    generation_flights = getattr(request.app.state, "generation_flights", None)
+    retry_policy = getattr(request.app.state, "retry_policy", None)
+    job_runner = getattr(request.app.state, "job_runner", None)
+    meal_store = getattr(request.app.state, "meal_store", None)
+    prompts = getattr(request.app.state, "prompts", None) or []
     return {
         "status": "healthy",
         "service": "nutriai-worker",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "plan_cache": plan_cache.stats() if plan_cache else None,
+        "single_flight": generation_flights.stats() if generation_flights else None,
+        "retries": retry_policy.stats() if retry_policy else None,
+        "jobs": job_runner.stats() if job_runner else None,
+        "meal_store": meal_store.stats() if meal_store else None,
+        "prompt_tokens": {prompt.name: prompt.token_report() for prompt in prompts}
     }
 
 @router.get("/ready")
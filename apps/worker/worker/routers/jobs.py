@@ -0,0 +1,83 @@
+import logging
+from typing import Any, Awaitable, Callable, Dict
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from worker.config import settings
+from worker.routers.generate import _generate_validated_plan
+from worker.schemas import MealPlanRequest, MealPreference
+from worker.services.job_store import JobQueueFull, JobRunner, job_event_stream, job_summary
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+def get_job_runner(request: Request) -> JobRunner:
+    """Return the process-wide job runner created in the app lifespan."""
+    return request.app.state.job_runner
+
+async def run_generation_job(
+    state: Any,
+    request: Dict[str, Any],
+    report: Callable[[Dict[str, Any]], Awaitable[None]],
+) -> Dict[str, Any]:
+    """Job handler: run the regular generation pipeline (cache, single-flight, retries) for one request."""
+    preferences = MealPreference(**request["preferences"])
+    await report({"stage": "generating"})
+    plan = await _generate_validated_plan(
+        preferences,
+        state.openai_client,
+        state.plan_cache,
+        state.generation_flights,
+        state.retry_policy,
+        request.get("regenerate", False),
+        meal_store=state.meal_store,
+        metrics=state.metrics,
+        endpoint="job",
+    )
+    return plan.data()
+
+@router.post("/", status_code=202)
+async def submit_job(
+    request: MealPlanRequest,
+    regenerate: bool = False,
+    runner: JobRunner = Depends(get_job_runner),
+):
+    """
+    Queue a meal plan generation and return its job ID immediately.
+    Poll GET /jobs/{id} (optionally with ?wait=seconds) or follow
+    GET /jobs/{id}/events for progress and the result.
+    """
+    try:
+        job = await runner.submit({"preferences": request.preferences.model_dump(mode="json"), "regenerate": regenerate})
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=f"Too many queued jobs: {str(e)}")
+    return job_summary(job)
+
+@router.get("/{job_id}")
+async def get_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, description="Seconds to wait for the job to finish (long-poll)"),
+    runner: JobRunner = Depends(get_job_runner),
+):
+    """
+    Return a job's status and progress, and its result once it has succeeded.
+    With ?wait=N the response is held until the job finishes or N seconds
+    (capped at JOB_MAX_WAIT_SECONDS) pass.
+    """
+    job = await runner.wait(job_id, min(wait, settings.JOB_MAX_WAIT_SECONDS))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/{job_id}/events")
+async def job_events(job_id: str, runner: JobRunner = Depends(get_job_runner)):
+    """
+    Server-sent events for one job: a "job" event on every status or progress
+    change, ending with the finished job (including its result).
+    """
+    if await runner.store.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(
+        job_event_stream(runner, job_id, settings.JOB_EVENTS_MAX_SECONDS, settings.JOB_EVENTS_HEARTBEAT_SECONDS),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
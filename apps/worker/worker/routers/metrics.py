@@ -0,0 +1,13 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import Response
+from worker.services.metrics import CONTENT_TYPE
+
+router = APIRouter()
+
+@router.get("")
+async def metrics(request: Request):
+    """
+    Latency histograms, token, retry, JSON repair and fallback counters for
+    every worker process on the host, in the Prometheus text format.
+    """
+    return Response(await request.app.state.metrics.render(), media_type=CONTENT_TYPE)
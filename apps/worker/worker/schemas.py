@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Literal
+from typing import Dict, List, Optional, Literal
 from enum import Enum
 
 class Sex(str, Enum):
@@ -52,6 +52,8 @@ class Totals(BaseModel):
 class GroceryCategory(BaseModel):
     category: str
     items: List[str]
+    # Week's total per item, e.g. {"Salmon fillet": "450 g"}; only for locally built lists
+    quantities: Dict[str, str] = Field(default_factory=dict)
 
 class MealPreference(BaseModel):
     age: int = Field(..., ge=16, le=100)
@@ -74,3 +76,16 @@ class MealPlanResponse(BaseModel):
     plan: List[DayPlan]
     totals: Totals
     groceries: List[GroceryCategory]
+
+class BatchMealPlanRequest(BaseModel):
+    profiles: List[MealPreference] = Field(..., min_length=1)
+
+class BatchMealPlanResult(BaseModel):
+    index: int
+    status: Literal["ok", "error"]
+    plan: Optional[MealPlanResponse] = None
+    error: Optional[str] = None
+
+class BatchMealPlanResponse(BaseModel):
+    results: List[BatchMealPlanResult]
+    unique_profiles: int
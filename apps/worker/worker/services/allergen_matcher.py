@@ -0,0 +1,223 @@
+import json
+import os
+import re
+from collections import deque
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Set, Tuple
+from worker.services.ingredients import _singular, load_ingredient_index
+
+ALLERGENS_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "allergens.json")
+
+# Words users add around an allergen ("lactose intolerance", "nut allergy")
+_QUALIFIERS = {"allergy", "allergies", "allergic", "intolerance", "intolerant", "sensitivity"}
+
+# "gluten-free", "dairy free": negates the word before it for the rest of the
+# phrase, up to punctuation or a conjunction ("gluten-free bread, toast")
+_FREE = re.compile(r"\b([a-z]+)[- ]free\b")
+_PHRASE_END = re.compile(r"[,;.:()\n]| and | or | with ")
+
+# What may follow a literal term inside the same word: its plural ending
+_PLURAL_ENDINGS = ("", "s", "es")
+
+class Match(NamedTuple):
+    term: str  # the user's allergy or dislike this match belongs to
+    category: str  # "allergy" or "dislike"
+    text: str  # the matched text, e.g. "almond" for "tree nuts"
+
+@lru_cache(maxsize=1)
+def load_allergen_table(path: str = ALLERGENS_PATH) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def _normalize_term(term: str) -> str:
+    words = [w for w in str(term).lower().replace("_", " ").split() if w not in _QUALIFIERS]
+    return " ".join(words)
+
+def _spellings(term: str) -> Set[str]:
+    """The term, its singular and, for "-y" words, the "-ies" plural; other plurals are plural endings."""
+    singular = _singular(term)
+    spellings = {term, singular}
+    if singular.endswith("y") and singular[-2:-1] not in ("", "a", "e", "i", "o", "u"):
+        spellings.add(singular[:-1] + "ies")
+    return spellings
+
+def tags_for_term(term: str) -> List[str]:
+    """Allergen tags a free-text allergy refers to ("tree nuts" -> ["nuts"]); empty if none."""
+    table = load_allergen_table()
+    term = _normalize_term(term)
+    for candidate in (term, _singular(term)):
+        if candidate in table["tags"]:
+            return [candidate]
+        if candidate in table["aliases"]:
+            return list(table["aliases"][candidate])
+    return []
+
+class _Automaton:
+    """Aho-Corasick automaton over lower-cased patterns, each carrying a payload."""
+
+    def __init__(self, patterns: Iterable[Tuple[str, Any]]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[List[Tuple[int, Any]]] = [[]]
+        for pattern, payload in patterns:
+            node = 0
+            for char in pattern:
+                if char not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                    self.goto[node][char] = len(self.goto) - 1
+                node = self.goto[node][char]
+            self.out[node].append((len(pattern), payload))
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+    def iter(self, text: str) -> Iterator[Tuple[int, int, Any]]:
+        """(start, end, payload) for every pattern occurrence, in one pass over ``text``."""
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length, payload in out[node]:
+                yield index + 1 - length, index + 1, payload
+
+class AllergenMatcher:
+    """
+    Finds a profile's allergies and dislikes in free text with one
+    Aho-Corasick pass.
+
+    Allergies that name an allergen group in the bundled table ("nuts",
+    "milk", "seafood") expand to every ingredient of the group ("almond
+    flour", "pesto", "ghee"); other allergies match literally. Dislikes are
+    tastes, not groups: they match literally, with their plural, the
+    ingredient taxonomy's synonyms ("aubergine" for "eggplant") and kinds
+    ("strawberries" for "berries"), so a dislike of "cheese" does not flag
+    yogurt. Matches must start at a word boundary ("nut" does not match
+    "coconut"), and literal terms must also end at one, give or take a
+    plural ending ("pea" matches "peas" but not "peach"); a match inside one of the
+    group's safe phrases ("eggplant", "coconut milk", "peanut butter" for
+    dairy) or negated by a preceding "-free" ("gluten-free bread") is
+    ignored.
+    """
+
+    def __init__(self, allergies: Iterable[str] = (), dislikes: Iterable[str] = ()):
+        table = load_allergen_table()
+        self._owners: Dict[Any, Tuple[str, str]] = {}
+        patterns: List[Tuple[str, Any]] = []
+        # Dislikes first so an allergy to the same group takes precedence
+        for category, terms in (("dislike", dislikes), ("allergy", allergies)):
+            for term in terms:
+                normalized = _normalize_term(term)
+                if not normalized:
+                    continue
+                tags = tags_for_term(normalized) if category == "allergy" else []
+                for tag in tags:
+                    self._owners[("tag", tag)] = (term, category)
+                if tags:
+                    continue
+                key = ("term", normalized)
+                self._owners[key] = (term, category)
+                spellings = _spellings(normalized)
+                if category == "dislike":
+                    index = load_ingredient_index()
+                    # True synonyms only: "chicken" is not a synonym of "chicken breast"
+                    for name in index.synonyms(normalized) + index.kinds(normalized):
+                        name = name.lower()
+                        if normalized not in name and name not in normalized:
+                            spellings |= _spellings(name)
+                patterns += [(spelling, (False, key)) for spelling in spellings]
+
+        for key in self._owners:
+            if key[0] != "tag":
+                continue
+            group = table["tags"][key[1]]
+            patterns += [(term.lower(), (False, key)) for term in group["terms"]]
+            patterns += [(phrase.lower(), (True, key)) for phrase in group.get("safe", [])]
+
+        self._automaton = _Automaton(patterns)
+        self.empty = not patterns
+
+    def find(self, text: str) -> List[Match]:
+        """Every allergy or dislike mentioned in ``text``."""
+        if self.empty or not text:
+            return []
+        text = text.lower()
+        # Longest hit per start and owner: "tomatoes" rather than "tomato" and "tomatoes"
+        hits: Dict[Tuple[int, Any], int] = {}
+        safe: Dict[Any, List[Tuple[int, int]]] = {}
+        for start, end, (is_safe, key) in self._automaton.iter(text):
+            if start > 0 and text[start - 1].isalnum():
+                continue
+            if key[0] == "term":
+                word_end = end
+                while word_end < len(text) and text[word_end].isalnum():
+                    word_end += 1
+                if text[end:word_end] not in _PLURAL_ENDINGS:
+                    continue
+            if is_safe:
+                safe.setdefault(key, []).append((start, end))
+            else:
+                hits[(start, key)] = max(end, hits.get((start, key), 0))
+
+        negations = self._negations(text) if hits else []
+        matches = []
+        for (start, key), end in hits.items():
+            if any(s <= start and end <= e for s, e in safe.get(key, ())):
+                continue
+            if any(s <= start < e and self._negates(word, key) for word, s, e in negations):
+                continue
+            term, category = self._owners[key]
+            matches.append(Match(term, category, text[start:end]))
+        return matches
+
+    @staticmethod
+    def _negations(text: str) -> List[Tuple[str, int, int]]:
+        """(word, start, end) of each "<word>-free" and the rest of its phrase."""
+        negations = []
+        for free in _FREE.finditer(text):
+            phrase_end = _PHRASE_END.search(text, free.end())
+            negations.append((free.group(1), free.start(), phrase_end.start() if phrase_end else len(text)))
+        return negations
+
+    @staticmethod
+    def _negates(word: str, key: Any) -> bool:
+        """Whether "<word>-free" rules out matches for ``key`` ("gluten-free" for wheat, "nut-free" for almonds)."""
+        kind, name = key
+        if kind == "tag":
+            return name in tags_for_term(word) or word in load_allergen_table()["tags"][name]["terms"]
+        return _singular(word) == _singular(name)
+
+    def find_in_meal(self, meal: Dict[str, Any]) -> List[Match]:
+        """Matches in a meal's name, ingredients and steps, scanned as one text."""
+        parts = [str(meal.get("name", ""))]
+        for ingredient in meal.get("ingredients") or []:
+            parts.append(str(ingredient.get("item", "")) if isinstance(ingredient, dict) else str(ingredient))
+        for step in meal.get("steps") or []:
+            parts.append(str(step))
+        return self.find("\n".join(parts))
+
+@lru_cache(maxsize=256)
+def _compile(allergies: Tuple[str, ...], dislikes: Tuple[str, ...]) -> AllergenMatcher:
+    return AllergenMatcher(allergies, dislikes)
+
+def compile_matcher(allergies: Iterable[str] = (), dislikes: Iterable[str] = ()) -> AllergenMatcher:
+    """The matcher for a profile, compiled once and reused across validation rounds and requests."""
+    return _compile(
+        tuple(sorted({a.strip().lower() for a in allergies or [] if a.strip()})),
+        tuple(sorted({d.strip().lower() for d in dislikes or [] if d.strip()})),
+    )
+
+def allergen_tags(text: str) -> Set[str]:
+    """Allergen tags of every group mentioned in ``text``."""
+    return {match.term for match in compile_matcher(list(load_allergen_table()["tags"])).find(text)}
@@ -0,0 +1,25 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List
+
+async def gather_unique(keys: List[str], run: Callable[[int], Awaitable[Any]], concurrency: int) -> List[Any]:
+    """
+    Run ``run(index)`` once per distinct key (for its first position), at most
+    ``concurrency`` at a time, and return one outcome per position. Failures
+    are returned as exception objects so one bad item does not sink the batch.
+    """
+    first_index: Dict[str, int] = {}
+    for index, key in enumerate(keys):
+        first_index.setdefault(key, index)
+
+    slots = asyncio.Semaphore(max(concurrency, 1))
+
+    async def limited(index: int) -> Any:
+        async with slots:
+            return await run(index)
+
+    outcomes = await asyncio.gather(
+        *(limited(index) for index in first_index.values()),
+        return_exceptions=True,
+    )
+    by_key = dict(zip(first_index, outcomes))
+    return [by_key[key] for key in keys]
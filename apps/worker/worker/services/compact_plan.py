@@ -0,0 +1,168 @@
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+from worker.services.plan_payload import JSONPayload, dumps, loads
+
+# Upper bound on the shared string pool; once full, new strings are kept as they are
+MAX_POOLED_STRINGS = 65536
+
+_POOL: Dict[str, str] = {}
+
+def pooled(text: str) -> str:
+    """
+    The pooled copy of a string, so every plan naming "Olive oil" or "1 tbsp"
+    holds the same object. A bounded dict rather than sys.intern, which would
+    keep every model-generated string alive for the life of the process.
+    """
+    shared = _POOL.get(text)
+    if shared is not None:
+        return shared
+    if len(_POOL) < MAX_POOLED_STRINGS:
+        _POOL[text] = text
+    return text
+
+class CompactPlan:
+    """
+    A validated MealPlanResponse for long-lived in-memory use.
+
+    The plan is held column-wise in a dozen objects instead of a dict per
+    day, meal and ingredient: meals are positions in plan order, with
+    ``meal_counts`` saying how many belong to each day, and their kcal and
+    macros sit in typed arrays. Ingredients, steps and grocery items are flat
+    sequences cut up by the per-meal or per-category count arrays, and all
+    of a plan's step text is a single string cut up by ``step_lengths``.
+    Names, ingredients, quantities and categories come from a shared pool.
+    ``to_dict`` rebuilds exactly the MealPlanResponse JSON it was made from.
+    """
+
+    __slots__ = (
+        "days", "meal_counts", "names", "kcal", "protein_g", "carbs_g", "fat_g",
+        "ingredient_counts", "items", "qtys", "step_counts", "step_lengths", "steps_text",
+        "totals", "categories", "category_sizes", "grocery_items", "quantity_counts", "quantities",
+    )
+
+    def __init__(self):
+        self.days, self.meal_counts = array("B"), array("H")
+        self.names: Tuple[str, ...] = ()
+        self.kcal, self.protein_g, self.carbs_g, self.fat_g = array("l"), array("d"), array("d"), array("d")
+        self.ingredient_counts, self.step_counts, self.step_lengths = array("H"), array("H"), array("L")
+        self.items: Tuple[str, ...] = ()
+        self.qtys: Tuple[str, ...] = ()
+        self.steps_text = ""
+        self.totals: Tuple[int, float, float, float] = (0, 0.0, 0.0, 0.0)
+        self.categories: Tuple[str, ...] = ()
+        self.category_sizes, self.quantity_counts = array("H"), array("H")
+        self.grocery_items: Tuple[str, ...] = ()
+        # (item, amount) pairs flattened: item, amount, item, amount, ...
+        self.quantities: Tuple[str, ...] = ()
+
+    @classmethod
+    def from_dict(cls, plan: Dict[str, Any]) -> "CompactPlan":
+        """Build from a plan in the MealPlanResponse JSON shape (as validated and dumped)."""
+        compact = cls()
+        names: List[str] = []
+        items: List[str] = []
+        qtys: List[str] = []
+        steps: List[str] = []
+        for day in plan["plan"]:
+            compact.days.append(day["day"])
+            compact.meal_counts.append(len(day["meals"]))
+            for meal in day["meals"]:
+                names.append(pooled(meal["name"]))
+                compact.kcal.append(meal["kcal"])
+                compact.protein_g.append(meal["protein_g"])
+                compact.carbs_g.append(meal["carbs_g"])
+                compact.fat_g.append(meal["fat_g"])
+                compact.ingredient_counts.append(len(meal["ingredients"]))
+                for ingredient in meal["ingredients"]:
+                    items.append(pooled(ingredient["item"]))
+                    qtys.append(pooled(ingredient["qty"]))
+                compact.step_counts.append(len(meal["steps"]))
+                compact.step_lengths.extend(len(step) for step in meal["steps"])
+                steps.extend(meal["steps"])
+        compact.names, compact.items, compact.qtys = tuple(names), tuple(items), tuple(qtys)
+        compact.steps_text = "".join(steps)
+
+        totals = plan["totals"]
+        compact.totals = (totals["kcal"], totals["protein_g"], totals["carbs_g"], totals["fat_g"])
+
+        categories: List[str] = []
+        grocery_items: List[str] = []
+        quantities: List[str] = []
+        for category in plan["groceries"]:
+            categories.append(pooled(category["category"]))
+            compact.category_sizes.append(len(category["items"]))
+            grocery_items.extend(pooled(item) for item in category["items"])
+            amounts = category.get("quantities", {})
+            compact.quantity_counts.append(len(amounts))
+            for item, amount in amounts.items():
+                quantities += (pooled(item), pooled(amount))
+        compact.categories, compact.grocery_items, compact.quantities = (
+            tuple(categories), tuple(grocery_items), tuple(quantities),
+        )
+        return compact
+
+    @classmethod
+    def from_json(cls, body: Any) -> "CompactPlan":
+        return cls.from_dict(loads(body))
+
+    @classmethod
+    def from_payload(cls, payload: JSONPayload) -> Optional["CompactPlan"]:
+        """
+        The compact form of a payload, or None when it does not rebuild the
+        exact same JSON (another plan schema, such as main.py's, or extra keys).
+        """
+        try:
+            compact = cls.from_json(payload.body)
+        except (KeyError, TypeError, ValueError, OverflowError, AttributeError):
+            return None
+        return compact if dumps(compact.to_dict()) == payload.body else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """A new plan dict in the MealPlanResponse JSON shape."""
+        items, qtys, text, lengths = self.items, self.qtys, self.steps_text, self.step_lengths
+        meal = ingredient = step = offset = 0
+        plan = []
+        for day, count in zip(self.days, self.meal_counts):
+            meals = []
+            for _ in range(count):
+                ingredients_end = ingredient + self.ingredient_counts[meal]
+                steps = []
+                for _ in range(self.step_counts[meal]):
+                    steps.append(text[offset:offset + lengths[step]])
+                    offset += lengths[step]
+                    step += 1
+                meals.append({
+                    "name": self.names[meal],
+                    "kcal": self.kcal[meal],
+                    "protein_g": self.protein_g[meal],
+                    "carbs_g": self.carbs_g[meal],
+                    "fat_g": self.fat_g[meal],
+                    "ingredients": [{"item": items[i], "qty": qtys[i]} for i in range(ingredient, ingredients_end)],
+                    "steps": steps,
+                })
+                ingredient = ingredients_end
+                meal += 1
+            plan.append({"day": day, "meals": meals})
+
+        groceries = []
+        item = quantity = 0
+        for category, size, amounts in zip(self.categories, self.category_sizes, self.quantity_counts):
+            pairs = self.quantities[quantity:quantity + 2 * amounts]
+            groceries.append({
+                "category": category,
+                "items": list(self.grocery_items[item:item + size]),
+                "quantities": dict(zip(pairs[::2], pairs[1::2])),
+            })
+            item += size
+            quantity += 2 * amounts
+
+        totals = self.totals
+        return {
+            "plan": plan,
+            "totals": {"kcal": totals[0], "protein_g": totals[1], "carbs_g": totals[2], "fat_g": totals[3]},
+            "groceries": groceries,
+        }
+
+    def to_payload(self) -> JSONPayload:
+        data = self.to_dict()
+        return JSONPayload(dumps(data), data)
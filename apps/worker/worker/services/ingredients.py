@@ -0,0 +1,178 @@
+import json
+import os
+import re
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+from worker.services.quantities import add_quantity, format_quantities, parse_quantity
+
+INGREDIENTS_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "ingredients.json")
+
+OTHER_CATEGORY = "Other"
+
+# Preparation words that do not change what is bought ("2 fresh chopped tomatoes")
+_QUALIFIERS = {
+    "fresh", "freshly", "chopped", "diced", "grated", "shredded",
+    "peeled", "trimmed", "rinsed", "drained", "cubed", "halved", "quartered", "julienned",
+    "large", "small", "medium", "organic", "boneless", "skinless", "raw", "cooked", "uncooked",
+    "finely", "roughly", "thinly", "optional", "of", "a", "to", "taste", "for", "serving", "garnish",
+}
+_PARENTHESES = re.compile(r"\([^)]*\)")
+_WORDS = re.compile(r"[a-z0-9%]+")
+
+class IngredientMatch(NamedTuple):
+    canonical: str  # grocery-list name, e.g. "Bell pepper" for "red bell peppers"
+    category: str  # one of the taxonomy's categories, "Other" if unknown
+
+def _singular(word: str) -> str:
+    if len(word) <= 3 or word.endswith(("ss", "us")):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith("oes"):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+def normalize_ingredient(name: str) -> str:
+    """
+    Index key for an ingredient: lower-cased, without parentheses, anything
+    after a comma, numbers and preparation words, each word singular.
+    "Red bell peppers (sliced)" and "red bell pepper" share one key.
+    """
+    text = _PARENTHESES.sub(" ", str(name).lower()).split(",")[0]
+    words = [w for w in _WORDS.findall(text.replace("-", " ")) if w not in _QUALIFIERS and not w[0].isdigit()]
+    return " ".join(_singular(w) for w in words)
+
+class IngredientIndex:
+    """
+    Canonical ingredient taxonomy with a hash index over normalized names
+    and aliases. Unknown names fall back to their longest indexed run of
+    words, preferring the rightmost (the head noun: "grilled chicken
+    strips" -> "chicken"), so "bell pepper" and "black pepper" never depend
+    on check order. Lookups are LRU-cached.
+    """
+
+    def __init__(self, entries: Iterable[Dict[str, Any]], categories: Iterable[str], cache_size: int = 4096):
+        self.categories = list(categories)
+        if OTHER_CATEGORY not in self.categories:
+            self.categories.append(OTHER_CATEGORY)
+        self._index: Dict[str, IngredientMatch] = {}
+        self._densities: Dict[str, float] = {}
+        self._names: Dict[str, List[str]] = {}
+        for entry in entries:
+            match = IngredientMatch(entry["name"], entry["category"])
+            if entry.get("density"):
+                self._densities[entry["name"]] = float(entry["density"])
+            self._names[entry["name"]] = [entry["name"], *entry.get("aliases", [])]
+            for name in self._names[entry["name"]]:
+                self._index.setdefault(normalize_ingredient(name), match)
+        self._max_words = max((len(key.split()) for key in self._index), default=0)
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def _lookup(self, name: str) -> Optional[IngredientMatch]:
+        key = normalize_ingredient(name)
+        match = self._index.get(key)
+        if match or not key:
+            return match
+        words = key.split()
+        for size in range(min(len(words) - 1, self._max_words), 0, -1):
+            for start in range(len(words) - size, -1, -1):
+                match = self._index.get(" ".join(words[start:start + size]))
+                if match:
+                    return match
+        return None
+
+    def categorize(self, name: str) -> IngredientMatch:
+        """Canonical name and category of an ingredient; unknown ones keep their (capitalized) name under "Other"."""
+        name = str(name).strip()
+        return self.lookup(name) or IngredientMatch(name[:1].upper() + name[1:], OTHER_CATEGORY)
+
+    def synonyms(self, name: str) -> List[str]:
+        """
+        The canonical name and aliases of the entry ``name`` is exactly one of
+        ("aubergine" for "eggplant"); empty when it is not a taxonomy name.
+        """
+        match = self._index.get(normalize_ingredient(name))
+        return list(self._names[match.canonical]) if match else []
+
+    def kinds(self, name: str) -> List[str]:
+        """
+        Names of entries in the same category whose name ends in a compound
+        of ``name`` ("strawberries" and "blueberry" for "berries"). Heads of
+        three letters or fewer are too short to tell compounds apart
+        ("coconut" is not a nut).
+        """
+        key = normalize_ingredient(name)
+        match = self._index.get(key)
+        if not match or len(key.split()[-1]) <= 3:
+            return []
+        head = key.split()[-1]
+        canonicals = {
+            other.canonical for other_key, other in self._index.items()
+            if other.category == match.category and other.canonical != match.canonical
+            and other_key.split()[-1].endswith(head) and other_key.split()[-1] != head
+        }
+        return [name for canonical in sorted(canonicals) for name in self._names[canonical]]
+
+    def density(self, canonical: str) -> Optional[float]:
+        """Grams per millilitre of a canonical ingredient, if the taxonomy has it."""
+        return self._densities.get(canonical)
+
+    def aggregate(self, plan: Any) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """
+        Total quantity of every canonical ingredient across all days and
+        meals, in one pass: category -> canonical name -> unit -> amount.
+        Volumes of ingredients with a known density are added as grams;
+        amounts that do not parse ("to taste") add nothing, but the
+        ingredient is still listed.
+        """
+        totals: Dict[str, Dict[str, Dict[str, float]]] = {}
+        for day in plan if isinstance(plan, list) else []:
+            if not isinstance(day, dict):
+                continue
+            for meal in day.get("meals") or []:
+                if not isinstance(meal, dict):
+                    continue
+                for ingredient in meal.get("ingredients") or []:
+                    name = ingredient.get("item", "") if isinstance(ingredient, dict) else ingredient
+                    if not isinstance(name, str) or not name.strip():
+                        continue
+                    match = self.categorize(name)
+                    amounts = totals.setdefault(match.category, {}).setdefault(match.canonical, {})
+                    quantity = parse_quantity(ingredient.get("qty", "")) if isinstance(ingredient, dict) else None
+                    if quantity:
+                        add_quantity(amounts, quantity, self._densities.get(match.canonical))
+        return totals
+
+    def build_groceries(self, plan: Any) -> List[Dict[str, Any]]:
+        """
+        Grocery list for a plan's days: every ingredient under its canonical
+        name, de-duplicated, grouped in taxonomy category order, with the
+        week's total amount of each in ``quantities``.
+        """
+        totals = self.aggregate(plan)
+        groceries = []
+        for category in self.categories:
+            if not totals.get(category):
+                continue
+            items = sorted(totals[category], key=str.lower)
+            quantities = {item: format_quantities(totals[category][item]) for item in items if totals[category][item]}
+            groceries.append({"category": category, "items": items, "quantities": quantities})
+        return groceries
+
+@lru_cache(maxsize=1)
+def load_ingredient_index(path: str = INGREDIENTS_PATH) -> IngredientIndex:
+    """The bundled taxonomy, loaded once per process."""
+    with open(path, encoding="utf-8") as f:
+        table = json.load(f)
+    return IngredientIndex(table["ingredients"], table["categories"])
+
+def categorize_ingredient(name: str) -> IngredientMatch:
+    return load_ingredient_index().categorize(name)
+
+def build_groceries(plan: Any) -> List[Dict[str, Any]]:
+    return load_ingredient_index().build_groceries(plan)
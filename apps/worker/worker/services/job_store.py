@@ -0,0 +1,356 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+from contextlib import aclosing
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Set
+from worker.services.structured_logging import request_id_var
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOBS_PATH = os.path.join(tempfile.gettempdir(), "wellplate-jobs.sqlite3")
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+FINISHED_STATUSES = {SUCCEEDED, FAILED}
+
+# Receives the submitted request and a progress callback; returns the result
+JobHandler = Callable[[Dict[str, Any], Callable[[Dict[str, Any]], Awaitable[None]]], Awaitable[Dict[str, Any]]]
+
+class JobQueueFull(RuntimeError):
+    """Raised when this process already has the maximum number of queued jobs."""
+
+def new_owner_token() -> str:
+    """
+    Identity of one JobRunner for the life of its process. PIDs are reused
+    (in containers a restarted worker often gets the same small PID back),
+    so job ownership never relies on them; the pid prefix is only for humans.
+    """
+    return f"{os.getpid()}-{uuid.uuid4().hex}"
+
+class JobStore:
+    """
+    SQLite-backed job records shared by every worker process on the host.
+
+    Each job row holds the request, status, progress and (once finished) the
+    result or error as JSON text, plus the token of the JobRunner that owns
+    it and a heartbeat the owner renews while it is alive. Unfinished jobs
+    whose heartbeat is older than the lease were left behind by a dead
+    process and can be claimed by another.
+    """
+
+    def __init__(self, path: str = DEFAULT_JOBS_PATH, ttl_seconds: float = 7 * 24 * 3600):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self) -> None:
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, status TEXT NOT NULL, request TEXT NOT NULL,"
+                " progress TEXT, result TEXT, error TEXT, owner TEXT,"
+                " created_at REAL NOT NULL, updated_at REAL NOT NULL,"
+                " started_at REAL, finished_at REAL, heartbeat_at REAL)"
+            )
+            # Files created before the heartbeat lease; their pid owners are never renewed
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "heartbeat_at" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)")
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "id": row["id"],
+            "status": row["status"],
+            "progress": json.loads(row["progress"]) if row["progress"] else None,
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+        }
+
+    def _create(self, request: Dict[str, Any], owner: str) -> Dict[str, Any]:
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, request, owner, created_at, updated_at, heartbeat_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(request, separators=(",", ":")), owner, now, now, now),
+            )
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (SUCCEEDED, FAILED, now - self.ttl_seconds),
+            )
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row)
+
+    def _get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def _request(self, job_id: str) -> Dict[str, Any]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT request FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row["request"])
+
+    def _update(self, job_id: str, **fields: Any) -> None:
+        fields["updated_at"] = time.time()
+        for name in ("progress", "result"):
+            if fields.get(name) is not None:
+                fields[name] = json.dumps(fields[name], separators=(",", ":"))
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _heartbeat(self, owner: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status IN (?, ?)",
+                (time.time(), owner, QUEUED, RUNNING),
+            )
+
+    def _claim_orphans(self, owner: str, lease_seconds: float, limit: int) -> List[str]:
+        """Take over unfinished jobs whose owner stopped renewing its lease, and requeue them."""
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, owner, heartbeat_at FROM jobs WHERE status IN (?, ?)"
+                " AND owner IS NOT ? AND (heartbeat_at IS NULL OR heartbeat_at < ?)"
+                " ORDER BY created_at LIMIT ?",
+                (QUEUED, RUNNING, owner, now - lease_seconds, limit),
+            ).fetchall()
+            claimed = []
+            for row in rows:
+                # Conditional on the row still being the same expired lease, so only one process wins it
+                cursor = conn.execute(
+                    "UPDATE jobs SET owner = ?, status = ?, updated_at = ?, heartbeat_at = ?"
+                    " WHERE id = ? AND owner IS ? AND heartbeat_at IS ?",
+                    (owner, QUEUED, now, now, row["id"], row["owner"], row["heartbeat_at"]),
+                )
+                if cursor.rowcount:
+                    claimed.append(row["id"])
+        return claimed
+
+    async def create(self, request: Dict[str, Any], owner: str) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._create, request, owner)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._get, job_id)
+
+    async def request(self, job_id: str) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._request, job_id)
+
+    async def update(self, job_id: str, **fields: Any) -> None:
+        await asyncio.to_thread(self._update, job_id, **fields)
+
+    async def heartbeat(self, owner: str) -> None:
+        await asyncio.to_thread(self._heartbeat, owner)
+
+    async def claim_orphans(self, owner: str, lease_seconds: float, limit: int) -> List[str]:
+        return await asyncio.to_thread(self._claim_orphans, owner, lease_seconds, limit)
+
+class JobRunner:
+    """
+    Runs submitted jobs on a fixed pool of background tasks in this process.
+
+    Jobs are recorded in the JobStore before being queued, so results outlive
+    the request that created them and the process that ran them. The runner
+    renews the heartbeat of its unfinished jobs every third of
+    ``lease_seconds``; every ``recover_interval`` it claims jobs whose lease ran
+    out, i.e. those orphaned by processes that died mid-run.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        handler: JobHandler,
+        workers: int = 2,
+        max_queued: int = 100,
+        recover_interval: float = 30.0,
+        poll_interval: float = 0.5,
+        lease_seconds: float = 60.0,
+    ):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.max_queued = max_queued
+        self.recover_interval = recover_interval
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.owner = new_owner_token()
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        # One event per active watcher, set when this process updates the job
+        self._signals: Dict[str, Set[asyncio.Event]] = {}
+        self._stats = {"submitted": 0, "succeeded": 0, "failed": 0, "recovered": 0}
+
+    async def start(self) -> None:
+        await self._recover()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._renew_leases()))
+        self._tasks.append(asyncio.create_task(self._recover_periodically()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Record a job and queue it; returns the job as stored."""
+        if self._queue.qsize() >= self.max_queued:
+            raise JobQueueFull(f"{self._queue.qsize()} jobs already queued")
+        job = await self.store.create(request, self.owner)
+        self._stats["submitted"] += 1
+        self._queue.put_nowait(job["id"])
+        return job
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """Return the job once it has finished, or as it is when ``timeout`` runs out."""
+        job = None
+        async for job in self.watch(job_id, timeout):
+            pass
+        return job
+
+    async def watch(self, job_id: str, timeout: float) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Yield the job whenever its status or progress changes, until it
+        finishes or ``timeout`` runs out. Jobs run by this process wake the
+        watcher immediately; others are polled from the store.
+        """
+        deadline = time.monotonic() + timeout
+        last_update = None
+        signal = asyncio.Event()
+        self._signals.setdefault(job_id, set()).add(signal)
+        try:
+            while True:
+                # Cleared before reading, so an update landing after the read still wakes the wait
+                signal.clear()
+                job = await self.store.get(job_id)
+                if job is None:
+                    return
+                if job["updated_at"] != last_update:
+                    last_update = job["updated_at"]
+                    yield job
+                remaining = deadline - time.monotonic()
+                if job["status"] in FINISHED_STATUSES or remaining <= 0:
+                    return
+                try:
+                    await asyncio.wait_for(signal.wait(), timeout=min(self.poll_interval, remaining))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # Also runs when the client disconnects and the generator is closed
+            watchers = self._signals.get(job_id)
+            if watchers is not None:
+                watchers.discard(signal)
+                if not watchers:
+                    del self._signals[job_id]
+
+    def _notify(self, job_id: str) -> None:
+        for signal in self._signals.get(job_id, ()):
+            signal.set()
+
+    async def _renew_leases(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await self.store.heartbeat(self.owner)
+            except sqlite3.Error as e:
+                logger.warning(f"Job lease renewal failed: {e}")
+
+    async def _recover(self) -> None:
+        claimed = await self.store.claim_orphans(self.owner, self.lease_seconds, limit=max(self.max_queued - self._queue.qsize(), 0))
+        for job_id in claimed:
+            self._queue.put_nowait(job_id)
+        if claimed:
+            self._stats["recovered"] += len(claimed)
+            logger.info(f"Recovered {len(claimed)} unfinished jobs")
+
+    async def _recover_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.recover_interval)
+            try:
+                await self._recover()
+            except sqlite3.Error as e:
+                logger.warning(f"Job recovery failed: {e}")
+
+    async def _work(self) -> None:
+        while True:
+            # A plain get: wait_for can swallow the cancellation from stop() when a job arrives at the same moment
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except sqlite3.Error as e:
+                logger.error(f"Job store error while running job {job_id}: {e}")
+
+    async def _run(self, job_id: str) -> None:
+        # Log lines of the job carry its ID, as request logs carry the request ID
+        token = request_id_var.set(job_id)
+        try:
+            await self._run_job(job_id)
+        finally:
+            request_id_var.reset(token)
+
+    async def _run_job(self, job_id: str) -> None:
+        request = await self.store.request(job_id)
+        await self.store.update(job_id, status=RUNNING, started_at=time.time(), progress={"stage": "started"})
+        self._notify(job_id)
+
+        async def report(progress: Dict[str, Any]) -> None:
+            await self.store.update(job_id, progress=progress)
+            self._notify(job_id)
+
+        try:
+            result = await self.handler(request, report)
+        except Exception as e:
+            logger.warning(f"Job {job_id} failed: {str(e)}")
+            await self.store.update(job_id, status=FAILED, error=str(e), finished_at=time.time(), progress={"stage": "failed"})
+            self._stats["failed"] += 1
+        else:
+            await self.store.update(job_id, status=SUCCEEDED, result=result, finished_at=time.time(), progress={"stage": "done"})
+            self._stats["succeeded"] += 1
+        self._notify(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "queued": self._queue.qsize(), "workers": self.workers if self._tasks else 0}
+
+def job_summary(job: Dict[str, Any]) -> Dict[str, Any]:
+    """The job without its (potentially large) result."""
+    return {key: value for key, value in job.items() if key != "result"}
+
+async def job_event_stream(
+    runner: JobRunner, job_id: str, max_seconds: float, heartbeat_seconds: float
+) -> AsyncGenerator[str, None]:
+    """
+    Server-sent events for one job: a "job" event on every status or progress
+    change, ending with the finished job (including its result). A comment
+    line is sent every ``heartbeat_seconds`` so proxies keep the connection open.
+    """
+    deadline = time.monotonic() + max_seconds
+    last_update = None
+    while time.monotonic() < deadline:
+        # Closed with this stream, so a disconnected client leaves no watcher behind
+        async with aclosing(runner.watch(job_id, heartbeat_seconds)) as watch:
+            async for job in watch:
+                if job["updated_at"] == last_update:
+                    continue
+                last_update = job["updated_at"]
+                yield f"event: job\ndata: {json.dumps(job)}\n\n"
+                if job["status"] in FINISHED_STATUSES:
+                    return
+        yield ": keep-alive\n\n"
@@ -0,0 +1,387 @@
+import logging
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"[ \t\r\n]*")
+_STRING_RUN = re.compile(r'[^"\\]+')
+_NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?")
+_NUMBER_CHARS = re.compile(r"[-+0-9.eE]*")
+_WORD = re.compile(r"[A-Za-z_]+")
+# A quoted key and its colon, or what could still become one as more text arrives
+_MEMBER_KEY = re.compile(r'"(?:[^"\\\n]|\\.)*"[ \t\r\n]*:')
+_PARTIAL_MEMBER_KEY = re.compile(r'"(?:[^"\\\n]|\\.)*\\?(?:"[ \t\r\n]*)?')
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_LITERALS = {"true": True, "false": False, "null": None}
+_PYTHON_LITERALS = {"True": True, "False": False, "None": None}
+
+# Patterns for watch paths: ``int`` matches any array index
+MEAL_PATH = ("plan", int, "meals", int)
+
+def _match_end(pattern: "re.Pattern[str]", text: str, pos: int) -> int:
+    """Where ``pattern`` stops matching at ``pos``; ``pos`` itself when it does not match."""
+    match = pattern.match(text, pos)
+    return match.end() if match else pos
+
+class JSONRepairError(ValueError):
+    """Raised when no JSON object or array can be recovered from the text."""
+
+class IncrementalJSONParser:
+    """
+    Resumable single-pass JSON parser for model output.
+
+    Text is fed chunk by chunk (e.g. streamed tokens); each character is
+    examined once and values are built as they are read. Common model glitches
+    are repaired in the same pass and recorded in ``repairs``:
+
+    - ``stripped_preamble``: code fences or prose before the first ``{``/``[``
+    - ``trailing_text``: closing fences or prose after the root value
+    - ``trailing_comma``: ``,`` directly before ``}`` or ``]``
+    - ``missing_comma``: two values or members with no separator; after a
+      string on the same line, only a quoted key followed by ``:`` counts as
+      the next member (``{"a": "x" "b": 2}``), anything else is an inner quote
+    - ``missing_colon``: a key followed directly by its value
+    - ``inner_quote``: unescaped ``"`` inside a string (``tomorrow"s`` becomes ``tomorrow's``)
+    - ``python_literal``: ``True``/``False``/``None``
+    - ``skipped_garbage``: characters that cannot start a token
+    - ``truncated``: the text ended inside a string or open containers, which are closed
+
+    Containers whose path matches ``watch`` (e.g. ``MEAL_PATH``) are returned
+    from ``feed`` as soon as they close, which lets callers forward meals
+    while the rest of the document is still being generated.
+    """
+
+    def __init__(self, watch: Optional[Tuple] = None):
+        self.repairs: List[str] = []
+        self._watch = watch
+        self._chunks: List[str] = []
+        self._buf = ""
+        self._pos = 0
+        self._mode = "preamble"
+        self._stack: List[list] = []  # [container, pending_key, path]
+        self._root: Any = None
+        self._has_root = False
+        self._after_comma = False
+        self._str_parts: List[str] = []
+        self._str_is_key = False
+        self._completed: List[Tuple[tuple, Any]] = []
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far."""
+        return "".join(self._chunks)
+
+    def feed(self, chunk: str) -> List[Tuple[tuple, Any]]:
+        """Consume a chunk and return ``(path, value)`` for each watched container it completed."""
+        self._chunks.append(chunk)
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        self._run(final=False)
+        completed, self._completed = self._completed, []
+        return completed
+
+    def close(self) -> Any:
+        """Finish parsing, closing anything left open, and return the root value."""
+        self._run(final=True)
+
+        if self._mode in ("string", "string_quote"):
+            self._repair("truncated")
+            if self._str_is_key:
+                self._mode = "colon"
+            else:
+                self._finish_string()
+        if self._stack and self._mode in ("colon", "value"):
+            frame = self._stack[-1]
+            if isinstance(frame[0], dict) and frame[1] is not None:
+                self._repair("truncated")
+                frame[1] = None
+        while self._stack:
+            self._repair("truncated")
+            self._close_container(emit=False)
+
+        if not self._has_root:
+            raise JSONRepairError("No JSON object found in model output")
+        return self._root
+
+    # ---------------- internals ----------------
+    def _repair(self, kind: str) -> None:
+        if kind not in self.repairs:
+            self.repairs.append(kind)
+
+    def _matches_watch(self, path: tuple) -> bool:
+        watch = self._watch
+        if watch is None or len(path) != len(watch):
+            return False
+        for component, pattern in zip(path, watch):
+            if pattern is int:
+                if not isinstance(component, int):
+                    return False
+            elif component != pattern:
+                return False
+        return True
+
+    def _open_container(self, container: Any) -> None:
+        if self._stack:
+            parent, pending_key, parent_path = self._stack[-1]
+            if isinstance(parent, dict):
+                path = parent_path + (pending_key,)
+                parent[pending_key] = container
+                self._stack[-1][1] = None
+            else:
+                path = parent_path + (len(parent),)
+                parent.append(container)
+        else:
+            path = ()
+            self._root = container
+            self._has_root = True
+        self._stack.append([container, None, path])
+        self._mode = "key" if isinstance(container, dict) else "value"
+        self._after_comma = False
+
+    def _close_container(self, emit: bool = True) -> None:
+        container, _, path = self._stack.pop()
+        if emit and self._matches_watch(path):
+            self._completed.append((path, container))
+        self._mode = "after_value" if self._stack else "done"
+        self._after_comma = False
+
+    def _add_value(self, value: Any) -> None:
+        if not self._stack:
+            # Scalars are never accepted as the root; the preamble skips them
+            return
+        frame = self._stack[-1]
+        if isinstance(frame[0], dict):
+            if frame[1] is not None:
+                frame[0][frame[1]] = value
+                frame[1] = None
+        else:
+            frame[0].append(value)
+        self._mode = "after_value"
+        self._after_comma = False
+
+    def _finish_string(self) -> None:
+        value = "".join(self._str_parts)
+        self._str_parts = []
+        if any("\ud800" <= ch <= "\udfff" for ch in value):
+            value = value.encode("utf-16", "surrogatepass").decode("utf-16", "replace")
+        if self._str_is_key:
+            self._stack[-1][1] = value
+            self._mode = "colon"
+        else:
+            self._add_value(value)
+
+    def _run(self, final: bool) -> None:
+        buf = self._buf
+        n = len(buf)
+        pos = self._pos
+
+        while True:
+            mode = self._mode
+
+            if mode == "string":
+                match = _STRING_RUN.match(buf, pos)
+                if match:
+                    self._str_parts.append(match.group())
+                    pos = match.end()
+                if pos >= n:
+                    break
+                if buf[pos] == '"':
+                    self._mode = "string_quote"
+                    pos += 1
+                    continue
+                # Backslash escape
+                if pos + 1 >= n:
+                    if final:
+                        pos = n
+                    break
+                escape = buf[pos + 1]
+                if escape == "u":
+                    if pos + 6 > n:
+                        if final:
+                            pos = n
+                        break
+                    try:
+                        self._str_parts.append(chr(int(buf[pos + 2:pos + 6], 16)))
+                        pos += 6
+                    except ValueError:
+                        self._str_parts.append("u")
+                        pos += 2
+                    continue
+                self._str_parts.append(_ESCAPES.get(escape, escape))
+                pos += 2
+                continue
+
+            if mode == "string_quote":
+                # A quote ends the string only if a structural character follows it
+                end = _match_end(_WHITESPACE, buf, pos)
+                if end >= n and not final:
+                    break
+                following = buf[end] if end < n else ""
+                if self._str_is_key:
+                    terminates = following in ("", ":")
+                else:
+                    terminates = following in ("", ",", "}", "]") or (
+                        following in '"{[' and "\n" in buf[pos:end]
+                    )
+                    if not terminates and following == '"' and isinstance(self._stack[-1][0], dict):
+                        if _MEMBER_KEY.match(buf, end):
+                            terminates = True
+                        elif not final and _match_end(_PARTIAL_MEMBER_KEY, buf, end) >= n:
+                            break
+                if terminates:
+                    self._finish_string()
+                    continue
+                self._repair("inner_quote")
+                previous = self._str_parts[-1][-1:] if self._str_parts else ""
+                nxt = buf[pos] if pos < n else ""
+                self._str_parts.append("'" if previous.isalnum() and nxt.isalnum() else '"')
+                self._mode = "string"
+                continue
+
+            pos = _match_end(_WHITESPACE, buf, pos)
+            if pos >= n:
+                break
+            ch = buf[pos]
+
+            if mode == "preamble":
+                if ch in "{[":
+                    self._open_container({} if ch == "{" else [])
+                    pos += 1
+                    continue
+                self._repair("stripped_preamble")
+                starts = [i for i in (buf.find("{", pos), buf.find("[", pos)) if i != -1]
+                pos = min(starts) if starts else n
+                continue
+
+            if mode == "done":
+                self._repair("trailing_text")
+                pos = n
+                break
+
+            if mode == "after_value":
+                container = self._stack[-1][0]
+                if ch == ",":
+                    self._mode = "key" if isinstance(container, dict) else "value"
+                    self._after_comma = True
+                    pos += 1
+                elif ch in "}]":
+                    self._close_container()
+                    pos += 1
+                elif ch in '"{[-0123456789tfnTFN':
+                    self._repair("missing_comma")
+                    self._mode = "key" if isinstance(container, dict) else "value"
+                else:
+                    self._repair("skipped_garbage")
+                    pos += 1
+                continue
+
+            if mode == "key":
+                if ch == '"':
+                    self._str_is_key = True
+                    self._mode = "string"
+                    self._after_comma = False
+                    pos += 1
+                elif ch in "}]":
+                    if self._after_comma:
+                        self._repair("trailing_comma")
+                    self._close_container()
+                    pos += 1
+                else:
+                    self._repair("skipped_garbage")
+                    pos += 1
+                continue
+
+            if mode == "colon":
+                if ch == ":":
+                    pos += 1
+                else:
+                    self._repair("missing_colon")
+                self._mode = "value"
+                continue
+
+            # mode == "value"
+            if ch in "{[":
+                self._open_container({} if ch == "{" else [])
+                pos += 1
+            elif ch == '"':
+                self._str_is_key = False
+                self._mode = "string"
+                pos += 1
+            elif ch == "-" or ch.isdigit():
+                # Wait for more input while the number could still continue
+                if _match_end(_NUMBER_CHARS, buf, pos) >= n and not final:
+                    break
+                match = _NUMBER.match(buf, pos)
+                if match is None:
+                    self._repair("skipped_garbage")
+                    pos += 1
+                    continue
+                token = match.group()
+                self._add_value(float(token) if any(c in token for c in ".eE") else int(token))
+                pos = match.end()
+            elif ch in "}]":
+                frame = self._stack[-1]
+                if self._after_comma:
+                    self._repair("trailing_comma")
+                elif isinstance(frame[0], dict):
+                    frame[1] = None
+                    self._repair("skipped_garbage")
+                self._close_container()
+                pos += 1
+            elif ch.isalpha() or ch == "_":
+                match = _WORD.match(buf, pos)
+                # Letters outside A-Z start no literal
+                if match is None:
+                    self._repair("skipped_garbage")
+                    pos += 1
+                    continue
+                if match.end() >= n and not final:
+                    break
+                word = match.group()
+                if word in _LITERALS:
+                    self._add_value(_LITERALS[word])
+                elif word in _PYTHON_LITERALS:
+                    self._repair("python_literal")
+                    self._add_value(_PYTHON_LITERALS[word])
+                else:
+                    self._repair("skipped_garbage")
+                pos = match.end()
+            else:
+                self._repair("skipped_garbage")
+                pos += 1
+
+        self._pos = pos
+
+def parse_json_with_repairs(text: str) -> Tuple[Any, List[str]]:
+    """Parse possibly malformed model output in one pass and return ``(value, repairs)``."""
+    parser = IncrementalJSONParser()
+    parser.feed(text)
+    value = parser.close()
+    return value, parser.repairs
+
+class MealStreamScanner:
+    """
+    Feeds streamed plan JSON into an IncrementalJSONParser and returns every
+    object at ``plan[i].meals[j]`` as soon as its closing brace arrives, so
+    meals can be sent to the client while the model is still writing.
+    """
+
+    def __init__(self):
+        self.parser = IncrementalJSONParser(watch=MEAL_PATH)
+
+    @property
+    def text(self) -> str:
+        return self.parser.text
+
+    @property
+    def repairs(self) -> List[str]:
+        return self.parser.repairs
+
+    def feed(self, chunk: str) -> List[Tuple[int, int, Dict[str, Any]]]:
+        """Consume a chunk and return ``(day_index, meal_index, meal)`` for each completed meal."""
+        return [(path[1], path[3], meal) for path, meal in self.parser.feed(chunk)]
+
+    def close(self) -> Any:
+        """Return the complete (repaired) document."""
+        return self.parser.close()
@@ -0,0 +1,215 @@
+import hashlib
+import json
+import logging
+import os
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+import numpy as np
+from worker.services.allergen_matcher import compile_matcher, load_allergen_table, tags_for_term
+from worker.services.nutrition import plan_totals
+from worker.services.plan_cache import normalize_preferences
+
+logger = logging.getLogger(__name__)
+
+RECIPES_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "recipes.json")
+
+KNOWN_DIETS = {"vegan", "vegetarian", "keto", "paleo", "mediterranean", "diabetes-friendly"}
+
+# Allergen tags used in the corpus, shared with the bundled allergen table
+ALLERGEN_TAGS = list(load_allergen_table()["tags"])
+
+# Share of the daily calories per slot, and which recipe kind fills it
+SLOT_LAYOUTS = {
+    1: [("dinner", "main", 1.0)],
+    2: [("breakfast", "breakfast", 0.4), ("dinner", "main", 0.6)],
+    3: [("breakfast", "breakfast", 0.27), ("lunch", "main", 0.35), ("dinner", "main", 0.38)],
+    4: [("breakfast", "breakfast", 0.25), ("lunch", "main", 0.3), ("dinner", "main", 0.33), ("snack", "snack", 0.12)],
+    5: [("breakfast", "breakfast", 0.23), ("lunch", "main", 0.28), ("dinner", "main", 0.31),
+        ("afternoon snack", "snack", 0.09), ("evening snack", "snack", 0.09)],
+    6: [("breakfast", "breakfast", 0.2), ("morning snack", "snack", 0.09), ("lunch", "main", 0.26),
+        ("afternoon snack", "snack", 0.09), ("dinner", "main", 0.27), ("evening snack", "snack", 0.09)],
+}
+
+# Scoring weights: calorie fit dominates; the rest break ties toward variety
+PORTION_STEPS = 4  # portions are scaled in quarters
+MIN_PORTION, MAX_PORTION = 0.75, 2.0
+# Per-meal limits of worker.schemas.Meal that scaled portions must respect
+MAX_MEAL_KCAL, MAX_MEAL_MACRO_G = 1000, 100
+PROTEIN_WEIGHT = 0.3
+EFFORT_BONUS = 0.05
+REPEAT_PENALTY = 0.35
+RECENT_PENALTY = 0.5
+JITTER = 0.08
+
+class LocalPlanError(ValueError):
+    """Raised when no recipe in the corpus fits the profile."""
+
+class RecipeCorpus:
+    """The bundled recipes, with macros and filter attributes as NumPy arrays."""
+
+    def __init__(self, recipes: List[Dict[str, Any]]):
+        self.recipes = recipes
+        self.kcal = np.array([r["kcal"] for r in recipes], dtype=float)
+        self.protein = np.array([r["protein_g"] for r in recipes], dtype=float)
+        self.carbs = np.array([r["carbs_g"] for r in recipes], dtype=float)
+        self.fat = np.array([r["fat_g"] for r in recipes], dtype=float)
+        self.kind = np.array([r["slot"] for r in recipes])
+        self.names = np.array([r["name"].lower() for r in recipes])
+        self.text = np.array([
+            " ".join([r["name"]] + [i["item"] for i in r["ingredients"]]).lower() for r in recipes
+        ])
+        self.diets = {diet: np.array([diet in r["diets"] for r in recipes]) for diet in KNOWN_DIETS}
+        self.efforts = {
+            effort: np.array([effort in r["effort"] for r in recipes]) for effort in ("quick", "budget", "gourmet")
+        }
+        self.allergens = np.array([[tag in r["allergens"] for tag in ALLERGEN_TAGS] for r in recipes])
+        largest = np.maximum(self.kcal / MAX_MEAL_KCAL, np.maximum.reduce([self.protein, self.carbs, self.fat]) / MAX_MEAL_MACRO_G)
+        self.max_portion = np.clip(np.floor(PORTION_STEPS / largest) / PORTION_STEPS, MIN_PORTION, MAX_PORTION)
+
+    def contains(self, term: str) -> np.ndarray:
+        """Recipes whose name or ingredients mention ``term``."""
+        return np.char.find(self.text, term) >= 0
+
+    def allergen_mask(self, term: str) -> np.ndarray:
+        """Recipes carrying an allergen tag that ``term`` refers to, or mentioning it (or a synonym) outright."""
+        tags = np.isin(ALLERGEN_TAGS, tags_for_term(term))
+        matcher = compile_matcher([term])
+        mentions = np.array([bool(matcher.find(text)) for text in self.text])
+        return self.allergens[:, tags].any(axis=1) | mentions
+
+@lru_cache(maxsize=1)
+def load_corpus(path: str = RECIPES_PATH) -> RecipeCorpus:
+    with open(path, encoding="utf-8") as f:
+        return RecipeCorpus(json.load(f)["recipes"])
+
+def estimate_calorie_target(profile: Dict[str, Any]) -> int:
+    """Harris-Benedict (sedentary), adjusted for the goal; mirrors OpenAIClient._calculate_calorie_target."""
+    if profile["sex"] == "male":
+        bmr = 88.362 + 13.397 * profile["weightKg"] + 4.799 * profile["heightCm"] - 5.677 * profile["age"]
+    else:
+        bmr = 447.593 + 9.247 * profile["weightKg"] + 3.098 * profile["heightCm"] - 4.330 * profile["age"]
+    tdee = bmr * 1.2
+    adjustment = {"lose": -500, "gain": 500}.get(profile["goal"], 0)
+    return max(1200, int(tdee + adjustment))
+
+def slot_layout(meals_per_day: int, include_shake: bool = False) -> List[Tuple[str, str, float]]:
+    """(slot name, recipe kind, calorie share) for each meal of the day."""
+    if meals_per_day in SLOT_LAYOUTS:
+        layout = list(SLOT_LAYOUTS[meals_per_day])
+    else:
+        extra = meals_per_day - 3
+        layout = [(name, kind, share * 0.8) for name, kind, share in SLOT_LAYOUTS[3]]
+        layout += [(f"snack {i + 1}", "snack", 0.2 / extra) for i in range(extra)]
+    if include_shake:
+        for index, (name, kind, share) in enumerate(layout):
+            if kind == "snack":
+                layout[index] = ("protein shake", "shake", share)
+                break
+    return layout
+
+def is_simple_profile(preferences: Any) -> bool:
+    """
+    True when the corpus can fully honour the profile: a known diet, no
+    free-text dislikes or recent-meal history, and only allergies that map
+    onto corpus allergen tags.
+    """
+    profile = normalize_preferences(preferences)
+    if profile["dietType"] not in KNOWN_DIETS | {"omnivore"}:
+        return False
+    if profile["dislikes"] or profile["recentMeals"]:
+        return False
+    return all(tags_for_term(allergy) for allergy in profile["allergies"])
+
+def _eligible(corpus: RecipeCorpus, profile: Dict[str, Any], honour_dislikes: bool = True) -> np.ndarray:
+    mask = corpus.diets.get(profile["dietType"], np.ones(len(corpus.recipes), dtype=bool)).copy()
+    for allergy in profile["allergies"]:
+        mask &= ~corpus.allergen_mask(allergy)
+    if honour_dislikes:
+        for dislike in profile["dislikes"]:
+            mask &= ~corpus.contains(dislike)
+    return mask
+
+def _scaled_meal(recipe: Dict[str, Any], portion: float) -> Dict[str, Any]:
+    steps = list(recipe["steps"])
+    if portion != 1.0:
+        steps.insert(0, f"Scale all ingredients by {portion:g}x for this portion")
+    return {
+        "name": recipe["name"],
+        "kcal": int(round(recipe["kcal"] * portion)),
+        "protein_g": round(recipe["protein_g"] * portion, 1),
+        "carbs_g": round(recipe["carbs_g"] * portion, 1),
+        "fat_g": round(recipe["fat_g"] * portion, 1),
+        "ingredients": [{"item": i["item"], "qty": i["qty"]} for i in recipe["ingredients"]],
+        "steps": steps,
+    }
+
+def local_meal_plan(preferences: Any, days: int = 7) -> Dict[str, Any]:
+    """
+    Build a plan from the bundled recipe corpus, with no network access.
+
+    Every slot scores all eligible recipes at once: distance from the slot's
+    calorie target after portion scaling, protein shortfall for the goal,
+    repeats within the plan and the user's recent meals, plus a small jitter
+    seeded from the profile, so the same profile always gets the same plan.
+    """
+    corpus = load_corpus()
+    profile = normalize_preferences(preferences)
+    calorie_target = profile["caloriesTarget"] or estimate_calorie_target(profile)
+    protein_share = 0.3 if profile["goal"] in ("lose", "gain") else 0.25
+    layout = slot_layout(profile["mealsPerDay"], profile["includeProteinShakes"])
+
+    eligible = _eligible(corpus, profile)
+    if not eligible.any():
+        logger.warning("No recipes match the profile's dislikes; ignoring dislikes")
+        eligible = _eligible(corpus, profile, honour_dislikes=False)
+    if not eligible.any():
+        raise LocalPlanError("No recipes in the local corpus fit this profile")
+
+    seed = int(hashlib.sha256(json.dumps(profile, sort_keys=True).encode("utf-8")).hexdigest()[:16], 16)
+    rng = np.random.default_rng(seed)
+    uses = np.zeros(len(corpus.recipes))
+    recent = np.isin(corpus.names, profile["recentMeals"])
+    effort = corpus.efforts.get(profile["cookingEffort"], np.zeros(len(corpus.recipes), dtype=bool))
+
+    plan = []
+    for day in range(1, days + 1):
+        meals = []
+        for _, kind, share in layout:
+            target = calorie_target * share
+            candidates = eligible & (corpus.kind == kind)
+            if not candidates.any():
+                candidates = eligible & (corpus.kind != "shake") if kind != "main" else eligible
+            if not candidates.any():
+                candidates = eligible
+
+            portion = np.clip(np.round(target / corpus.kcal * PORTION_STEPS) / PORTION_STEPS, MIN_PORTION, corpus.max_portion)
+            protein_target = target * protein_share / 4
+            score = (
+                np.abs(corpus.kcal * portion - target) / target
+                + PROTEIN_WEIGHT * np.clip((protein_target - corpus.protein * portion) / protein_target, 0, 1)
+                - EFFORT_BONUS * effort
+                + REPEAT_PENALTY * uses
+                + RECENT_PENALTY * recent
+                + rng.uniform(0, JITTER, len(corpus.recipes))
+            )
+            score[~candidates] = np.inf
+
+            choice = int(np.argmin(score))
+            uses[choice] += 1
+            meals.append(_scaled_meal(corpus.recipes[choice], float(portion[choice])))
+        plan.append({"day": day, "meals": meals})
+
+    return {
+        "plan": plan,
+        "totals": plan_totals(plan),
+        "groceries": _groceries(corpus, plan),
+    }
+
+def _groceries(corpus: RecipeCorpus, plan: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    by_name = {recipe["name"]: recipe for recipe in corpus.recipes}
+    categories: Dict[str, set] = {}
+    for day in plan:
+        for meal in day["meals"]:
+            for ingredient in by_name[meal["name"]]["ingredients"]:
+                categories.setdefault(ingredient["category"], set()).add(ingredient["item"])
+    return [{"category": category, "items": sorted(items)} for category, items in sorted(categories.items())]
@@ -0,0 +1,250 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import time
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+from worker.services.allergen_matcher import allergen_tags, compile_matcher, tags_for_term
+from worker.services.ingredients import _singular, categorize_ingredient
+from worker.services.local_planner import ALLERGEN_TAGS, estimate_calorie_target, slot_layout
+from worker.services.plan_cache import normalize_preferences
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEAL_STORE_PATH = os.path.join(tempfile.gettempdir(), "wellplate-meals.sqlite3")
+
+# Meals are indexed by 100 kcal band; a stored meal fits a slot within ±KCAL_TOLERANCE of its target
+KCAL_BAND = 100
+KCAL_TOLERANCE = 0.15
+# A slot is filled with a random pick among this many closest-fitting meals
+CANDIDATES_PER_SLOT = 5
+
+# Meals stored for a diet that also suit another one
+COMPATIBLE_DIETS = {
+    "vegetarian": ["vegetarian", "vegan"],
+}
+
+class StoredMeal(NamedTuple):
+    meal: Dict[str, Any]
+    groceries: List[Dict[str, Any]]
+
+def meal_key(name: str) -> str:
+    """Name used to de-duplicate meals: lower-cased, without a "Breakfast:"-style slot prefix."""
+    name = str(name or "").strip().lower()
+    prefix, sep, rest = name.partition(":")
+    return (rest if sep and len(prefix.split()) <= 2 else name).strip()
+
+def allergen_bits(tags: Iterable[str]) -> int:
+    """Bit mask of allergen tags, as stored in the ``allergens`` column."""
+    return sum(1 << bit for bit, tag in enumerate(ALLERGEN_TAGS) if tag in tags)
+
+def _fts_query(terms: List[str]) -> Optional[str]:
+    """
+    FTS5 query matching any of the terms as a prefix phrase, as written and
+    singular ("peanuts" also matches "peanut", "berries" also "berry").
+    """
+    phrases: List[str] = []
+    for term in terms:
+        tokens = re.findall(r"\w+", term.lower())
+        if not tokens:
+            continue
+        for last in dict.fromkeys((tokens[-1], _singular(tokens[-1]))):
+            phrase = '"' + " ".join(tokens[:-1] + [last]) + '"*'
+            if phrase not in phrases:
+                phrases.append(phrase)
+    return " OR ".join(phrases) or None
+
+def _meal_groceries(meal: Dict[str, Any], groceries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """The plan's grocery categories narrowed to this meal's ingredients; others are categorized by the taxonomy."""
+    categories: Dict[str, str] = {}
+    for group in groceries:
+        if not isinstance(group, dict):
+            continue
+        for item in group.get("items", []):
+            categories.setdefault(str(item).strip().lower(), str(group.get("category", "Other")))
+    by_category: Dict[str, List[str]] = {}
+    for ingredient in meal.get("ingredients", []):
+        item = str(ingredient.get("item", "")).strip() if isinstance(ingredient, dict) else str(ingredient).strip()
+        if not item:
+            continue
+        category = categories.get(item.lower()) or categorize_ingredient(item).category
+        by_category.setdefault(category, []).append(item)
+    return [{"category": category, "items": items} for category, items in by_category.items()]
+
+class MealStore:
+    """
+    SQLite store of every validated meal, indexed for reuse in later plans.
+
+    Meals are keyed by name, diet and slot kind (breakfast, main, snack), with
+    a composite index on (kind, diet, kcal band), an allergen tag bit mask and
+    an FTS5 table over names and ingredients for free-text allergies and
+    dislikes. An empty ``path`` disables the store.
+    """
+
+    def __init__(self, path: str = DEFAULT_MEAL_STORE_PATH, max_meals: int = 20000, enabled: bool = True):
+        self.path = path
+        self.max_meals = max_meals
+        self.enabled = enabled and bool(path)
+        self._stats = {"stored": 0, "lookups": 0, "slots_filled": 0, "slots_missed": 0}
+        if self.enabled:
+            self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self) -> None:
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS meals ("
+                " id INTEGER PRIMARY KEY, name_key TEXT NOT NULL, diet TEXT NOT NULL, kind TEXT NOT NULL,"
+                " kcal INTEGER NOT NULL, kcal_band INTEGER NOT NULL, allergens INTEGER NOT NULL,"
+                " payload TEXT NOT NULL, times_seen INTEGER NOT NULL DEFAULT 1,"
+                " created_at REAL NOT NULL, last_seen REAL NOT NULL,"
+                " UNIQUE (name_key, diet, kind))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_meals_lookup ON meals (kind, diet, kcal_band)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_meals_last_seen ON meals (last_seen)")
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS meals_fts USING fts5(name, ingredients)")
+
+    def _add_plan(self, plan: Dict[str, Any], preferences: Any) -> int:
+        profile = normalize_preferences(preferences)
+        kinds = [kind for _, kind, _ in slot_layout(profile["mealsPerDay"], profile["includeProteinShakes"])]
+        groceries = plan.get("groceries") or []
+        now = time.time()
+        added = 0
+        with self._connect() as conn:
+            for day in plan.get("plan", []):
+                meals = day.get("meals") or []
+                # Without the expected meal count the slot of each meal is unknown
+                if len(meals) != len(kinds):
+                    continue
+                for kind, meal in zip(kinds, meals):
+                    kcal = meal.get("kcal")
+                    if not meal.get("name") or not isinstance(kcal, (int, float)) or kcal <= 0:
+                        continue
+                    key = meal_key(meal["name"])
+                    cursor = conn.execute(
+                        "UPDATE meals SET times_seen = times_seen + 1, last_seen = ? WHERE name_key = ? AND diet = ? AND kind = ?",
+                        (now, key, profile["dietType"], kind),
+                    )
+                    if cursor.rowcount:
+                        continue
+                    ingredients = " ".join(
+                        str(i.get("item", "")) if isinstance(i, dict) else str(i) for i in meal.get("ingredients", [])
+                    )
+                    payload = {"meal": meal, "groceries": _meal_groceries(meal, groceries)}
+                    cursor = conn.execute(
+                        "INSERT INTO meals (name_key, diet, kind, kcal, kcal_band, allergens, payload, created_at, last_seen)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            key, profile["dietType"], kind, int(kcal), int(kcal) // KCAL_BAND,
+                            allergen_bits(allergen_tags(f"{meal['name']}\n{ingredients}")),
+                            json.dumps(payload, separators=(",", ":")), now, now,
+                        ),
+                    )
+                    conn.execute(
+                        "INSERT INTO meals_fts (rowid, name, ingredients) VALUES (?, ?, ?)",
+                        (cursor.lastrowid, meal["name"], ingredients),
+                    )
+                    added += 1
+            excess = conn.execute("SELECT COUNT(*) FROM meals").fetchone()[0] - self.max_meals
+            if excess > 0:
+                stale = [row[0] for row in conn.execute("SELECT id FROM meals ORDER BY last_seen LIMIT ?", (excess,))]
+                conn.executemany("DELETE FROM meals WHERE id = ?", [(i,) for i in stale])
+                conn.executemany("DELETE FROM meals_fts WHERE rowid = ?", [(i,) for i in stale])
+        return added
+
+    def _lookup(self, preferences: Any, days: int, max_fill: float) -> List[List[Optional[StoredMeal]]]:
+        profile = normalize_preferences(preferences)
+        layout = slot_layout(profile["mealsPerDay"], profile["includeProteinShakes"])
+        slots: List[List[Optional[StoredMeal]]] = [[None] * len(layout) for _ in range(days)]
+        budget = int(max_fill * days * len(layout))
+        if budget <= 0:
+            return slots
+
+        calorie_target = profile["caloriesTarget"] or estimate_calorie_target(profile)
+        diets = COMPATIBLE_DIETS.get(profile["dietType"], [profile["dietType"]])
+        allergens = allergen_bits({tag for allergy in profile["allergies"] for tag in tags_for_term(allergy)})
+        excluded = _fts_query(profile["allergies"] + profile["dislikes"])
+        # Final check on the few candidates, covering synonyms in the steps too
+        matcher = compile_matcher(profile["allergies"], profile["dislikes"])
+        used = {meal_key(name) for name in profile["recentMeals"]}
+
+        query = (
+            "SELECT name_key, payload FROM meals WHERE kind = ? AND kcal_band BETWEEN ? AND ?"
+            " AND kcal BETWEEN ? AND ? AND allergens & ? = 0"
+        )
+        if profile["dietType"] != "omnivore":
+            query += f" AND diet IN ({', '.join('?' for _ in diets)})"
+        if excluded:
+            query += " AND id NOT IN (SELECT rowid FROM meals_fts WHERE meals_fts MATCH ?)"
+        query += " ORDER BY ABS(kcal - ?) LIMIT ?"
+
+        filled = 0
+        with self._connect() as conn:
+            for day in slots:
+                for index, (_, kind, share) in enumerate(layout):
+                    if filled >= budget:
+                        break
+                    target = calorie_target * share
+                    low, high = int(target * (1 - KCAL_TOLERANCE)), int(target * (1 + KCAL_TOLERANCE))
+                    params: List[Any] = [kind, low // KCAL_BAND, high // KCAL_BAND, low, high, allergens]
+                    if profile["dietType"] != "omnivore":
+                        params += diets
+                    if excluded:
+                        params.append(excluded)
+                    params += [target, CANDIDATES_PER_SLOT + len(used)]
+                    candidates = [
+                        payload for payload in (
+                            json.loads(row["payload"]) for row in conn.execute(query, params) if row["name_key"] not in used
+                        )
+                        if not matcher.find_in_meal(payload["meal"])
+                    ]
+                    if not candidates:
+                        continue
+                    payload = random.choice(candidates[:CANDIDATES_PER_SLOT])
+                    used.add(meal_key(payload["meal"]["name"]))
+                    day[index] = StoredMeal(payload["meal"], payload["groceries"])
+                    filled += 1
+
+        self._stats["lookups"] += 1
+        self._stats["slots_filled"] += filled
+        self._stats["slots_missed"] += days * len(layout) - filled
+        return slots
+
+    async def add_plan(self, plan: Dict[str, Any], preferences: Any) -> int:
+        """Store the meals of a validated plan; returns how many were new. Errors are logged, not raised."""
+        if not self.enabled:
+            return 0
+        try:
+            added = await asyncio.to_thread(self._add_plan, plan, preferences)
+        except sqlite3.Error as e:
+            logger.warning(f"Meal store write failed: {e}")
+            return 0
+        self._stats["stored"] += added
+        return added
+
+    async def lookup(self, preferences: Any, days: int, max_fill: float = 1.0) -> List[List[Optional[StoredMeal]]]:
+        """
+        Stored meals for each slot of each day, or None where nothing fits:
+        same slot kind, compatible diet, within ±15% of the slot's calorie
+        target, no allergen or dislike match, not among the recent meals and
+        not repeated within the plan. At most ``max_fill`` of all slots are filled.
+        """
+        if not self.enabled:
+            return [[None] * normalize_preferences(preferences)["mealsPerDay"] for _ in range(days)]
+        try:
+            return await asyncio.to_thread(self._lookup, preferences, days, max_fill)
+        except sqlite3.Error as e:
+            logger.warning(f"Meal store lookup failed: {e}")
+            return [[None] * normalize_preferences(preferences)["mealsPerDay"] for _ in range(days)]
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "enabled": self.enabled}
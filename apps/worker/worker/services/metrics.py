@@ -0,0 +1,229 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METRICS_PATH = os.path.join(tempfile.gettempdir(), "wellplate-metrics.sqlite3")
+
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds in seconds; generations take from milliseconds (cache) to minutes (retries)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+GENERATION_SECONDS = "wellplate_generation_duration_seconds"
+UPSTREAM_SECONDS = "wellplate_upstream_request_duration_seconds"
+UPSTREAM_TOKENS = "wellplate_upstream_tokens_total"
+GENERATION_RETRIES = "wellplate_generation_retries_total"
+JSON_PARSES = "wellplate_json_parse_total"
+FALLBACK_RESPONSES = "wellplate_fallback_responses_total"
+TOTALS_CORRECTIONS = "wellplate_totals_corrections_total"
+OFF_TARGET_DAYS = "wellplate_off_target_days_total"
+
+# name -> (type, help); both apps report the same families
+METRIC_FAMILIES = {
+    GENERATION_SECONDS: ("histogram", "End-to-end time to serve a meal plan, by endpoint, source and outcome."),
+    UPSTREAM_SECONDS: ("histogram", "Time per upstream chat completion (to the first chunk when streaming), by model and call kind."),
+    UPSTREAM_TOKENS: ("counter", "Tokens reported by the upstream, by model and direction (input, cached_input, output)."),
+    GENERATION_RETRIES: ("counter", "Generation attempts retried, by cause."),
+    JSON_PARSES: ("counter", "Model responses parsed strictly, recovered by the repairing parser, or unparseable."),
+    FALLBACK_RESPONSES: ("counter", "Plans served from a fallback instead of the model, by kind (local, mock)."),
+    TOTALS_CORRECTIONS: ("counter", "Model-reported plan totals that disagreed with the meals and were recomputed, by field."),
+    OFF_TARGET_DAYS: ("counter", "Plan days whose meals miss the calorie target by more than the tolerance."),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def _labels(values: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(getattr(value, "value", value))) for key, value in values.items()))
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return str(int(value)) if value == int(value) else repr(value)
+
+def _family(series: str) -> str:
+    """The metric family a series belongs to (histograms expose _bucket, _sum and _count series)."""
+    for suffix in ("_bucket", "_sum", "_count"):
+        if series.endswith(suffix) and series[: -len(suffix)] in METRIC_FAMILIES:
+            return series[: -len(suffix)]
+    return series
+
+class Metrics:
+    """
+    Counters and histograms exposed in the Prometheus text format.
+
+    Recording only updates an in-process dict under a lock, so the hot path
+    never touches disk. ``flush`` adds the pending deltas to a SQLite file
+    shared by every worker process on the host (gunicorn -w N), and
+    ``render`` flushes and then reads the host-wide totals, so a scrape that
+    lands on any worker sees all of them. Without a path the totals stay in
+    this process.
+    """
+
+    def __init__(self, path: Optional[str] = DEFAULT_METRICS_PATH, enabled: bool = True):
+        self.path: str = path or ""
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple[str, Labels], float] = {}
+        self._totals: Dict[Tuple[str, Labels], float] = {}
+
+        if self.enabled and self.path:
+            try:
+                self._init_shared()
+            except sqlite3.Error as e:
+                logger.warning(f"Shared metrics disabled ({self.path}): {e}")
+                self.path = ""
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5.0)
+
+    def _init_shared(self) -> None:
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS metrics ("
+                " series TEXT NOT NULL, labels TEXT NOT NULL, value REAL NOT NULL,"
+                " PRIMARY KEY (series, labels))"
+            )
+
+    def _add(self, series: str, labels: Labels, value: float) -> None:
+        key = (series, labels)
+        self._pending[key] = self._pending.get(key, 0.0) + value
+
+    def inc(self, name: str, value: float = 1.0, **labels: Any) -> None:
+        """Add ``value`` to a counter."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._add(name, _labels(labels), value)
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = LATENCY_BUCKETS, **labels: Any) -> None:
+        """Record one histogram observation (cumulative buckets, sum and count)."""
+        if not self.enabled:
+            return
+        key = _labels(labels)
+        with self._lock:
+            for bound in buckets:
+                self._add(f"{name}_bucket", key + (("le", _format_value(bound)),), 1 if value <= bound else 0)
+            self._add(f"{name}_bucket", key + (("le", "+Inf"),), 1)
+            self._add(f"{name}_sum", key, value)
+            self._add(f"{name}_count", key, 1)
+
+    @contextmanager
+    def timer(self, name: str, **labels: Any) -> Iterator[Dict[str, Any]]:
+        """
+        Observe the duration of the block into histogram ``name`` with an
+        ``outcome`` of ok or error. Yields the labels so the block can refine
+        them once it knows more (e.g. that the plan came from the cache).
+        """
+        labels = dict(labels)
+        started = perf_counter()
+        try:
+            yield labels
+        except BaseException:
+            labels["outcome"] = "error"
+            raise
+        finally:
+            labels.setdefault("outcome", "ok")
+            self.observe(name, perf_counter() - started, **labels)
+
+    def record_usage(self, model: str, response: Any) -> None:
+        """Count the tokens in a completion's (or final stream chunk's) ``usage``, if present."""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        cached_tokens = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", 0) or 0
+        self.inc(UPSTREAM_TOKENS, prompt_tokens, model=model, direction="input")
+        self.inc(UPSTREAM_TOKENS, getattr(usage, "completion_tokens", 0) or 0, model=model, direction="output")
+        if cached_tokens:
+            self.inc(UPSTREAM_TOKENS, cached_tokens, model=model, direction="cached_input")
+
+    def _take_pending(self) -> Dict[Tuple[str, Labels], float]:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def _flush(self) -> None:
+        pending = self._take_pending()
+        if not pending:
+            return
+        if not self.path:
+            for key, value in pending.items():
+                self._totals[key] = self._totals.get(key, 0.0) + value
+            return
+        try:
+            with self._connect() as conn:
+                conn.executemany(
+                    "INSERT INTO metrics (series, labels, value) VALUES (?, ?, ?)"
+                    " ON CONFLICT (series, labels) DO UPDATE SET value = value + excluded.value",
+                    [(series, json.dumps(labels), value) for (series, labels), value in pending.items()],
+                )
+        except sqlite3.Error as e:
+            # Keep the deltas for the next flush rather than losing them
+            logger.warning(f"Metrics flush failed: {e}")
+            with self._lock:
+                for key, value in pending.items():
+                    self._pending[key] = self._pending.get(key, 0.0) + value
+
+    def _read(self) -> List[Tuple[str, Labels, float]]:
+        self._flush()
+        if not self.path:
+            return [(series, labels, value) for (series, labels), value in self._totals.items()]
+        with self._connect() as conn:
+            rows = conn.execute("SELECT series, labels, value FROM metrics").fetchall()
+        return [(series, tuple(tuple(pair) for pair in json.loads(labels)), value) for series, labels, value in rows]
+
+    async def flush(self) -> None:
+        """Write pending deltas to the shared file."""
+        await asyncio.to_thread(self._flush)
+
+    async def flush_periodically(self, interval: float) -> None:
+        """Flush every ``interval`` seconds until cancelled, then once more."""
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                await self.flush()
+        finally:
+            self._flush()
+
+    def _render(self) -> str:
+        def order(row: Tuple[str, Labels, float]):
+            series, labels, _ = row
+            le = dict(labels).get("le")
+            return series, [pair for pair in labels if pair[0] != "le"], float(le) if le else 0.0
+
+        families: Dict[str, List[Tuple[str, Labels, float]]] = {}
+        for row in sorted(self._read(), key=order):
+            families.setdefault(_family(row[0]), []).append(row)
+
+        lines = []
+        for family in sorted(families):
+            kind, help_text = METRIC_FAMILIES.get(family, ("untyped", family))
+            lines.append(f"# HELP {family} {help_text}")
+            lines.append(f"# TYPE {family} {kind}")
+            for series, labels, value in families[family]:
+                lines.append(f"{series}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    async def render(self) -> str:
+        """Host-wide totals in the Prometheus text format."""
+        if not self.enabled:
+            return ""
+        return await asyncio.to_thread(self._render)
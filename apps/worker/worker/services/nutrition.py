@@ -0,0 +1,96 @@
+import logging
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MACRO_FIELDS = ("kcal", "protein_g", "carbs_g", "fat_g")
+# Model totals this close to the computed ones are rounding, not arithmetic errors
+TOTALS_TOLERANCE = 0.02
+# A day misses the calorie target when its meals are further off than this share
+DAY_KCAL_TOLERANCE = 0.10
+
+class NutritionSummary(NamedTuple):
+    daily: np.ndarray  # one row per day: kcal, protein_g, carbs_g, fat_g summed over its meals
+    totals: Dict[str, Any]  # average daily totals, as worker.schemas.Totals
+    off_target_days: List[int]  # day numbers (by position) outside the calorie tolerance
+    corrected: List[str]  # fields of the reported totals that disagreed with the meals
+
+def _number(value: Any) -> float:
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else 0.0
+
+def meal_macros(plan: Any) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Per-meal kcal and macros as a (meals, 4) array, plus the position of each
+    meal's day. Days and meals that are not objects are skipped and
+    non-numeric values count as zero, so a half-repaired plan still sums.
+    """
+    values: List[float] = []
+    day_index: List[int] = []
+    for index, day in enumerate(plan if isinstance(plan, list) else []):
+        meals = day.get("meals") if isinstance(day, dict) else None
+        for meal in meals if isinstance(meals, list) else []:
+            if isinstance(meal, dict):
+                values.extend(_number(meal.get(field)) for field in MACRO_FIELDS)
+                day_index.append(index)
+    return np.array(values, dtype=float).reshape(-1, len(MACRO_FIELDS)), np.array(day_index, dtype=np.intp)
+
+def daily_macros(plan: Any) -> np.ndarray:
+    """Summed kcal and macros per day, one row per entry of ``plan``."""
+    macros, day_index = meal_macros(plan)
+    days = len(plan) if isinstance(plan, list) else 0
+    if not days:
+        return np.zeros((0, len(MACRO_FIELDS)))
+    return np.stack([np.bincount(day_index, weights=macros[:, column], minlength=days) for column in range(len(MACRO_FIELDS))], axis=1)
+
+def average_totals(daily: np.ndarray) -> Dict[str, Any]:
+    """Average daily totals from per-day sums, rounded as the plan schemas expect."""
+    average = daily.mean(axis=0) if len(daily) else np.zeros(len(MACRO_FIELDS))
+    return {
+        "kcal": int(round(float(average[0]))),
+        "protein_g": round(float(average[1]), 1),
+        "carbs_g": round(float(average[2]), 1),
+        "fat_g": round(float(average[3]), 1),
+    }
+
+def plan_totals(plan: Any) -> Dict[str, Any]:
+    """Average daily kcal and macros computed from the per-meal values."""
+    return average_totals(daily_macros(plan))
+
+def off_target_days(daily: np.ndarray, calorie_target: Optional[float], tolerance: float = DAY_KCAL_TOLERANCE) -> List[int]:
+    """Day numbers (by position) whose kcal miss ``calorie_target`` by more than ``tolerance``."""
+    if not calorie_target or not len(daily):
+        return []
+    missed = np.abs(daily[:, 0] - calorie_target) > tolerance * calorie_target
+    return (np.flatnonzero(missed) + 1).tolist()
+
+def reconcile_totals(data: Dict[str, Any], calorie_target: Optional[float] = None, tolerance: float = DAY_KCAL_TOLERANCE) -> NutritionSummary:
+    """
+    Replace ``data["totals"]`` with totals computed from the meals, noting
+    which reported fields were inconsistent with them, and flag days that miss
+    the calorie target. The model's arithmetic is never trusted, so a wrong
+    sum no longer fails validation on its own.
+    """
+    daily = daily_macros(data.get("plan"))
+    totals = average_totals(daily)
+    reported = data.get("totals")
+    if not isinstance(reported, dict):
+        reported = {}
+    corrected = [
+        field for field in MACRO_FIELDS
+        if abs(_number(reported.get(field)) - totals[field]) > max(TOTALS_TOLERANCE * abs(totals[field]), 1.0)
+    ]
+    if corrected:
+        logger.info(
+            f"Replaced model totals that disagree with the meals: {', '.join(corrected)}",
+            extra={"stage": "nutrition", "reported_kcal": reported.get("kcal"), "kcal": totals["kcal"]},
+        )
+    data["totals"] = totals
+
+    missed = off_target_days(daily, calorie_target, tolerance)
+    if missed and calorie_target is not None:
+        logger.warning(
+            f"Days {missed} miss the {int(calorie_target)} kcal target by more than {tolerance:.0%}",
+            extra={"stage": "nutrition", "days": missed, "daily_kcal": [int(round(kcal)) for kcal in daily[:, 0]]},
+        )
+    return NutritionSummary(daily, totals, missed, corrected)
@@ -0,0 +1,196 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional
+import numpy as np
+from worker.services.ingredients import OTHER_CATEGORY, IngredientIndex, load_ingredient_index
+from worker.services.nutrition import MACRO_FIELDS
+from worker.services.quantities import parse_quantity
+
+logger = logging.getLogger(__name__)
+
+NUTRITION_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "nutrition.json")
+
+# Compiled tables, shared through the page cache by every worker process on the host
+DEFAULT_ARRAYS_DIR = os.path.join(tempfile.gettempdir(), "wellplate-nutrition")
+
+# Columns of the compiled table: the macros per 100 g, then grams per piece and per millilitre
+PIECE_G, G_PER_ML = len(MACRO_FIELDS), len(MACRO_FIELDS) + 1
+_LAYOUT = "v1:" + ",".join(MACRO_FIELDS) + ",piece_g,g_per_ml"
+
+# Per-meal limits of worker.schemas.Meal, which computed values can exceed
+MIN_MEAL_KCAL, MAX_MEAL_KCAL, MAX_MEAL_MACRO_G = 50, 1000, 100
+
+_COOKED = re.compile(r"\bcooked\b")
+
+class IngredientAmount(NamedTuple):
+    row: int  # row of the compiled table
+    grams: float
+
+def _compiled(rows: List[List[float]], digest: str, arrays_dir: Optional[str]) -> np.ndarray:
+    """
+    The table as a read-only memory-mapped .npy, written once per version of
+    the source; an in-process array when the directory is not writable.
+    """
+    table = np.array(rows, dtype=np.float32)
+    if not arrays_dir:
+        return table
+    path = os.path.join(arrays_dir, f"nutrition-{digest}.npy")
+    try:
+        if not os.path.exists(path):
+            os.makedirs(arrays_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=arrays_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, table)
+            os.replace(tmp_path, path)
+        return np.load(path, mmap_mode="r")
+    except (OSError, ValueError) as e:
+        logger.warning(f"Nutrition table not memory-mapped ({path}): {e}")
+        return table
+
+class NutritionTable:
+    """
+    Nutrition per 100 g of the taxonomy's canonical ingredients, with
+    per-category rows for ingredients the table does not list, compiled
+    into a float32 array that is memory-mapped read-only.
+
+    Ingredient names are resolved through the IngredientIndex and their
+    ``qty`` through parse_quantity: grams are used as they are, volumes go
+    through the ingredient's density, counts through its weight per piece,
+    and named units (can, slice, clove...) through per-ingredient or
+    generic weights. Amounts that do not parse ("to taste") weigh nothing.
+    Grains, pasta and lentils use their cooked values when the item or
+    quantity says "cooked".
+    """
+
+    def __init__(self, table: Dict[str, Any], index: IngredientIndex, arrays_dir: Optional[str] = DEFAULT_ARRAYS_DIR, cache_size: int = 8192):
+        self.index = index
+        self.unit_grams: Dict[str, float] = table["unit_grams"]
+        self._rows: Dict[str, int] = {}
+        self._cooked_rows: Dict[str, int] = {}
+        self._category_rows: Dict[str, int] = {}
+        self._units: Dict[str, Dict[str, float]] = {}
+        rows: List[List[float]] = []
+
+        def add(entry: Dict[str, Any], fallback: Dict[str, Any], density: Optional[float]) -> None:
+            piece_g = entry.get("piece_g", fallback["piece_g"])
+            g_per_ml = density or entry.get("g_per_ml") or fallback["g_per_ml"]
+            rows.append([*entry["per_100g"], piece_g, g_per_ml])
+            if "cooked_per_100g" in entry:
+                rows.append([*entry["cooked_per_100g"], piece_g, g_per_ml])
+
+        for category, entry in table["categories"].items():
+            self._category_rows[category] = len(rows)
+            if "cooked_per_100g" in entry:
+                self._cooked_rows[category] = len(rows) + 1
+            add(entry, entry, None)
+        for name, entry in table["ingredients"].items():
+            category = index.categorize(name).category
+            self._rows[name] = len(rows)
+            if "cooked_per_100g" in entry:
+                self._cooked_rows[name] = len(rows) + 1
+            self._units[name] = entry.get("units", {})
+            add(entry, table["categories"].get(category, table["categories"][OTHER_CATEGORY]), index.density(name))
+
+        source = json.dumps(table, sort_keys=True).encode("utf-8")
+        digest = hashlib.sha256(_LAYOUT.encode("utf-8") + source).hexdigest()[:16]
+        self.table = _compiled(rows, digest, arrays_dir)
+        self.per_100g = self.table[:, :len(MACRO_FIELDS)]
+        self.resolve = lru_cache(maxsize=cache_size)(self._resolve)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _resolve(self, item: str, qty: str) -> IngredientAmount:
+        match = self.index.lookup(item)
+        key = match.canonical if match and match.canonical in self._rows else (match.category if match else OTHER_CATEGORY)
+        row = self._rows.get(key, self._category_rows.get(key, self._category_rows[OTHER_CATEGORY]))
+        if _COOKED.search(f"{item} {qty}".lower()):
+            row = self._cooked_rows.get(key, row)
+
+        quantity = parse_quantity(qty)
+        if quantity is None:
+            return IngredientAmount(row, 0.0)
+        amount, unit = quantity
+        if unit == "g":
+            grams = amount
+        elif unit == "ml":
+            grams = amount * float(self.table[row, G_PER_ML])
+        elif unit in self._units.get(key, {}):
+            grams = amount * self._units[key][unit]
+        elif unit in self.unit_grams:
+            grams = amount * self.unit_grams[unit]
+        else:
+            grams = amount * float(self.table[row, PIECE_G])
+        return IngredientAmount(row, grams)
+
+    def meal_macros(self, meals: List[Dict[str, Any]]) -> np.ndarray:
+        """
+        kcal, protein_g, carbs_g and fat_g of each meal from its ingredients,
+        as a (meals, 4) array; all ingredients of all meals in one product.
+        """
+        rows: List[int] = []
+        grams: List[float] = []
+        owners: List[int] = []
+        for position, meal in enumerate(meals):
+            for ingredient in meal.get("ingredients") or []:
+                if isinstance(ingredient, dict):
+                    amount = self.resolve(str(ingredient.get("item", "")), str(ingredient.get("qty", "")))
+                else:
+                    amount = self.resolve(str(ingredient), "")
+                rows.append(amount.row)
+                grams.append(amount.grams)
+                owners.append(position)
+        if not rows:
+            return np.zeros((len(meals), len(MACRO_FIELDS)))
+        values = self.per_100g[rows].astype(float) * (np.array(grams) / 100.0)[:, None]
+        return np.stack([
+            np.bincount(owners, weights=values[:, column], minlength=len(meals))
+            for column in range(len(MACRO_FIELDS))
+        ], axis=1)
+
+    def apply_meal_macros(self, plan: Any) -> int:
+        """
+        Overwrite the kcal and macros of every meal in ``plan`` that lists
+        ingredients with the values computed from them; returns how many
+        meals were set. Meals without ingredients keep what they have.
+        """
+        meals: List[Dict[str, Any]] = []
+        for day in plan if isinstance(plan, list) else []:
+            day_meals = day.get("meals") if isinstance(day, dict) else None
+            meals.extend(
+                meal for meal in (day_meals if isinstance(day_meals, list) else [])
+                if isinstance(meal, dict) and meal.get("ingredients")
+            )
+        for meal, (kcal, protein, carbs, fat) in zip(meals, self.meal_macros(meals).tolist()):
+            meal["kcal"] = int(round(kcal))
+            meal["protein_g"] = round(protein, 1)
+            meal["carbs_g"] = round(carbs, 1)
+            meal["fat_g"] = round(fat, 1)
+        return len(meals)
+
+@lru_cache(maxsize=1)
+def load_nutrition_table(path: str = NUTRITION_PATH, arrays_dir: Optional[str] = DEFAULT_ARRAYS_DIR) -> NutritionTable:
+    """The bundled table, compiled and mapped once per process."""
+    with open(path, encoding="utf-8") as f:
+        table = json.load(f)
+    return NutritionTable(table, load_ingredient_index(), arrays_dir)
+
+def apply_meal_macros(plan: Any) -> int:
+    """Set every meal's kcal and macros in ``plan`` from the bundled table."""
+    return load_nutrition_table().apply_meal_macros(plan)
+
+def meal_limit_violations(meal: Dict[str, Any]) -> List[str]:
+    """The kcal and macro fields of ``meal`` outside the per-meal limits of the plan schema."""
+    limits = {"kcal": (MIN_MEAL_KCAL, MAX_MEAL_KCAL)}
+    violations = []
+    for field in MACRO_FIELDS:
+        low, high = limits.get(field, (0, MAX_MEAL_MACRO_G))
+        value = meal.get(field)
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or not low <= value <= high:
+            violations.append(field)
+    return violations
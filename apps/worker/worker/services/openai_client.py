@@ -1,233 +1,563 @@
+import asyncio
 import json
 import logging
-from typing import Dict, Any
+from typing import AsyncIterator, Dict, Any, List, Optional
+# The HTTP client the installed openai SDK is built on: httpx2 in newer releases, httpx before
+try:
+    import httpx2 as httpx
+except ImportError:
+    import httpx  # type: ignore[no-redef]
 from openai import AsyncOpenAI
 from worker.schemas import MealPreference
 from worker.config import settings
+from worker.services.allergen_matcher import compile_matcher
+from worker.services.ingredients import build_groceries
+from worker.services.json_stream import MealStreamScanner, JSONRepairError, parse_json_with_repairs
+from worker.services.meal_store import StoredMeal
+from worker.services.metrics import JSON_PARSES, OFF_TARGET_DAYS, TOTALS_CORRECTIONS, UPSTREAM_SECONDS, Metrics
+from worker.services.nutrition import plan_totals, reconcile_totals
+from worker.services.nutrition_db import MAX_MEAL_KCAL, MIN_MEAL_KCAL, apply_meal_macros, meal_limit_violations
+from worker.services.plan_defects import DAY_DEFECTS, MEAL_DEFECTS, PlanDefect, PlanValidationError, is_repairable
+from worker.services.plan_prompts import day_group_prompt, week_plan_prompt
+from worker.services.retry_policy import Deadline, DeadlineExceeded, upstream_timeout
+from worker.services.structured_logging import log_payload
 
 logger = logging.getLogger(__name__)
 
+# Rotated across days so concurrently generated days stay distinct
+CUISINE_ROTATION = ["Mediterranean", "Mexican", "Japanese", "Indian", "Italian", "Middle Eastern", "Thai", "American", "Korean"]
+PROTEIN_ROTATION = {
+    "vegan": ["tofu", "lentils", "chickpeas", "tempeh", "black beans", "seitan", "edamame"],
+    "vegetarian": ["eggs", "lentils", "Greek yogurt", "chickpeas", "paneer", "tofu", "cottage cheese"],
+}
+DEFAULT_PROTEIN_ROTATION = ["chicken", "salmon", "lean beef", "eggs", "turkey", "white fish", "shrimp"]
+
+def groceries_example() -> str:
+    """The "groceries" part of a small prompt's JSON example, empty when grocery lists are built locally."""
+    return "" if settings.LOCAL_GROCERIES else ', "groceries": [{"category": "Produce", "items": ["..."]}]'
+
+def meal_example() -> str:
+    """One meal of a small prompt's JSON example, without kcal and macros when they are computed locally."""
+    if settings.LOCAL_MACROS:
+        return '{"name": "...", "ingredients": [{"item": "...", "qty": "amount in g, ml, cups, spoons or pieces"}], "steps": ["..."]}'
+    return '{"name": "...", "kcal": 450, "protein_g": 25.0, "carbs_g": 40.0, "fat_g": 15.0, "ingredients": [{"item": "...", "qty": "..."}], "steps": ["..."]}'
+
+def meal_slots(meals_per_day: int) -> List[str]:
+    """Names of the meal slots for a given number of meals per day."""
+    if meals_per_day == 4:
+        return ["breakfast", "lunch", "dinner", "snack"]
+    elif meals_per_day == 5:
+        return ["breakfast", "lunch", "dinner", "afternoon snack", "evening snack"]
+    elif meals_per_day == 6:
+        return ["breakfast", "morning snack", "lunch", "afternoon snack", "dinner", "evening snack"]
+    return ["breakfast", "lunch", "dinner"]
+
+def create_http_client() -> httpx.AsyncClient:
+    """Build the keep-alive (HTTP/2 when available) pool shared by all upstream calls."""
+    http2 = settings.OPENAI_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("OPENAI_HTTP2 is enabled but the 'h2' package is missing; falling back to HTTP/1.1")
+            http2 = False
+    
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=settings.OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+        timeout=httpx.Timeout(settings.OPENAI_TIMEOUT_SECONDS, connect=10.0),
+    )
+
 class OpenAIClient:
-    def __init__(self):
-        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+    def __init__(self, client: Optional[AsyncOpenAI] = None, metrics: Optional[Metrics] = None):
+        self.client = client or AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+        self.metrics = metrics or Metrics(path=None)
+    
+    @classmethod
+    def create_shared(cls, metrics: Optional[Metrics] = None) -> "OpenAIClient":
+        """Create the long-lived, pooled client owned by the app lifespan."""
+        # Retries are owned by RetryPolicy, so the SDK must not retry on its own
+        return cls(AsyncOpenAI(api_key=settings.OPENAI_API_KEY, http_client=create_http_client(), max_retries=0), metrics)
+    
+    async def warm_up(self, connections: int = 1) -> None:
+        """
+        Open pooled connections ahead of the first request so it does not pay
+        for DNS and TLS setup. Failures are logged and otherwise ignored.
+        """
+        if connections <= 0:
+            return
+        results = await asyncio.gather(
+            *(self.client.models.list() for _ in range(connections)),
+            return_exceptions=True,
+        )
+        failures = [r for r in results if isinstance(r, Exception)]
+        if failures:
+            logger.warning(f"Upstream warm-up failed for {len(failures)}/{connections} connections: {failures[0]}")
+        else:
+            logger.info(f"Warmed up {connections} upstream connections")
     
-    async def generate_meal_plan(self, preferences: MealPreference) -> Dict[str, Any]:
+    async def aclose(self) -> None:
+        """Close the underlying connection pool."""
+        await self.client.close()
+    
+    async def _create(self, kind: str, **kwargs: Any) -> Any:
+        """One chat completion, timed and with its token usage counted per model."""
+        with self.metrics.timer(UPSTREAM_SECONDS, model=kwargs["model"], kind=kind):
+            response = await self.client.chat.completions.create(**kwargs)
+        if not kwargs.get("stream"):
+            self.metrics.record_usage(kwargs["model"], response)
+        return response
+    
+    async def generate_meal_plan(
+        self,
+        preferences: MealPreference,
+        deadline: Optional[Deadline] = None,
+        prefilled: Optional[List[List[Optional[StoredMeal]]]] = None,
+    ) -> Dict[str, Any]:
         """
         Generate a personalized meal plan using OpenAI's GPT-4 with structured output.
+        With GENERATION_DAYS_PER_REQUEST below 7 the week is requested as
+        concurrent groups of days instead of one long completion. Slots already
+        filled from the meal store (``prefilled``, per day and slot) are kept
+        and only the rest is generated. Every upstream call's timeout is
+        capped at the time left before ``deadline``.
         """
+        if prefilled and any(meal for day in prefilled for meal in day):
+            return await self._complete_prefilled(preferences, prefilled, deadline)
         
-        # Build the prompt
-        prompt = self._build_prompt(preferences)
+        days_per_request = settings.GENERATION_DAYS_PER_REQUEST
+        if 0 < days_per_request < 7:
+            return await self._generate_fan_out(preferences, days_per_request, deadline)
         
         try:
-            response = await self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": f"You are a professional nutritionist and meal planning expert. CRITICAL: You MUST generate EXACTLY {preferences.mealsPerDay} meals per day. This is NON-NEGOTIABLE. Count your meals before responding. Create detailed, personalized meal plans that are nutritionally balanced and practical to prepare."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.3,
-                max_tokens=4000
+            response = await self._create(
+                "week",
+                **self._completion_kwargs(preferences),
+                **upstream_timeout(deadline, settings.OPENAI_TIMEOUT_SECONDS),
             )
             
             # Parse the response
-            content = response.choices[0].message.content
-            meal_plan_data = json.loads(content)
+            meal_plan_data = self._parse_content(response.choices[0].message.content)
             
-            # Log what AI returned before validation
-            logger.info(f"🔍 AI returned data with {len(meal_plan_data.get('plan', []))} days")
-            if meal_plan_data.get('plan') and len(meal_plan_data['plan']) > 0:
-                actual_meals = len(meal_plan_data['plan'][0].get('meals', []))
-                expected_meals = preferences.mealsPerDay
-                logger.info(f"🔍 First day has {actual_meals} meals, expected {expected_meals}")
-                meal_names = [meal.get('name', 'unnamed') for meal in meal_plan_data['plan'][0].get('meals', [])]
-                logger.info(f"🔍 Meal names from AI: {meal_names}")
-                
-                # CRITICAL: If meal count is wrong, reject and retry
-                if actual_meals != expected_meals:
-                    logger.error(f"🚨 MEAL COUNT MISMATCH: Expected {expected_meals}, got {actual_meals}")
-                    raise ValueError(f"AI generated {actual_meals} meals instead of {expected_meals}. This is unacceptable.")
+            # Log the shape of what the model returned before validation
+            plan = meal_plan_data.get("plan") or []
+            logger.info(
+                "Plan received",
+                extra={
+                    "stage": "parse",
+                    "days": len(plan),
+                    "first_day_meals": len(plan[0].get("meals", [])) if plan and isinstance(plan[0], dict) else 0,
+                    "expected_meals": preferences.mealsPerDay,
+                },
+            )
             
-            # Validate and clean the data
-            return self._validate_and_clean_response(meal_plan_data, preferences)
+            # Validate, regenerating only the days or meals that are wrong
+            return await self._validate_with_repairs(meal_plan_data, preferences, deadline)
             
-        except json.JSONDecodeError as e:
+        except JSONRepairError as e:
             logger.error(f"Failed to parse JSON response: {e}")
-            raise Exception("Invalid response format from AI service")
+            raise Exception("Invalid response format from AI service") from e
+        except PlanValidationError:
+            raise
         except Exception as e:
             logger.error(f"OpenAI API error: {e}")
-            raise Exception("Failed to generate meal plan")
+            raise Exception("Failed to generate meal plan") from e
     
-    def _build_prompt(self, preferences: MealPreference) -> str:
-        """Build a detailed prompt for meal plan generation."""
+    async def _generate_fan_out(self, preferences: MealPreference, days_per_request: int, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """
+        Request groups of days concurrently, each with the same diversity
+        context, then merge them into one plan with recomputed totals and a
+        single grocery list. Wall-clock time tracks the slowest group.
+        """
+        themes = self._day_themes(preferences)
+        groups = [list(range(start, min(start + days_per_request, 8))) for start in range(1, 8, days_per_request)]
         
-        # Calculate calorie target if not provided
-        calorie_target = preferences.caloriesTarget
-        if not calorie_target:
-            calorie_target = self._calculate_calorie_target(preferences)
+        try:
+            results = await asyncio.gather(
+                *(self._generate_days(preferences, days, themes, deadline) for days in groups)
+            )
+        except JSONRepairError as e:
+            logger.error(f"Failed to parse JSON response: {e}")
+            raise Exception("Invalid response format from AI service") from e
+        except Exception as e:
+            logger.error(f"OpenAI API error: {e}")
+            raise Exception("Failed to generate meal plan") from e
         
-        # Determine meal structure based on preferences
+        merged = self._merge_day_groups(results)
+        logger.info(f"Merged {len(groups)} concurrent day groups into a {len(merged['plan'])}-day plan")
+        return await self._validate_with_repairs(merged, preferences, deadline)
+    
+    async def _generate_days(self, preferences: MealPreference, days: List[int], themes: Dict[int, str], deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """Generate the given days and renumber them to match the request."""
         meals_per_day = preferences.mealsPerDay
-        meal_names = ["breakfast", "lunch", "dinner"]
-        if meals_per_day == 4:
-            meal_names = ["breakfast", "lunch", "dinner", "snack"]
-        elif meals_per_day == 5:
-            meal_names = ["breakfast", "lunch", "dinner", "afternoon snack", "evening snack"]
-        elif meals_per_day == 6:
-            meal_names = ["breakfast", "morning snack", "lunch", "afternoon snack", "dinner", "evening snack"]
+        response = await self._create(
+            "days",
+            model="gpt-4o",
+            messages=self._days_messages(preferences, days, themes),
+            response_format={"type": "json_object"},
+            temperature=0.3,
+            max_tokens=min(4000, 400 + 180 * meals_per_day * len(days)),
+            **upstream_timeout(deadline, settings.OPENAI_TIMEOUT_SECONDS),
+        )
+        data = self._parse_content(response.choices[0].message.content)
         
-        # Protein shake instructions
-        protein_instructions = ""
-        if preferences.includeProteinShakes:
-            protein_instructions = f"""
-- Include protein powder in {meals_per_day // 2} meals per day (mix into smoothies, yogurt, oatmeal, or create protein-rich recipes)
-- Use 1 scoop (25-30g) of protein powder per meal when included
-- Examples: protein smoothie, protein yogurt bowl, protein oatmeal, protein pancakes, protein energy balls
-- Ensure protein powder is appropriate for {preferences.dietType} diet (whey, plant-based, etc.)
-"""
-
-        prompt = f"""
-🚨 CRITICAL: You MUST generate EXACTLY {meals_per_day} meals per day. This is NON-NEGOTIABLE.
-
-Create a detailed 7-day meal plan for a {preferences.age}-year-old {preferences.sex} who weighs {preferences.weightKg}kg and is {preferences.heightCm}cm tall.
-
-Goals and Preferences:
-- Goal: {preferences.goal} weight
-- Diet type: {preferences.dietType}
+        plan = [day for day in data.get("plan", []) if isinstance(day, dict)][:len(days)]
+        for day_number, day in zip(days, plan):
+            day["day"] = day_number
+        return {"plan": plan, "groceries": data.get("groceries", [])}
+    
+    async def _complete_prefilled(self, preferences: MealPreference, prefilled: List[List[Optional[StoredMeal]]], deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """
+        Build the week around stored meals. Days with at most half of their
+        slots empty get just the missing meals in one small call; emptier
+        days are generated whole, in groups of GENERATION_DAYS_PER_REQUEST.
+        Fully stored days cost no upstream call at all.
+        """
+        themes = self._day_themes(preferences)
+        whole_days = [day for day, slots in enumerate(prefilled, 1) if slots.count(None) * 2 > len(slots)]
+        partial_days = [
+            day for day, slots in enumerate(prefilled, 1)
+            if day not in whole_days and None in slots
+        ]
+        days_per_request = settings.GENERATION_DAYS_PER_REQUEST if 0 < settings.GENERATION_DAYS_PER_REQUEST < 7 else 7
+        groups = [whole_days[start:start + days_per_request] for start in range(0, len(whole_days), days_per_request)]
+        logger.info(
+            f"Meal store filled {sum(meal is not None for slots in prefilled for meal in slots)} slots; "
+            f"generating {len(whole_days)} whole days and missing meals for {len(partial_days)} days"
+        )
+        
+        try:
+            day_results, slot_results = await asyncio.gather(
+                asyncio.gather(*(self._generate_days(preferences, days, themes, deadline) for days in groups)),
+                asyncio.gather(*(self._generate_slot_meals(preferences, day, prefilled[day - 1], deadline) for day in partial_days)),
+            )
+        except JSONRepairError as e:
+            logger.error(f"Failed to parse JSON response: {e}")
+            raise Exception("Invalid response format from AI service") from e
+        except Exception as e:
+            logger.error(f"OpenAI API error: {e}")
+            raise Exception("Failed to generate meal plan") from e
+        
+        generated = {day["day"]: day for result in day_results for day in result["plan"]}
+        for day, result in zip(partial_days, slot_results):
+            generated[day] = {"day": day, "meals": result["meals"]}
+        stored_groceries = []
+        plan = []
+        for day, slots in enumerate(prefilled, 1):
+            if day in whole_days:
+                # A day the model left out is reported as missing and repaired
+                plan.append(generated.get(day) or {"day": day})
+                continue
+            new_meals = iter(generated.get(day, {}).get("meals", []))
+            meals = []
+            for stored in slots:
+                if stored is None:
+                    meals.append(next(new_meals, None))
+                else:
+                    meals.append(stored.meal)
+                    stored_groceries.append(stored.groceries)
+            plan.append({"day": day, "meals": [meal for meal in meals if meal is not None]})
+        
+        merged = {
+            "plan": plan,
+            "totals": plan_totals(plan),
+            "groceries": self._merge_groceries(
+                stored_groceries + [r.get("groceries", []) for r in day_results] + [r.get("groceries", []) for r in slot_results]
+            ),
+        }
+        return await self._validate_with_repairs(merged, preferences, deadline)
+    
+    async def _generate_slot_meals(self, preferences: MealPreference, day: int, slots: List[Optional[StoredMeal]], deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """Generate the meals for the empty slots of one day, around the stored meals it keeps."""
+        names = meal_slots(preferences.mealsPerDay)
+        missing = [names[i] if i < len(names) else "meal" for i, stored in enumerate(slots) if stored is None]
+        kept = [stored.meal.get("name", "") for stored in slots if stored is not None]
+        calorie_target = preferences.caloriesTarget or self._calculate_calorie_target(preferences)
+        remaining_kcal = calorie_target - sum(stored.meal.get("kcal") or 0 for stored in slots if stored is not None)
+        
+        response = await self._create(
+            "slot_meals",
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": "You are a professional nutritionist. Respond with JSON only."},
+                {
+                    "role": "user",
+                    "content": f"""
+Day {day} of a {preferences.dietType} meal plan ({calorie_target} kcal/day, {preferences.mealsPerDay} meals) already has: {', '.join(kept)}.
+Create exactly {len(missing)} meal(s) for these slots, in order: {', '.join(missing)}.
+- Together about {max(remaining_kcal, 150 * len(missing))} kcal
+- Never use: {', '.join(preferences.allergies) if preferences.allergies else 'None'}
+- Avoid: {', '.join(preferences.dislikes) if preferences.dislikes else 'None'}
+- Must differ from the meals above
 - Cooking effort: {preferences.cookingEffort}
-- Target calories: {calorie_target} per day
-- Meals per day: {meals_per_day} ({', '.join(meal_names)})
-- Include protein shakes: {'Yes' if preferences.includeProteinShakes else 'No'}
-- Allergies: {', '.join(preferences.allergies) if preferences.allergies else 'None'}
-- Dislikes: {', '.join(preferences.dislikes) if preferences.dislikes else 'None'}
-
-🚨 ABSOLUTE REQUIREMENTS (FAILURE TO FOLLOW WILL RESULT IN REJECTION):
-1. 🚨 EXACTLY {meals_per_day} meals per day for ALL 7 days - NO EXCEPTIONS
-2. 🚨 Each meal must be appropriate for its designated time:
-   - BREAKFAST: Light, morning-appropriate meals (eggs, oatmeal, smoothies, toast, yogurt, fruit, pancakes, cereal)
-   - LUNCH: Midday meals (salads, sandwiches, soups, light proteins, wraps, bowls)
-   - DINNER: Hearty evening meals (roasted meats, pasta, substantial dishes, casseroles, stir-fries)
-   - SNACKS: Light, portable options (nuts, fruit, yogurt, energy balls, smoothies)
-3. Each meal must include detailed nutritional information (calories, protein, carbs, fat)
-4. Provide complete ingredient lists with quantities
-5. Include step-by-step cooking instructions
-6. Ensure meals are appropriate for the {preferences.dietType} diet
-7. Avoid all allergens: {', '.join(preferences.allergies) if preferences.allergies else 'None'}
-8. Stay within ±10% of the calorie target
-9. Make meals practical for {preferences.cookingEffort} cooking
-10. Include a comprehensive grocery list organized by category{protein_instructions}
 
-🚨 MEAL COUNT VERIFICATION:
-- If you generate fewer than {meals_per_day} meals, your response will be REJECTED
-- If you generate more than {meals_per_day} meals, your response will be REJECTED
-- You MUST count your meals before submitting: 1, 2, 3{', 4' if meals_per_day >= 4 else ''}{', 5' if meals_per_day >= 5 else ''}{', 6' if meals_per_day >= 6 else ''}
-
-MEAL TIMING ENFORCEMENT:
-- Breakfast meals should NEVER include heavy dinner foods like beef quesadillas, pasta, or roasted meats
-- Lunch meals should be lighter than dinner but more substantial than breakfast
-- Dinner meals should be the heartiest and most satisfying
-- Snacks should be light and portable, not full meals
-
-🚨 CRITICAL: You are generating a meal plan for {meals_per_day} meals per day.
-🚨 The "meals" array MUST contain EXACTLY {meals_per_day} meal objects.
-🚨 Count them: 1, 2, 3{', 4' if meals_per_day >= 4 else ''}{', 5' if meals_per_day >= 5 else ''}{', 6' if meals_per_day >= 6 else ''}
-
-🚨 JSON STRUCTURE - FOLLOW EXACTLY:
-You MUST create a JSON with EXACTLY {meals_per_day} meals in the "meals" array:
-
-{{
-  "plan": [
-    {{
-      "day": 1,
-      "meals": [
-        {{
-          "name": "Breakfast: [meal name]",
-          "kcal": 450,
-          "protein_g": 25.5,
-          "carbs_g": 35.2,
-          "fat_g": 18.3,
-          "ingredients": [
-            {{"item": "ingredient name", "qty": "amount"}}
-          ],
-          "steps": ["Step 1", "Step 2", "Step 3"]
-        }},
-        {{
-          "name": "Lunch: [meal name]",
-          "kcal": 500,
-          "protein_g": 30.0,
-          "carbs_g": 40.0,
-          "fat_g": 20.0,
-          "ingredients": [
-            {{"item": "ingredient name", "qty": "amount"}}
-          ],
-          "steps": ["Step 1", "Step 2", "Step 3"]
-        }},
-        {{
-          "name": "Dinner: [meal name]",
-          "kcal": 600,
-          "protein_g": 35.0,
-          "carbs_g": 45.0,
-          "fat_g": 25.0,
-          "ingredients": [
-            {{"item": "ingredient name", "qty": "amount"}}
-          ],
-          "steps": ["Step 1", "Step 2", "Step 3"]
-        }}{',' if meals_per_day >= 4 else ''}
-        {{
-          "name": "Snack: [meal name]",
-          "kcal": 200,
-          "protein_g": 10.0,
-          "carbs_g": 20.0,
-          "fat_g": 8.0,
-          "ingredients": [
-            {{"item": "ingredient name", "qty": "amount"}}
-          ],
-          "steps": ["Step 1", "Step 2"]
-        }}{',' if meals_per_day >= 5 else ''}
-        {{
-          "name": "Evening Snack: [meal name]",
-          "kcal": 150,
-          "protein_g": 8.0,
-          "carbs_g": 15.0,
-          "fat_g": 6.0,
-          "ingredients": [
-            {{"item": "ingredient name", "qty": "amount"}}
-          ],
-          "steps": ["Step 1"]
-        }}{',' if meals_per_day >= 6 else ''}
-      ]
-    }}
-  ],
-  "totals": {{
-    "kcal": 2100,
-    "protein_g": 120.5,
-    "carbs_g": 180.2,
-    "fat_g": 85.3
-  }},
-  "groceries": [
-    {{"category": "Produce", "items": ["item 1", "item 2"]}},
-    {{"category": "Dairy", "items": ["item 1", "item 2"]}}
-  ]
-}}
-
-🚨 COUNT VERIFICATION: The "meals" array above shows EXACTLY {meals_per_day} meals. Copy this structure and fill in your actual meals.
+Return JSON only:
+{{"meals": [{meal_example()}]{groceries_example()}}}
+"""
+                }
+            ],
+            response_format={"type": "json_object"},
+            temperature=0.3,
+            max_tokens=300 + 400 * len(missing),
+            **upstream_timeout(deadline, settings.OPENAI_TIMEOUT_SECONDS),
+        )
+        data = self._parse_content(response.choices[0].message.content)
+        meals = [meal for meal in data.get("meals", []) if isinstance(meal, dict)][:len(missing)]
+        return {"meals": meals, "groceries": data.get("groceries", [])}
+    
+    def _day_themes(self, preferences: MealPreference) -> Dict[int, str]:
+        """Assign each day a cuisine and protein focus so parallel requests do not repeat each other."""
+        proteins = PROTEIN_ROTATION.get(getattr(preferences.dietType, "value", preferences.dietType), DEFAULT_PROTEIN_ROTATION)
+        matcher = compile_matcher(preferences.allergies, preferences.dislikes)
+        proteins = [p for p in proteins if not matcher.find(p)] or proteins
+        return {
+            day: f"{CUISINE_ROTATION[(day - 1) % len(CUISINE_ROTATION)]} cuisine, {proteins[(day - 1) % len(proteins)]} as the main protein"
+            for day in range(1, 8)
+        }
+    
+    def _profile_values(self, preferences: MealPreference, protein_powder: str) -> Dict[str, Any]:
+        """Per-request values shared by the plan prompts' suffixes."""
+        # Enum members would render as "Sex.MALE"
+        sex, goal, diet_type, cooking_effort = (
+            getattr(value, "value", value)
+            for value in (preferences.sex, preferences.goal, preferences.dietType, preferences.cookingEffort)
+        )
+        return {
+            "age": preferences.age,
+            "sex": sex,
+            "weight_kg": preferences.weightKg,
+            "height_cm": preferences.heightCm,
+            "goal": goal,
+            "diet_type": diet_type,
+            "cooking_effort": cooking_effort,
+            "calorie_target": preferences.caloriesTarget or self._calculate_calorie_target(preferences),
+            "meals_per_day": preferences.mealsPerDay,
+            "slots": ", ".join(meal_slots(preferences.mealsPerDay)),
+            "allergies": ", ".join(preferences.allergies) if preferences.allergies else "None",
+            "dislikes": ", ".join(preferences.dislikes) if preferences.dislikes else "None",
+            "protein_powder": protein_powder if preferences.includeProteinShakes else "No",
+        }
+    
+    def _days_messages(self, preferences: MealPreference, days: List[int], themes: Dict[int, str]) -> List[Dict[str, str]]:
+        """Messages for a subset of the week: the compiled prefix plus this profile, days and themes."""
+        return day_group_prompt(settings.LOCAL_GROCERIES, settings.LOCAL_MACROS).messages(
+            **self._profile_values(preferences, "Yes, in about half of the meals"),
+            days=", ".join(str(d) for d in days),
+            week_overview="\n".join(f"- Day {day}: {theme}" for day, theme in themes.items()),
+        )
+    
+    def _merge_day_groups(self, groups: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Merge day groups, recompute average daily totals and combine the grocery lists."""
+        plan = sorted((day for group in groups for day in group["plan"]), key=lambda d: d["day"])
+        return {
+            "plan": plan,
+            "totals": plan_totals(plan),
+            "groceries": self._merge_groceries([group.get("groceries", []) for group in groups]),
+        }
+    
+    def _merge_groceries(self, grocery_lists: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """Combine grocery lists by category, de-duplicating items case-insensitively."""
+        categories: Dict[str, Dict[str, str]] = {}
+        for groceries in grocery_lists:
+            for category in groceries:
+                if not isinstance(category, dict):
+                    continue
+                name = str(category.get("category", "Other")).strip() or "Other"
+                items = categories.setdefault(name.title(), {})
+                for item in category.get("items", []):
+                    items.setdefault(str(item).strip().lower(), str(item).strip())
+        return [
+            {"category": name, "items": sorted(items.values(), key=str.lower)}
+            for name, items in categories.items() if items
+        ]
+    
+    async def _validate_with_repairs(self, data: Dict[str, Any], preferences: MealPreference, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """
+        Validate the plan; if every defect is local to a day or meal, regenerate
+        just those parts and splice them in, up to PLAN_REPAIR_ROUNDS times.
+        Anything else raises PlanValidationError so the caller retries. With
+        LOCAL_GROCERIES the grocery list is rebuilt from the final meals, and
+        with LOCAL_MACROS each meal's kcal and macros from its ingredients.
+        Totals are always recomputed from the meals rather than trusted.
+        """
+        calorie_target = preferences.caloriesTarget or self._calculate_calorie_target(preferences)
+        for repair_round in range(settings.PLAN_REPAIR_ROUNDS + 1):
+            if settings.LOCAL_MACROS:
+                apply_meal_macros(data.get("plan"))
+            if settings.LOCAL_GROCERIES:
+                data["groceries"] = build_groceries(data.get("plan"))
+            nutrition = reconcile_totals(data, calorie_target)
+            # With LOCAL_MACROS the model reports no totals, so there is nothing to correct
+            if repair_round == 0 and not settings.LOCAL_MACROS:
+                for field in nutrition.corrected:
+                    self.metrics.inc(TOTALS_CORRECTIONS, field=field)
+            defects = self._find_plan_defects(data, preferences)
+            if not defects:
+                break
+            if repair_round == settings.PLAN_REPAIR_ROUNDS or not is_repairable(defects):
+                raise PlanValidationError(defects)
+            logger.warning(f"Repairing {len(defects)} plan defects (round {repair_round + 1}): {defects[0].reason}")
+            data = await self._repair_plan(data, defects, preferences, deadline)
+        
+        if nutrition.off_target_days:
+            self.metrics.inc(OFF_TARGET_DAYS, len(nutrition.off_target_days))
+        return self._validate_and_clean_response(data, preferences)
+    
+    async def _repair_plan(self, data: Dict[str, Any], defects: List[PlanDefect], preferences: MealPreference, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """Regenerate the defective days and meals concurrently and splice them into the plan."""
+        plan = data["plan"]
+        del plan[7:]
+        
+        # Repairable defects always carry their day, and meal defects their meal
+        days = sorted({d.day for d in defects if d.kind in DAY_DEFECTS and d.day is not None})
+        meals = sorted({
+            (d.day, d.meal_index) for d in defects
+            if d.kind in MEAL_DEFECTS and d.day is not None and d.meal_index is not None and d.day not in days
+        })
+        themes = self._day_themes(preferences)
+        
+        day_results, meal_results = await asyncio.gather(
+            asyncio.gather(*(self._generate_days(preferences, [day], themes, deadline) for day in days)),
+            asyncio.gather(*(self._generate_meal(preferences, plan, day, meal_index, deadline) for day, meal_index in meals)),
+        )
+        
+        for result in day_results:
+            for new_day in result["plan"]:
+                while len(plan) < new_day["day"]:
+                    plan.append(None)
+                plan[new_day["day"] - 1] = new_day
+        for (day, meal_index), meal in zip(meals, meal_results):
+            plan[day - 1]["meals"][meal_index] = meal
+        
+        if days:
+            data["groceries"] = self._merge_groceries([data.get("groceries", [])] + [r.get("groceries", []) for r in day_results])
+        data["totals"] = plan_totals([day for day in plan if isinstance(day, dict)])
+        return data
+    
+    async def _generate_meal(self, preferences: MealPreference, plan: List[Dict[str, Any]], day: int, meal_index: int, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """Generate a single replacement meal for one slot."""
+        slot = meal_slots(preferences.mealsPerDay)[meal_index] if meal_index < preferences.mealsPerDay else "meal"
+        current = plan[day - 1]["meals"][meal_index]
+        other_meals = [meal.get("name", "") for meal in plan[day - 1]["meals"] if meal is not current]
+        calorie_target = preferences.caloriesTarget or self._calculate_calorie_target(preferences)
+        current_kcal = current.get("kcal")
+        if not isinstance(current_kcal, int) or not MIN_MEAL_KCAL <= current_kcal <= MAX_MEAL_KCAL:
+            current_kcal = calorie_target // preferences.mealsPerDay
+        
+        response = await self._create(
+            "meal",
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": "You are a professional nutritionist. Respond with JSON only."},
+                {
+                    "role": "user",
+                    "content": f"""
+Replace the {slot} "{current.get('name', '')}" on day {day} of a {preferences.dietType} meal plan ({calorie_target} kcal/day, {preferences.mealsPerDay} meals).
+- Target about {current_kcal} kcal
+- Never use: {', '.join(preferences.allergies) if preferences.allergies else 'None'}
+- Avoid: {', '.join(preferences.dislikes) if preferences.dislikes else 'None'}
+- Must differ from: {', '.join(other_meals) if other_meals else 'None'}
+- Cooking effort: {preferences.cookingEffort}
 
-Ensure all nutritional values are realistic and the total daily calories are close to {calorie_target}.
-🚨 CRITICAL FINAL CHECK: Count your meals - you MUST have EXACTLY {meals_per_day} meals per day for all 7 days.
-🚨 If you have fewer or more than {meals_per_day} meals, STOP and regenerate with the correct count.
+Return JSON only:
+{{"meal": {meal_example()}}}
 """
+                }
+            ],
+            response_format={"type": "json_object"},
+            temperature=0.3,
+            max_tokens=600,
+            **upstream_timeout(deadline, settings.OPENAI_TIMEOUT_SECONDS),
+        )
+        data = self._parse_content(response.choices[0].message.content)
+        return data.get("meal", data)
+    
+    def _parse_content(self, content: str) -> Dict[str, Any]:
+        """Parse a JSON completion, repairing minor glitches if needed."""
+        try:
+            data = json.loads(content)
+        except json.JSONDecodeError:
+            try:
+                meal_plan_data, repairs = parse_json_with_repairs(content)
+            except JSONRepairError as e:
+                self.metrics.inc(JSON_PARSES, mode="failed")
+                logger.warning(f"Unparseable JSON response: {e}", extra={"stage": "parse", "chars": len(content)})
+                log_payload(logger, "Unparseable response payload", content, settings.LOG_PAYLOAD_SAMPLE_RATE, stage="parse")
+                raise
+            self.metrics.inc(JSON_PARSES, mode="repaired")
+            logger.warning(f"Repaired malformed JSON response: {', '.join(repairs)}", extra={"stage": "parse", "repairs": repairs})
+            log_payload(logger, "Repaired response payload", content, settings.LOG_PAYLOAD_SAMPLE_RATE, stage="parse")
+            return meal_plan_data
+        self.metrics.inc(JSON_PARSES, mode="strict")
+        return data
+    
+    async def stream_meal_plan(self, preferences: MealPreference, deadline: Optional[Deadline] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream the completion and yield a "meal" event as soon as each meal
+        object is complete, followed by a "plan" event with the validated plan.
+        The stream and any repair calls are capped at the time left before
+        ``deadline``.
+        """
+        scanner = MealStreamScanner()
+        kwargs = self._completion_kwargs(preferences)
+        stream = await self._create(
+            "stream",
+            **kwargs,
+            **upstream_timeout(deadline, settings.OPENAI_TIMEOUT_SECONDS),
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        async for chunk in stream:
+            # The timeout bounds each read, not the whole stream
+            if deadline and deadline.expired:
+                raise DeadlineExceeded("Request deadline exceeded while streaming")
+            # The final chunk carries the usage for the whole stream and no choices
+            self.metrics.record_usage(kwargs["model"], chunk)
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            for day_index, meal_index, meal in scanner.feed(chunk.choices[0].delta.content):
+                if settings.LOCAL_MACROS:
+                    apply_meal_macros([{"meals": [meal]}])
+                yield {"type": "meal", "day": day_index + 1, "index": meal_index, "meal": meal}
         
-        logger.info(f"🔍 Generated prompt for {meals_per_day} meals per day")
-        logger.info(f"🔍 Meal names: {meal_names}")
-        logger.info(f"🔍 CRITICAL: AI must generate EXACTLY {meals_per_day} meals per day")
-        return prompt
+        try:
+            meal_plan_data = scanner.close()
+        except JSONRepairError as e:
+            self.metrics.inc(JSON_PARSES, mode="failed")
+            logger.error(f"Failed to parse streamed JSON response: {e}")
+            raise Exception("Invalid response format from AI service") from e
+        self.metrics.inc(JSON_PARSES, mode="repaired" if scanner.repairs else "strict")
+        if scanner.repairs:
+            logger.warning(f"Repaired malformed streamed JSON: {', '.join(scanner.repairs)}")
+        
+        yield {"type": "plan", "plan": await self._validate_with_repairs(meal_plan_data, preferences, deadline)}
+    
+    def _completion_kwargs(self, preferences: MealPreference) -> Dict[str, Any]:
+        """Request parameters shared by the regular and streaming completions."""
+        return {
+            "model": "gpt-4o",
+            "messages": self._week_messages(preferences),
+            "response_format": {"type": "json_object"},
+            "temperature": 0.3,
+            "max_tokens": 4000,
+        }
+    
+    def _week_messages(self, preferences: MealPreference) -> List[Dict[str, str]]:
+        """Messages for the whole week: the compiled prefix plus this profile."""
+        template = week_plan_prompt(settings.LOCAL_GROCERIES, settings.LOCAL_MACROS)
+        messages = template.messages(
+            **self._profile_values(preferences, f"Yes, in {preferences.mealsPerDay // 2} meals per day"),
+        )
+        report = template.token_report(messages[-1]["content"])
+        logger.debug(
+            "Week prompt rendered",
+            extra={"stage": "prompt", "prefix_tokens": report["prefix"], "suffix_tokens": report["suffix"]},
+        )
+        return messages
     
     def _calculate_calorie_target(self, preferences: MealPreference) -> int:
         """Calculate BMR and TDEE for calorie target."""
@@ -248,37 +578,90 @@ Ensure all nutritional values are realistic and the total daily calories are clo
         else:
             return int(tdee)
     
-    def _validate_and_clean_response(self, data: Dict[str, Any], preferences: MealPreference) -> Dict[str, Any]:
-        """Validate and clean the AI response."""
-        
+    def _find_plan_defects(self, data: Dict[str, Any], preferences: MealPreference) -> List[PlanDefect]:
+        """
+        Collect every defect in the plan with its location, so that only the
+        affected days or meals need to be regenerated. Days are renumbered by
+        position.
+        """
         # Ensure we have the required structure
-        if "plan" not in data or "totals" not in data or "groceries" not in data:
-            raise ValueError("Invalid response structure")
+        if not isinstance(data.get("plan"), list) or "totals" not in data or "groceries" not in data:
+            return [PlanDefect("structure", "Invalid response structure")]
+        
+        defects = []
+        plan = data["plan"]
         
         # Validate we have 7 days
-        if len(data["plan"]) != 7:
-            raise ValueError(f"Must have exactly 7 days, got {len(data['plan'])}")
+        for day_number in range(len(plan) + 1, 8):
+            defects.append(PlanDefect("missing_day", f"Must have exactly 7 days, got {len(plan)}: day {day_number} is missing", day=day_number))
+        if len(plan) > 7:
+            defects.append(PlanDefect("extra_day", f"Must have exactly 7 days, got {len(plan)}"))
         
         # Validate each day has the correct number of meals
         expected_meals = preferences.mealsPerDay
-        logger.info(f"🔍 Validating meal count: expected {expected_meals}, got {len(data['plan'][0]['meals']) if data['plan'] else 'no plan'}")
-        
-        for day_idx, day in enumerate(data["plan"]):
+        for day_idx, day in enumerate(plan[:7]):
+            if not isinstance(day, dict) or not isinstance(day.get("meals"), list):
+                defects.append(PlanDefect("missing_day", f"Day {day_idx + 1} has no meals", day=day_idx + 1))
+                continue
+            day["day"] = day_idx + 1
             actual_meals = len(day["meals"])
             if actual_meals != expected_meals:
                 logger.error(f"❌ Meal count validation failed: Day {day_idx + 1} must have exactly {expected_meals} meals, got {actual_meals}")
-                raise ValueError(f"Day {day_idx + 1} must have exactly {expected_meals} meals, got {actual_meals}")
+                defects.append(PlanDefect("meal_count", f"Day {day_idx + 1} must have exactly {expected_meals} meals, got {actual_meals}", day=day_idx + 1))
+        
+        # Validate nutritional values are reasonable
+        totals = data["totals"]
+        if not isinstance(totals.get("kcal"), (int, float)) or totals["kcal"] < 1000 or totals["kcal"] > 5000:
+            defects.append(PlanDefect("totals", f"Total calories {totals.get('kcal')} out of reasonable range (1000-5000)"))
+        
+        # Computed meal values can exceed the per-meal limits a model would respect
+        if settings.LOCAL_MACROS:
+            for day_idx, day in enumerate(plan[:7]):
+                if not isinstance(day, dict):
+                    continue
+                for meal_idx, meal in enumerate(day.get("meals") or []):
+                    violations = meal_limit_violations(meal) if isinstance(meal, dict) else []
+                    if violations:
+                        defects.append(PlanDefect(
+                            "meal_macros",
+                            f"Day {day_idx + 1}, Meal {meal_idx + 1}: {', '.join(f'{field} {meal.get(field)}' for field in violations)} outside the per-meal limits",
+                            day=day_idx + 1,
+                            meal_index=meal_idx,
+                        ))
+        
+        # Ensure no allergens or disliked foods are present (synonyms included)
+        matcher = compile_matcher(preferences.allergies, preferences.dislikes)
+        if not matcher.empty:
+            for day_idx, day in enumerate(plan[:7]):
+                if not isinstance(day, dict):
+                    continue
+                for meal_idx, meal in enumerate(day.get("meals") or []):
+                    if not isinstance(meal, dict):
+                        continue
+                    reported = set()
+                    for match in matcher.find_in_meal(meal):
+                        if match.term in reported:
+                            continue
+                        reported.add(match.term)
+                        label = "Allergen" if match.category == "allergy" else "Disliked food"
+                        defects.append(PlanDefect(
+                            "allergen" if match.category == "allergy" else "dislike",
+                            f"{label} '{match.term}' found in Day {day_idx + 1}, Meal {meal_idx + 1}: {match.text}",
+                            day=day_idx + 1,
+                            meal_index=meal_idx,
+                        ))
+        
+        return defects
+    
+    def _validate_and_clean_response(self, data: Dict[str, Any], preferences: MealPreference) -> Dict[str, Any]:
+        """Validate and clean the AI response, raising PlanValidationError with every defect found."""
         
-        logger.info(f"✅ Meal count validation passed: {expected_meals} meals per day")
+        defects = self._find_plan_defects(data, preferences)
+        if defects:
+            raise PlanValidationError(defects)
         
-        # Validate meal timing appropriateness
-        meal_names = ["breakfast", "lunch", "dinner"]
-        if expected_meals == 4:
-            meal_names = ["breakfast", "lunch", "dinner", "snack"]
-        elif expected_meals == 5:
-            meal_names = ["breakfast", "lunch", "dinner", "afternoon snack", "evening snack"]
-        elif expected_meals == 6:
-            meal_names = ["breakfast", "morning snack", "lunch", "afternoon snack", "dinner", "evening snack"]
+        expected_meals = preferences.mealsPerDay
+        logger.debug(f"Meal count validation passed: {expected_meals} meals per day")
         
         # Check for inappropriate meal timing
         for day_idx, day in enumerate(data["plan"]):
@@ -296,18 +679,4 @@ Ensure all nutritional values are realistic and the total daily calories are clo
                     if "snack" in meal_name or "light" in meal_name:
                         logger.warning(f"Day {day_idx + 1}, Meal {meal_idx + 1}: '{meal['name']}' may be too light for dinner")
         
-        # Validate nutritional values are reasonable
-        totals = data["totals"]
-        if totals["kcal"] < 1000 or totals["kcal"] > 5000:
-            raise ValueError(f"Total calories {totals['kcal']} out of reasonable range (1000-5000)")
-        
-        # Ensure no allergens are present
-        if preferences.allergies:
-            for day_idx, day in enumerate(data["plan"]):
-                for meal_idx, meal in enumerate(day["meals"]):
-                    for ingredient in meal["ingredients"]:
-                        for allergen in preferences.allergies:
-                            if allergen.lower() in ingredient["item"].lower():
-                                raise ValueError(f"Allergen '{allergen}' found in Day {day_idx + 1}, Meal {meal_idx + 1}: {ingredient['item']}")
-        
         return data
@@ -0,0 +1,232 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple, Union
+from worker.services.compact_plan import CompactPlan
+from worker.services.plan_payload import JSONPayload, dumps
+
+logger = logging.getLogger(__name__)
+
+# Calorie targets within the same bucket share a cached plan
+CALORIE_BUCKET_KCAL = 50
+
+DEFAULT_CACHE_PATH = os.path.join(tempfile.gettempdir(), "wellplate-plan-cache.sqlite3")
+
+# Free-text values the web app sends, mapped onto the enum values used by worker.schemas
+_GOAL_ALIASES = {
+    "lose weight": "lose",
+    "gain weight": "gain",
+    "maintain weight": "maintain",
+}
+_EFFORT_ALIASES = {
+    "quick and easy": "quick",
+    "quick & easy": "quick",
+    "budget friendly": "budget",
+    "budget-friendly": "budget",
+}
+_DIET_ALIASES = {
+    "diabetes friendly": "diabetes-friendly",
+    "diabetic": "diabetes-friendly",
+}
+
+def _enum_value(value: Any) -> str:
+    """Return the lower-cased string form of an enum member or plain string."""
+    return str(getattr(value, "value", value) or "").strip().lower()
+
+def _normalized_list(values: Optional[list]) -> list:
+    """Lower-case, de-duplicate and sort a list of free-text tags."""
+    return sorted({str(v).strip().lower() for v in values or [] if str(v).strip()})
+
+def _bucket(value: Optional[float], size: float) -> Optional[int]:
+    if value is None:
+        return None
+    return int(round(float(value) / size) * size)
+
+def normalize_preferences(preferences: Any) -> Dict[str, Any]:
+    """
+    Build the canonical form of a MealPreference (from worker.schemas or main.py)
+    so that profiles differing only in ordering, casing or small calorie
+    differences map to the same cache entry.
+    """
+    data = preferences.model_dump() if hasattr(preferences, "model_dump") else dict(preferences)
+
+    goal = _enum_value(data.get("goal"))
+    effort = _enum_value(data.get("cookingEffort"))
+    diet = _enum_value(data.get("dietType"))
+
+    return {
+        "age": int(data.get("age") or 0),
+        "weightKg": _bucket(data.get("weightKg"), 1),
+        "heightCm": _bucket(data.get("heightCm"), 1),
+        "sex": _enum_value(data.get("sex")),
+        "goal": _GOAL_ALIASES.get(goal, goal),
+        "dietType": _DIET_ALIASES.get(diet, diet),
+        "cookingEffort": _EFFORT_ALIASES.get(effort, effort),
+        "caloriesTarget": _bucket(data.get("caloriesTarget"), CALORIE_BUCKET_KCAL),
+        "mealsPerDay": int(data.get("mealsPerDay") or 3),
+        "includeProteinShakes": bool(data.get("includeProteinShakes")),
+        "allergies": _normalized_list(data.get("allergies")),
+        "dislikes": _normalized_list(data.get("dislikes")),
+        "recentMeals": _normalized_list(data.get("recentMeals")),
+    }
+
+def plan_cache_key(preferences: Any, scope: str) -> str:
+    """
+    Stable key for a profile. The scope separates plans produced by different
+    endpoints or prompt versions (e.g. 1-day plans from main.py vs 7-day plans).
+    """
+    canonical = json.dumps(normalize_preferences(preferences), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{scope}|{canonical}".encode("utf-8")).hexdigest()
+
+class PlanCache:
+    """
+    Two-tier cache of generated plans.
+
+    The first tier is an in-process LRU with TTL. The second is a SQLite file
+    shared by every worker process on the host (gunicorn -w N), so a plan
+    generated by one process is served by the others. The shared tier keeps
+    plans as JSON text and the in-process tier as CompactPlan (or JSON bytes
+    for plans of another shape), so hits come back as JSON that can be sent
+    as it is, and callers that decode one always receive a private copy.
+    """
+
+    _PRUNE_EVERY_N_SETS = 256
+
+    def __init__(
+        self,
+        path: Optional[str] = DEFAULT_CACHE_PATH,
+        max_entries: int = 1024,
+        ttl_seconds: float = 24 * 3600,
+        enabled: bool = True,
+    ):
+        self.path: str = path or ""
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self._memory: "OrderedDict[str, Tuple[float, Union[CompactPlan, bytes]]]" = OrderedDict()
+        self._sets = 0
+        self._stats = {"memory_hits": 0, "shared_hits": 0, "misses": 0, "sets": 0, "bypassed": 0, "errors": 0}
+
+        if self.enabled and self.path:
+            try:
+                self._init_shared_tier()
+            except sqlite3.Error as e:
+                logger.warning(f"Shared plan cache disabled ({self.path}): {e}")
+                self.path = ""
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5.0)
+
+    def _init_shared_tier(self) -> None:
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS plan_cache ("
+                " key TEXT PRIMARY KEY, payload TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_plan_cache_expires ON plan_cache (expires_at)")
+
+    def _shared_get(self, key: str) -> Optional[Tuple[float, str]]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT expires_at, payload FROM plan_cache WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def _shared_set(self, key: str, expires_at: float, payload: str, prune: bool) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO plan_cache (key, payload, expires_at) VALUES (?, ?, ?)",
+                (key, payload, expires_at),
+            )
+            if prune:
+                conn.execute("DELETE FROM plan_cache WHERE expires_at <= ?", (time.time(),))
+
+    def _remember(self, key: str, expires_at: float, payload: JSONPayload) -> None:
+        # Plans that fit CompactPlan take a fraction of their JSON's memory; anything else stays as bytes
+        self._memory[key] = (expires_at, CompactPlan.from_payload(payload) or payload.body)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def get_payload(self, key: str) -> Optional[JSONPayload]:
+        """
+        Return a cached plan as JSON, checking the in-process tier before the
+        shared one; serving it needs no decoding or validation.
+        """
+        if not self.enabled:
+            return None
+
+        entry = self._memory.get(key)
+        if entry is not None:
+            if entry[0] > time.time():
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                plan = entry[1]
+                return plan.to_payload() if isinstance(plan, CompactPlan) else JSONPayload(plan)
+            del self._memory[key]
+
+        if self.path:
+            try:
+                shared = await asyncio.to_thread(self._shared_get, key)
+            except sqlite3.Error as e:
+                self._stats["errors"] += 1
+                logger.warning(f"Shared plan cache read failed: {e}")
+                shared = None
+            if shared is not None:
+                payload = JSONPayload(shared[1].encode())
+                self._remember(key, shared[0], payload)
+                self._stats["shared_hits"] += 1
+                return payload
+
+        self._stats["misses"] += 1
+        return None
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a private copy of a cached plan."""
+        payload = await self.get_payload(key)
+        return payload.data() if payload is not None else None
+
+    async def set_payload(self, key: str, payload: JSONPayload) -> None:
+        """Store a validated plan's JSON in both tiers."""
+        if not self.enabled:
+            return
+
+        expires_at = time.time() + self.ttl_seconds
+        self._remember(key, expires_at, payload)
+        self._stats["sets"] += 1
+
+        if self.path:
+            self._sets += 1
+            prune = self._sets % self._PRUNE_EVERY_N_SETS == 0
+            try:
+                await asyncio.to_thread(self._shared_set, key, expires_at, payload.body.decode(), prune)
+            except sqlite3.Error as e:
+                self._stats["errors"] += 1
+                logger.warning(f"Shared plan cache write failed: {e}")
+
+    async def set(self, key: str, plan: Dict[str, Any]) -> None:
+        """Store a validated plan in both tiers."""
+        await self.set_payload(key, JSONPayload(dumps(plan)))
+
+    def record_bypass(self) -> None:
+        """Count a request that explicitly skipped the cache (regenerate)."""
+        self._stats["bypassed"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for this process."""
+        hits = self._stats["memory_hits"] + self._stats["shared_hits"]
+        lookups = hits + self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "shared_tier": bool(self.path),
+        }
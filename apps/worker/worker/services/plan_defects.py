@@ -0,0 +1,26 @@
+from typing import List, NamedTuple, Optional
+
+class PlanDefect(NamedTuple):
+    """A single problem found while validating a generated plan."""
+    kind: str
+    reason: str
+    day: Optional[int] = None
+    meal_index: Optional[int] = None
+
+# Fixed by regenerating one whole day
+DAY_DEFECTS = {"missing_day", "meal_count"}
+# Fixed by regenerating one meal in place
+MEAL_DEFECTS = {"allergen", "dislike", "meal_macros"}
+# Fixed locally without calling the model
+LOCAL_DEFECTS = {"extra_day", "extra_meals"}
+
+class PlanValidationError(ValueError):
+    """Raised when a plan still has defects; carries the structured list."""
+
+    def __init__(self, defects: List[PlanDefect]):
+        self.defects = defects
+        super().__init__("; ".join(defect.reason for defect in defects))
+
+def is_repairable(defects: List[PlanDefect]) -> bool:
+    """True if every defect can be fixed by targeted regeneration or a local fix."""
+    return all(defect.kind in DAY_DEFECTS | MEAL_DEFECTS | LOCAL_DEFECTS for defect in defects)
@@ -0,0 +1,84 @@
+import json
+from typing import Any, Iterable, Optional, Tuple, Union
+from fastapi.responses import Response
+from pydantic import TypeAdapter
+from pydantic_core import to_json
+from worker.schemas import MealPlanResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+# Built once: the schema is compiled at import instead of on every request
+PLAN_ADAPTER = TypeAdapter(MealPlanResponse)
+
+def dumps(data: Any) -> bytes:
+    """Compact JSON bytes, with orjson when installed and pydantic-core's encoder otherwise."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            # e.g. non-str keys or pydantic objects, which pydantic-core handles
+            pass
+    return to_json(data)
+
+def loads(body: Union[bytes, str]) -> Any:
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+class JSONPayload:
+    """
+    A JSON document kept as its encoded bytes, which is what responses and
+    caches need; the decoded objects are only built if something asks for
+    them, and then kept.
+    """
+
+    __slots__ = ("body", "_data")
+
+    def __init__(self, body: bytes, data: Optional[Any] = None):
+        self.body = body
+        self._data = data
+
+    @classmethod
+    def from_data(cls, data: Any) -> "JSONPayload":
+        return cls(dumps(data), data)
+
+    def data(self) -> Any:
+        if self._data is None:
+            self._data = loads(self.body)
+        return self._data
+
+def validated_plan_payload(meal_plan: Any) -> JSONPayload:
+    """Validate a plan against MealPlanResponse once and serialize the result straight to bytes."""
+    return JSONPayload(PLAN_ADAPTER.dump_json(PLAN_ADAPTER.validate_python(meal_plan)))
+
+def json_response(payload: Union[JSONPayload, Any], status_code: int = 200) -> Response:
+    """
+    Send a payload's bytes as they are. Returning a Response skips FastAPI's
+    response_model validation and jsonable_encoder pass, so keep
+    response_model on the route for the schema only.
+    """
+    body = payload.body if isinstance(payload, JSONPayload) else dumps(payload)
+    return Response(content=body, status_code=status_code, media_type="application/json")
+
+def event_line(event: Any) -> bytes:
+    """One NDJSON line."""
+    return dumps(event) + b"\n"
+
+def plan_event_line(payload: JSONPayload, **extra: Any) -> bytes:
+    """The NDJSON ``{"type": "plan", "plan": ..., **extra}`` line, with the plan's bytes spliced in unparsed."""
+    fields = b"," + dumps(extra)[1:-1] if extra else b""
+    return b'{"type":"plan","plan":' + payload.body + fields + b"}\n"
+
+def batch_response_body(outcomes: Iterable[Tuple[int, Union[JSONPayload, str]]], unique_profiles: int) -> bytes:
+    """
+    A BatchMealPlanResponse document from per-profile plans (spliced in as
+    they are) or error messages, without decoding any of the plans.
+    """
+    results = []
+    for index, outcome in outcomes:
+        if isinstance(outcome, JSONPayload):
+            results.append(b'{"index":%d,"status":"ok","plan":%s,"error":null}' % (index, outcome.body))
+        else:
+            results.append(dumps({"index": index, "status": "error", "plan": None, "error": outcome}))
+    return b'{"results":[' + b",".join(results) + b'],"unique_profiles":%d}' % unique_profiles
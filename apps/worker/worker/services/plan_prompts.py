@@ -0,0 +1,134 @@
+from functools import lru_cache
+from worker.services.prompts import PromptTemplate
+
+_MEAL_JSON = '{"name": "Breakfast: [meal name]", "kcal": 450, "protein_g": 25.5, "carbs_g": 35.2, "fat_g": 18.3, "ingredients": [{"item": "ingredient name", "qty": "amount"}], "steps": ["Step 1", "Step 2"]}'
+# Without kcal and macros, for LOCAL_MACROS: the worker computes them from the ingredients
+_MEAL_JSON_NO_MACROS = '{"name": "Breakfast: [meal name]", "ingredients": [{"item": "ingredient name", "qty": "amount in g, ml, cups, spoons or pieces"}], "steps": ["Step 1", "Step 2"]}'
+
+_QUANTITIES_RULE = 'Give every ingredient a measurable quantity (g, ml, cups, spoons or pieces); grains, pasta and legumes by dry weight unless the quantity says "cooked"'
+
+_MEAL_TIMING = """
+MEAL TIMING:
+- BREAKFAST: Light, morning-appropriate meals (eggs, oatmeal, smoothies, toast, yogurt, fruit, pancakes, cereal); NEVER heavy dinner foods like beef quesadillas, pasta, or roasted meats
+- LUNCH: Midday meals (salads, sandwiches, soups, light proteins, wraps, bowls), lighter than dinner but more substantial than breakfast
+- DINNER: Hearty evening meals (roasted meats, pasta, substantial dishes, casseroles, stir-fries), the most satisfying meal of the day
+- SNACKS: Light, portable options (nuts, fruit, yogurt, energy balls, smoothies), not full meals
+"""
+
+_PROTEIN_POWDER = """
+PROTEIN POWDER (only when the request asks for it):
+- Mix into smoothies, yogurt, oatmeal, or create protein-rich recipes (protein pancakes, energy balls)
+- Use 1 scoop (25-30g) of protein powder per meal when included
+- Use a powder appropriate for the diet type (whey, plant-based, etc.)
+"""
+
+_PROFILE = """
+Profile:
+- {age}-year-old {sex}, {weight_kg}kg, {height_cm}cm
+- Goal: {goal} weight
+- Diet type: {diet_type}
+- Cooking effort: {cooking_effort}
+- Target calories: {calorie_target} per day
+- Meals per day: EXACTLY {meals_per_day}, in this order: {slots}
+- Allergies (never use): {allergies}
+- Dislikes (avoid): {dislikes}
+- Protein powder: {protein_powder}
+"""
+
+@lru_cache(maxsize=4)
+def week_plan_prompt(local_groceries: bool, local_macros: bool = False) -> PromptTemplate:
+    """
+    The whole-week prompt; everything but the profile lives in the cacheable
+    prefix. With ``local_macros`` the model is not asked for kcal, macros or
+    totals, which the worker computes from the ingredients.
+    """
+    meal_json = _MEAL_JSON_NO_MACROS if local_macros else _MEAL_JSON
+    nutrition_rule = _QUANTITIES_RULE if local_macros else "Each meal must include detailed nutritional information (calories, protein, carbs, fat)"
+    totals_json = "" if local_macros else """,
+  "totals": {"kcal": 2100, "protein_g": 120.5, "carbs_g": 180.2, "fat_g": 85.3}"""
+    final_check = (
+        "Size the portions so every day's calories are close to the target."
+        if local_macros else "Ensure all nutritional values are realistic and the total daily calories are close to the target."
+    )
+    groceries_rule = "" if local_groceries else "\n9. Include a comprehensive grocery list organized by category"
+    groceries_json = "" if local_groceries else """,
+  "groceries": [
+    {"category": "Produce", "items": ["item 1", "item 2"]},
+    {"category": "Dairy", "items": ["item 1", "item 2"]}
+  ]"""
+    return PromptTemplate(
+        "week_plan",
+        [
+            ("role", """
+You are a professional nutritionist and meal planning expert. Create detailed, personalized 7-day meal plans that are nutritionally balanced and practical to prepare.
+🚨 CRITICAL: Every day MUST have EXACTLY the number of meals given as "Meals per day" in the request. This is NON-NEGOTIABLE. Count your meals before responding.
+"""),
+            ("requirements", f"""
+🚨 ABSOLUTE REQUIREMENTS (FAILURE TO FOLLOW WILL RESULT IN REJECTION):
+1. 🚨 EXACTLY "Meals per day" meals for ALL 7 days, in the order given - NO EXCEPTIONS
+2. 🚨 Each meal must be appropriate for its designated time (see MEAL TIMING)
+3. {nutrition_rule}
+4. Provide complete ingredient lists with quantities
+5. Include step-by-step cooking instructions
+6. Ensure meals are appropriate for the diet type and avoid every listed allergen
+7. Stay within ±10% of the calorie target
+8. Make meals practical for the requested cooking effort{groceries_rule}
+"""),
+            ("meal_timing", _MEAL_TIMING),
+            ("protein_powder", _PROTEIN_POWDER),
+            ("json_structure", f"""
+🚨 JSON STRUCTURE - FOLLOW EXACTLY. Each day's "meals" array holds one object per meal slot, in order:
+{{
+  "plan": [
+    {{"day": 1, "meals": [{meal_json}, ...]}}
+  ]{totals_json}{groceries_json}
+}}
+"""),
+            ("final_check", f"""
+{final_check}
+🚨 CRITICAL FINAL CHECK: Count your meals - every day of all 7 days needs EXACTLY "Meals per day" meals. If not, STOP and regenerate with the correct count.
+"""),
+        ],
+        f"""
+Create a detailed 7-day meal plan.
+{_PROFILE}
+🚨 EXACTLY {{meals_per_day}} meals per day for all 7 days: {{slots}}.
+""",
+    )
+
+@lru_cache(maxsize=4)
+def day_group_prompt(local_groceries: bool, local_macros: bool = False) -> PromptTemplate:
+    """Prompt for a few days of the week, generated concurrently with the other days."""
+    meal_json = _MEAL_JSON_NO_MACROS if local_macros else _MEAL_JSON
+    meal_rule = (
+        f'name, ingredients [{{"item", "qty"}}], steps\n- {_QUANTITIES_RULE}'
+        if local_macros else 'name, kcal, protein_g, carbs_g, fat_g, ingredients [{"item", "qty"}] with quantities, steps'
+    )
+    groceries_rule = "" if local_groceries else "\n- A grocery list for these days, grouped by category"
+    groceries_json = "" if local_groceries else ', "groceries": [{"category": "Produce", "items": ["..."]}]'
+    return PromptTemplate(
+        "day_group",
+        [
+            ("role", """
+You are a professional nutritionist and meal planning expert. You create some days of a 7-day meal plan; the other days are generated separately, so follow your days' themes from the week overview so the week does not repeat.
+CRITICAL: You MUST generate EXACTLY "Meals per day" meals per day. Respond with JSON only.
+"""),
+            ("requirements", f"""
+Requirements:
+- EXACTLY "Meals per day" meals per day, in the order given
+- Each meal: {meal_rule}
+- Stay within ±10% of the target calories
+- Never use the allergies; avoid the dislikes{groceries_rule}
+"""),
+            ("json_structure", f"""
+Return JSON only:
+{{"plan": [{{"day": 1, "meals": [{meal_json}]}}]{groceries_json}}}
+"""),
+        ],
+        f"""
+Create days {{days}} of a 7-day meal plan.
+{_PROFILE}
+Week overview:
+{{week_overview}}
+""",
+    )
@@ -0,0 +1,63 @@
+import logging
+import math
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")  # gpt-4o
+except Exception:  # not installed, or the encoding could not be downloaded
+    _ENCODING = None
+
+def count_tokens(text: str) -> int:
+    """Input tokens of ``text``: exact with tiktoken installed, otherwise about one per 4 characters."""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return math.ceil(len(text) / 4)
+
+class PromptSection(NamedTuple):
+    name: str
+    text: str
+    tokens: int
+
+class PromptTemplate:
+    """
+    A prompt compiled once: static instructions joined into a byte-identical
+    system prefix, which upstream prefix caching can reuse across requests,
+    plus a compact ``str.format`` suffix for the per-request values, sent as
+    the user message.
+    """
+
+    def __init__(self, name: str, sections: List[Tuple[str, str]], suffix: str):
+        self.name = name
+        self.sections = [PromptSection(title, text.strip(), count_tokens(text.strip())) for title, text in sections]
+        self.prefix = "\n\n".join(section.text for section in self.sections)
+        self.prefix_tokens = count_tokens(self.prefix)
+        self.suffix = suffix.strip()
+        logger.info(f"Compiled prompt '{name}': {self.prefix_tokens} prefix tokens ({self.describe_sections()})")
+
+    def describe_sections(self) -> str:
+        return ", ".join(f"{section.name} {section.tokens}" for section in self.sections)
+
+    def render(self, **values: Any) -> str:
+        """The per-request suffix."""
+        return self.suffix.format(**values)
+
+    def messages(self, **values: Any) -> List[Dict[str, str]]:
+        """System prefix plus the rendered suffix, ready for a chat completion."""
+        return [
+            {"role": "system", "content": self.prefix},
+            {"role": "user", "content": self.render(**values)},
+        ]
+
+    def token_report(self, suffix: str = "") -> Dict[str, Any]:
+        """Input tokens per section, for the prefix and, given a rendered suffix, the whole request."""
+        suffix_tokens = count_tokens(suffix) if suffix else 0
+        return {
+            "sections": {section.name: section.tokens for section in self.sections},
+            "prefix": self.prefix_tokens,
+            "suffix": suffix_tokens,
+            "total": self.prefix_tokens + suffix_tokens,
+            "exact": _ENCODING is not None,
+        }
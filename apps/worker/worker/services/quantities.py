@@ -0,0 +1,117 @@
+import math
+import re
+from functools import lru_cache
+from typing import Dict, NamedTuple, Optional
+
+# Factors to the base units: grams for mass, millilitres for volume
+MASS_UNITS = {
+    "g": 1.0, "gram": 1.0, "gramme": 1.0, "kg": 1000.0, "kilo": 1000.0, "kilogram": 1000.0,
+    "mg": 0.001, "milligram": 0.001, "oz": 28.3495, "ounce": 28.3495, "lb": 453.592, "pound": 453.592,
+}
+VOLUME_UNITS = {
+    "ml": 1.0, "millilitre": 1.0, "milliliter": 1.0, "cl": 10.0, "dl": 100.0,
+    "l": 1000.0, "litre": 1000.0, "liter": 1000.0,
+    "tsp": 4.92892, "teaspoon": 4.92892, "tbsp": 14.7868, "tablespoon": 14.7868, "tbs": 14.7868,
+    "cup": 240.0, "fl oz": 29.5735, "fluid ounce": 29.5735, "pint": 473.176, "quart": 946.353,
+}
+# Words that only describe a whole item ("2 large eggs", "1 medium onion")
+COUNT_WORDS = {"piece", "whole", "large", "medium", "small", "x"}
+# Units kept as they are, since their weight depends on the ingredient
+NAMED_UNITS = {
+    "clove", "slice", "can", "tin", "jar", "scoop", "serving", "pinch", "dash", "handful", "bunch",
+    "sprig", "stalk", "head", "fillet", "leaf", "packet", "pack", "bag", "block", "sheet", "stick",
+}
+_PLURALS = {"pinches": "pinch", "dashes": "dash", "bunches": "bunch", "leaves": "leaf"}
+_SINGULARS = {singular: plural for plural, singular in _PLURALS.items()}
+# Order of units in a formatted amount; named units come last
+_UNIT_ORDER = {"g": 0, "ml": 1, "": 2}
+
+_VULGAR_FRACTIONS = {"½": " 1/2", "⅓": " 1/3", "⅔": " 2/3", "¼": " 1/4", "¾": " 3/4", "⅛": " 1/8", "⅕": " 1/5"}
+_NUMBER = r"(?:\d+\s+\d+/\d+|\d+/\d+|\d+(?:[.,]\d+)?)"
+_QUANTITY = re.compile(rf"^(?P<amount>{_NUMBER}|an?\b)(?:\s*(?:-|–|to)\s*(?P<upper>{_NUMBER}))?\s*(?P<unit>fl\.?\s*oz\b|[a-z]+\.?)?")
+_PARENTHESES = re.compile(r"\(([^)]*)\)")
+
+class Quantity(NamedTuple):
+    amount: float
+    unit: str  # "g", "ml", "" for a plain count, or a named unit such as "clove"
+
+def _number(text: str) -> float:
+    if text in ("a", "an"):
+        return 1.0
+    total = 0.0
+    for part in text.replace(",", ".").split():
+        numerator, _, denominator = part.partition("/")
+        total += float(numerator) / float(denominator) if denominator else float(numerator)
+    return total
+
+def _unit(word: str) -> Optional[str]:
+    word = re.sub(r"\s+", " ", word.rstrip(".").replace(".", ""))
+    for candidate in (word, _PLURALS.get(word, ""), word[:-1] if word.endswith("s") else ""):
+        if candidate in MASS_UNITS or candidate in VOLUME_UNITS or candidate in NAMED_UNITS:
+            return candidate
+        if candidate in COUNT_WORDS:
+            return ""
+    return None
+
+def _parse(text: str) -> Optional[Quantity]:
+    match = _QUANTITY.match(text)
+    if not match:
+        # A bare named unit ("pinch", "handful") is one of it
+        unit = _unit(text)
+        return Quantity(1.0, unit) if unit in NAMED_UNITS else None
+    try:
+        # For shopping, a range means the larger amount
+        amount = _number(match.group("upper") or match.group("amount"))
+    except (ValueError, ZeroDivisionError):
+        return None
+    # An unknown word is the ingredient itself ("2 eggs"): a plain count
+    unit = _unit(match.group("unit") or "") or ""
+    if unit in MASS_UNITS:
+        return Quantity(amount * MASS_UNITS[unit], "g")
+    if unit in VOLUME_UNITS:
+        return Quantity(amount * VOLUME_UNITS[unit], "ml")
+    return Quantity(amount, unit)
+
+@lru_cache(maxsize=4096)
+def parse_quantity(text: str) -> Optional[Quantity]:
+    """
+    Parse a free-text ``qty`` into grams, millilitres, a plain count or a
+    named unit: "150g", "1 1/2 cups", "½ tbsp", "2-3 cloves" (the upper
+    bound), "1 scoop (30g)" (the metric amount in parentheses wins over a
+    named unit). Returns None for "to taste" and other amounts without a
+    number. Memoized, since plans repeat the same strings.
+    """
+    text = str(text).strip().lower()
+    for fraction, replacement in _VULGAR_FRACTIONS.items():
+        text = text.replace(fraction, replacement)
+    quantity = _parse(_PARENTHESES.sub(" ", text).strip())
+    if quantity is None or quantity.unit not in ("g", "ml"):
+        for inner in _PARENTHESES.findall(text):
+            metric = _parse(inner.strip())
+            if metric and metric.unit in ("g", "ml"):
+                return metric
+    return quantity
+
+def add_quantity(totals: Dict[str, float], quantity: Quantity, density: Optional[float] = None) -> None:
+    """Add to per-unit totals, converting millilitres to grams when the ingredient's density is known."""
+    amount, unit = quantity
+    if unit == "ml" and density:
+        amount, unit = amount * density, "g"
+    totals[unit] = totals.get(unit, 0.0) + amount
+
+def _amount(value: float) -> str:
+    return f"{round(value, 1) if value < 10 else round(value):g}"
+
+def format_quantities(totals: Dict[str, float]) -> str:
+    """Shopping amount for per-unit totals: "1.2 kg", "450 ml + 2 cans", "3"."""
+    parts = []
+    for unit, value in sorted(totals.items(), key=lambda item: (_UNIT_ORDER.get(item[0], 3), item[0])):
+        if unit == "g":
+            parts.append(f"{_amount(value / 1000)} kg" if value >= 1000 else f"{_amount(value)} g")
+        elif unit == "ml":
+            parts.append(f"{_amount(value / 1000)} l" if value >= 1000 else f"{_amount(value)} ml")
+        elif unit == "":
+            parts.append(_amount(math.ceil(value * 10) / 10))
+        else:
+            parts.append(f"{_amount(value)} {unit if value == 1 else _SINGULARS.get(unit, unit + 's')}")
+    return " + ".join(parts)
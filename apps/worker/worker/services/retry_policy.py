@@ -0,0 +1,222 @@
+import asyncio
+import json
+import logging
+import random
+from time import monotonic
+from typing import Any, Awaitable, Callable, Dict, Optional
+import openai
+import pydantic
+from worker.services.json_stream import JSONRepairError
+from worker.services.plan_defects import PlanValidationError
+
+logger = logging.getLogger(__name__)
+
+# Upstream statuses worth retrying; everything else in 4xx is the caller's fault
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+# Upper bound on a server-provided Retry-After we are willing to honour
+MAX_RETRY_AFTER_SECONDS = 30.0
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """Raised when a request's overall deadline has passed."""
+
+class RetryBudgetExhausted(RuntimeError):
+    """Raised when a retry was needed but the process-wide retry budget is empty."""
+
+class Deadline:
+    """Absolute end time for one request, shared by every attempt and upstream call."""
+
+    def __init__(self, seconds: float):
+        self.expires_at = monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, cap: Optional[float] = None) -> float:
+        """Timeout for the next upstream call: the time left, optionally capped."""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("Request deadline exceeded")
+        return min(remaining, cap) if cap else remaining
+
+def upstream_timeout(deadline: Optional[Deadline], cap: Optional[float] = None) -> Dict[str, Any]:
+    """Extra kwargs for an OpenAI call so it never outlives the request deadline."""
+    return {"timeout": deadline.timeout(cap)} if deadline else {}
+
+def is_retryable(exc: Optional[BaseException]) -> bool:
+    """
+    Classify a failure. Timeouts, connection errors, 408/409/429 and 5xx are
+    transient; other 4xx (auth, bad request, exhausted quota) are not.
+    Malformed or invalid model output is worth another attempt. Wrapped
+    exceptions are classified by their cause.
+    """
+    while exc is not None:
+        if isinstance(exc, (DeadlineExceeded, RetryBudgetExhausted)):
+            return False
+        if isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError)):
+            return True
+        if isinstance(exc, openai.APIStatusError):
+            if getattr(exc, "code", None) == "insufficient_quota":
+                return False
+            return exc.status_code in RETRYABLE_STATUS_CODES or exc.status_code >= 500
+        exc = exc.__cause__
+    return True
+
+# Plan defects that mean the model returned the wrong number of days or meals
+MEAL_COUNT_DEFECTS = {"meal_count", "missing_day", "extra_day", "extra_meals"}
+
+def retry_cause(exc: Optional[BaseException]) -> str:
+    """
+    Why an attempt failed, for retry metrics: meal_count, parse, validation,
+    timeout, rate_limit, upstream or other. Wrapped exceptions are classified
+    by their cause.
+    """
+    while exc is not None:
+        if isinstance(exc, PlanValidationError):
+            if any(defect.kind in MEAL_COUNT_DEFECTS for defect in exc.defects):
+                return "meal_count"
+            return "validation"
+        if isinstance(exc, (JSONRepairError, json.JSONDecodeError)):
+            return "parse"
+        if isinstance(exc, pydantic.ValidationError):
+            return "validation"
+        if isinstance(exc, (asyncio.TimeoutError, openai.APITimeoutError)):
+            return "timeout"
+        if isinstance(exc, openai.RateLimitError):
+            return "rate_limit"
+        if isinstance(exc, openai.APIError):
+            return "upstream"
+        exc = exc.__cause__
+    return "other"
+
+def retry_after_seconds(exc: Optional[BaseException]) -> Optional[float]:
+    """Delay requested by the upstream via a Retry-After header, if any."""
+    while exc is not None:
+        response = getattr(exc, "response", None)
+        headers = getattr(response, "headers", None)
+        if headers is not None:
+            try:
+                return min(float(headers.get("retry-after", "")), MAX_RETRY_AFTER_SECONDS)
+            except ValueError:
+                return None
+        exc = exc.__cause__
+    return None
+
+class RetryBudget:
+    """
+    Process-wide token bucket that keeps retries to a fraction of traffic.
+
+    Every request deposits ``ratio`` tokens and every retry spends one, so
+    under sustained failure retries add at most ``ratio`` extra upstream load.
+    ``min_per_second`` keeps a trickle of retries available at low traffic,
+    and the balance never exceeds ``burst``.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, burst: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.burst = burst
+        self._balance = burst
+        self._updated_at = monotonic()
+        self._stats = {"requests": 0, "retries": 0, "rejected": 0}
+
+    def _refill(self) -> None:
+        now = monotonic()
+        self._balance = min(self.burst, self._balance + (now - self._updated_at) * self.min_per_second)
+        self._updated_at = now
+
+    def record_request(self) -> None:
+        self._refill()
+        self._balance = min(self.burst, self._balance + self.ratio)
+        self._stats["requests"] += 1
+
+    def try_spend(self) -> bool:
+        self._refill()
+        if self._balance < 1:
+            self._stats["rejected"] += 1
+            return False
+        self._balance -= 1
+        self._stats["retries"] += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        self._refill()
+        return {**self._stats, "balance": round(self._balance, 2)}
+
+class RetryPolicy:
+    """
+    Runs an operation with exponential backoff and full jitter, bounded by an
+    overall per-request deadline and the shared RetryBudget.
+
+    The operation receives the request's Deadline so it can cap each upstream
+    call's timeout at the time left. Non-retryable errors, an expired deadline
+    and an empty budget stop immediately; the last error is raised.
+    ``on_retry`` is called with each error that is about to be retried.
+    """
+
+    def __init__(
+        self,
+        budget: RetryBudget,
+        max_attempts: int = 5,
+        deadline_seconds: float = 120.0,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        classify: Callable[[BaseException], bool] = is_retryable,
+        on_retry: Optional[Callable[[BaseException], None]] = None,
+    ):
+        self.budget = budget
+        self.max_attempts = max_attempts
+        self.deadline_seconds = deadline_seconds
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.classify = classify
+        self.on_retry = on_retry
+        self._stats = {"deadline_exceeded": 0, "non_retryable": 0}
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter delay before attempt ``attempt + 1``."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    async def run(self, operation: Callable[[Deadline], Awaitable[Any]], deadline: Optional[Deadline] = None) -> Any:
+        deadline = deadline or Deadline(self.deadline_seconds)
+        self.budget.record_request()
+
+        error: Exception
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return await asyncio.wait_for(operation(deadline), timeout=deadline.timeout())
+            except asyncio.TimeoutError as e:
+                if not deadline.expired:
+                    error = e
+                else:
+                    self._stats["deadline_exceeded"] += 1
+                    raise DeadlineExceeded(f"Request deadline of {self.deadline_seconds:.0f}s exceeded after {attempt} attempts") from e
+            except Exception as e:
+                error = e
+
+            logger.warning(f"Attempt {attempt} failed: {error}")
+            if not self.classify(error):
+                self._stats["non_retryable"] += 1
+                raise error
+            if attempt == self.max_attempts:
+                raise error
+
+            delay = retry_after_seconds(error)
+            if delay is None:
+                delay = self.backoff(attempt)
+            if delay >= deadline.remaining():
+                self._stats["deadline_exceeded"] += 1
+                raise DeadlineExceeded(f"No time left to retry after {attempt} attempts") from error
+            if not self.budget.try_spend():
+                logger.warning("Retry budget exhausted; not retrying")
+                raise RetryBudgetExhausted(f"Retry budget exhausted after {attempt} attempts: {error}") from error
+            if self.on_retry is not None:
+                self.on_retry(error)
+
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "budget": self.budget.stats()}
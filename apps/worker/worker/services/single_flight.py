@@ -0,0 +1,50 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+def flight_key(cache_key: str, idempotency_key: Optional[str] = None, regenerate: bool = False) -> str:
+    """
+    Key under which concurrent generations are coalesced: the normalized
+    profile plus the caller's idempotency scope. Regenerate requests never
+    join a normal in-flight generation (and vice versa).
+    """
+    scope = (idempotency_key or "").strip() or "-"
+    return f"{scope}|{'regen' if regenerate else 'plan'}|{cache_key}"
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key onto one running task.
+
+    The first caller starts the work; callers arriving while it runs await the
+    same task and receive the same result (or exception). The task is shielded,
+    so a caller that disconnects does not cancel the work for the others.
+    Results are shared objects and must be treated as read-only.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._stats = {"leaders": 0, "coalesced": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+            self._stats["leaders"] += 1
+        else:
+            self._stats["coalesced"] += 1
+            logger.info("Joining in-flight generation for identical request")
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved even if every waiter went away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {**self._stats, "inflight": len(self._inflight)}